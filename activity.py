@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+
+class ActivityTracker:
+    """Time of the last processed prompt, kept in memory and stored in MemoryDB.
+
+    ``touch()`` only updates the in-memory value and starts a background
+    write to the ``bot_state`` table, so the pipeline never waits on I/O;
+    touches that arrive while a write is in flight are folded into one more
+    write. ``load()`` reads the stored value once at startup, falling back to
+    the old ``last_activity.txt`` file so an upgrade keeps its timer.
+    """
+
+    def __init__(self, memory_db, key="last_activity", legacy_file=None):
+        self.memory_db = memory_db
+        self.key = key
+        self.legacy_file = legacy_file
+        self.last = None
+        self._dirty = False
+        self._task = None
+
+    async def load(self):
+        value = await self.memory_db.get_state(self.key)
+        if value is None and self.legacy_file and os.path.exists(self.legacy_file):
+            value = await asyncio.to_thread(read_text, self.legacy_file)
+            if value:
+                await self.memory_db.set_state(self.key, value)
+        try:
+            self.last = datetime.fromisoformat(value) if value else None
+        except ValueError:
+            self.last = None
+
+    def touch(self):
+        self.last = datetime.now()
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self.memory_db.set_state(self.key, self.last.isoformat())
+            except Exception as e:
+                logging.error(f"Failed to store last activity: {e}")
+
+    async def flush(self):
+        """Wait for any pending write (called on shutdown)"""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def idle_seconds(self):
+        """Seconds since the last activity, or None if there has been none"""
+        if self.last is None:
+            return None
+        return (datetime.now() - self.last).total_seconds()
+
+
+def read_text(path):
+    with open(path) as f:
+        return f.read().strip()
@@ -1,40 +1,65 @@
 # app.py - Stealth Notion AI Bot Web Interface
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
-import threading
-import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
 import logging
 from datetime import datetime
 import main  # your main.py logic
+from metrics import REGISTRY
 
 app = FastAPI(title="System Monitor", docs_url=None, redoc_url=None)
 
-# Global state for monitoring
+# Seconds /stop waits for queued pages to finish before cancelling them
+STOP_TIMEOUT = float(os.getenv("STOP_TIMEOUT", 30))
+
+# Global state for monitoring (processing counters live in main.pipeline_stats)
 bot_status = {
     "running": False,
-    "last_check": None,
-    "total_processed": 0,
     "last_error": None,
     "start_time": None
 }
+bot_task = None
+
+def _bot_finished(task):
+    bot_status["running"] = False
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Bot crashed: {task.exception()}")
+        bot_status["last_error"] = str(task.exception())
 
 def start_bot():
-    """Start the bot in background thread"""
-    global bot_status
+    """Run the bot as a background task on the server's own event loop"""
+    global bot_task
+    if not main.is_configured():
+        bot_status["last_error"] = "Missing required environment variables"
+        logging.error("Missing required environment variables!")
+        return None
     bot_status["running"] = True
     bot_status["start_time"] = datetime.now()
-    
-    def bot_runner():
-        try:
-            main.continuous_polling()
-        except Exception as e:
-            logging.error(f"Bot crashed: {e}")
-            bot_status["last_error"] = str(e)
-            bot_status["running"] = False
-    
-    thread = threading.Thread(target=bot_runner, daemon=True)
-    thread.start()
-    return thread
+    bot_status["last_error"] = None
+    bot_task = asyncio.create_task(main.run_bot())
+    bot_task.add_done_callback(_bot_finished)
+    return bot_task
+
+async def stop_bot():
+    """Stop polling, give queued pages up to STOP_TIMEOUT seconds to finish, then stop the workers.
+
+    Anything cut short is resumed from the job table on the next start.
+    """
+    global bot_task
+    if bot_task is not None:
+        bot_task.cancel()
+        await asyncio.gather(bot_task, return_exceptions=True)
+        bot_task = None
+    try:
+        await asyncio.wait_for(main.prompt_pool.drain(), STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning(f"Stopping with {main.prompt_pool.in_flight()} page(s) still in progress")
+    await main.prompt_pool.stop()
+    bot_status["running"] = False
 
 @app.get("/", response_class=HTMLResponse)
 def read_root():
@@ -81,45 +106,93 @@ def read_root():
 @app.get("/status")
 def get_status():
     """Get bot status (stealth endpoint)"""
-    global bot_status
-    
+    stats = main.pipeline_stats
+    uptime_str = None
+    per_minute = 0.0
     if bot_status["start_time"]:
         uptime = datetime.now() - bot_status["start_time"]
         uptime_str = str(uptime).split('.')[0]  # Remove microseconds
-    else:
-        uptime_str = None
-    
+        if uptime.total_seconds() > 0:
+            per_minute = stats["processed"] / uptime.total_seconds() * 60
+
     return {
         "status": "active" if bot_status["running"] else "inactive",
         "uptime": uptime_str,
-        "last_check": bot_status["last_check"],
-        "total_processed": bot_status["total_processed"],
+        "last_check": stats["last_check"],
+        "last_processed": stats["last_processed"],
+        "total_processed": stats["processed"],
+        "failed": stats["failed"],
+        "polls": stats["polls"],
+        "found": stats["found"],
+        "in_flight": main.prompt_pool.in_flight(),
+        "processed_per_minute": round(per_minute, 2),
+        "last_drain_rate": round(main.prompt_pool.stats["last_drain_rate"], 2),
         "last_error": bot_status["last_error"]
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text-format metrics: stage/MemoryDB/Notion latency histograms, tokens and estimated cost"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/start")
-def start_service():
+async def start_service():
     """Start the service (stealth endpoint)"""
-    global bot_status
     if not bot_status["running"]:
-        start_bot()
+        if start_bot() is None:
+            raise HTTPException(status_code=503, detail=bot_status["last_error"])
         return {"message": "Service started"}
     return {"message": "Service already running"}
 
 @app.post("/stop")
-def stop_service():
+async def stop_service():
     """Stop the service (stealth endpoint)"""
-    global bot_status
-    bot_status["running"] = False
+    if not bot_status["running"]:
+        return {"message": "Service already stopped"}
+    await stop_bot()
     return {"message": "Service stopped"}
 
+def verify_notion_signature(body, signature):
+    """Check Notion's X-Notion-Signature (HMAC-SHA256 of the body keyed by the verification token)"""
+    if not main.NOTION_WEBHOOK_SECRET:
+        return True
+    expected = "sha256=" + hmac.new(main.NOTION_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+@app.post("/webhook/notion", status_code=202)
+async def notion_webhook(request: Request):
+    """Receive Notion change notifications (or relay posts of page IDs) and queue the pages"""
+    body = await request.body()
+    if not verify_notion_signature(body, request.headers.get("X-Notion-Signature")):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if "verification_token" in payload:
+        # One-time handshake when the subscription is created; the token becomes NOTION_WEBHOOK_SECRET
+        logging.info("Notion webhook verification token received")
+        return {"message": "Verification token received"}
+    page_ids = main.page_ids_from_event(payload)
+    if page_ids and bot_status["running"]:
+        # While stopped, the reconciliation sweep after the next start picks these up
+        main.enqueue_page_ids(page_ids, main.database_id_from_event(payload))
+    return {"accepted": len(page_ids)}
+
 # Start the bot automatically when the app starts
 @app.on_event("startup")
 async def startup_event():
+    if main.WEBHOOK_MODE and not main.NOTION_WEBHOOK_SECRET:
+        logging.warning("WEBHOOK_MODE is on without NOTION_WEBHOOK_SECRET: /webhook/notion accepts unsigned requests")
+    await main.init_services()
     start_bot()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_bot()
+    await main.shutdown_services()
+
 if __name__ == "__main__":
     import uvicorn
-    import os
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,149 @@
+import json
+import time
+import uuid
+
+from model_router import AnthropicProvider, Completion, FakeProvider, OpenAIProvider
+
+# Batch states (OpenAI's names; other backends are mapped onto them) after which results can be read
+FINISHED_STATES = ("completed", "failed", "expired", "cancelled")
+CHAT_ENDPOINT = "/v1/chat/completions"
+
+
+class OpenAIBatchBackend:
+    """OpenAI Batch API: requests go up as one JSONL file and come back within the completion window.
+
+    Each request is ``{"custom_id", "model", "messages", "max_tokens",
+    "temperature"}``; ``results`` maps every custom_id that finished to a
+    Completion, or to an exception for requests the batch could not answer.
+    """
+
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    async def submit(self, requests):
+        lines = [
+            json.dumps({
+                "custom_id": r["custom_id"],
+                "method": "POST",
+                "url": CHAT_ENDPOINT,
+                "body": OpenAIProvider.request_params(r["model"], r["messages"], r["max_tokens"], r["temperature"]),
+            })
+            for r in requests
+        ]
+        upload = await self.client.files.create(file=("notion-batch.jsonl", "\n".join(lines).encode()), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=upload.id, endpoint=CHAT_ENDPOINT, completion_window=self.completion_window
+        )
+        return batch.id
+
+    async def status(self, batch_id):
+        """(state, requests finished so far)"""
+        batch = await self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return batch.status, (counts.completed + counts.failed) if counts else 0
+
+    async def results(self, batch_id):
+        batch = await self.client.batches.retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if line.strip():
+                    item = json.loads(line)
+                    results[item["custom_id"]] = parse_openai_result(item)
+        return results
+
+
+def parse_openai_result(item):
+    response = item.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") == 200:
+        usage = body.get("usage") or {}
+        return Completion(body["choices"][0]["message"]["content"], usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    error = item.get("error") or body.get("error") or {}
+    return RuntimeError(error.get("message") or f"Batch request failed with status {response.get('status_code')}")
+
+
+class AnthropicBatchBackend:
+    """Anthropic Message Batches, mapped onto the same submit/status/results interface"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def submit(self, requests):
+        batch = await self.client.messages.batches.create(requests=[
+            {
+                "custom_id": r["custom_id"],
+                "params": AnthropicProvider.request_params(r["model"], r["messages"], r["max_tokens"], r["temperature"]),
+            }
+            for r in requests
+        ])
+        return batch.id
+
+    async def status(self, batch_id):
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        done = counts.succeeded + counts.errored + counts.canceled + counts.expired
+        return ("completed" if batch.processing_status == "ended" else "in_progress"), done
+
+    async def results(self, batch_id):
+        results = {}
+        async for entry in await self.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                message = entry.result.message
+                text = "".join(block.text for block in message.content if getattr(block, "type", None) == "text")
+                results[entry.custom_id] = Completion(text, message.usage.input_tokens, message.usage.output_tokens)
+            else:
+                results[entry.custom_id] = RuntimeError(f"Batch request {entry.result.type}")
+        return results
+
+
+class FakeBatchBackend:
+    """Local stub: a batch finishes ``latency`` seconds after it is submitted, answered by a FakeProvider.
+
+    Batches only live in this process, so one that a restarted run asks
+    about is reported as expired.
+    """
+
+    def __init__(self, provider, latency=1.0):
+        self.provider = provider
+        self.latency = latency
+        self.batches = {}
+
+    async def submit(self, requests):
+        batch_id = f"fakebatch-{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = (time.monotonic(), list(requests))
+        return batch_id
+
+    async def status(self, batch_id):
+        if batch_id not in self.batches:
+            return "expired", 0
+        submitted, requests = self.batches[batch_id]
+        if time.monotonic() - submitted < self.latency:
+            return "in_progress", 0
+        return "completed", len(requests)
+
+    async def results(self, batch_id):
+        results = {}
+        for r in self.batches.get(batch_id, (0, []))[1]:
+            try:
+                results[r["custom_id"]] = Completion(self.provider.reply(r["model"], r["messages"]))
+            except ConnectionError as e:
+                results[r["custom_id"]] = e
+        return results
+
+
+def make_batch_backends(providers, fake_latency=1.0):
+    """Batch backends by provider name, for the providers that have a batch API"""
+    backends = {}
+    for name, provider in providers.items():
+        if isinstance(provider, OpenAIProvider) and provider.client is not None:
+            backends[name] = OpenAIBatchBackend(provider.client)
+        elif isinstance(provider, AnthropicProvider):
+            backends[name] = AnthropicBatchBackend(provider.client)
+        elif isinstance(provider, FakeProvider):
+            backends[name] = FakeBatchBackend(provider, fake_latency)
+    return backends
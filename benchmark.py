@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Scale-out benchmark: N bot instances sharing one claim store drain a backlog.
+Usage: python benchmark.py [--pages 100] [--instances 1,2,4] [--latency 0.2] [--concurrency 2]
+
+Serves the fake Notion API (fake_notion.py) on a local port, then for each
+instance count seeds the backlog and starts that many worker processes. Each
+worker is the normal bot (worker pool mode, own memory database) with a
+stand-in OpenAI client that answers after a fixed latency, and all of them
+share one CLAIMS_DB file. Reports the drain time, speedup over the first
+run and how many pages were answered more than once.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class LatencyOpenAI:
+    """Minimal stand-in for AsyncOpenAI: every completion takes ``latency`` seconds"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=self)
+
+    async def create(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        message = types.SimpleNamespace(content=f"Answer: {messages[-1]['content']}")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+async def run_worker(args):
+    """One bot instance: drain pending pages until the backlog stays empty"""
+    sys.path.insert(0, HERE)
+    import main
+
+    client = LatencyOpenAI(args.latency)
+    main.router.providers["openai"].client = client
+    await main.init_services()
+    print("READY", flush=True)
+    while not os.path.exists("../start"):
+        await asyncio.sleep(0.01)
+    try:
+        idle_polls = 0
+        while idle_polls < 3:
+            pages = await main.get_pending_prompts(full_scan=True)
+            if not pages:
+                idle_polls += 1
+                await asyncio.sleep(0.2)
+                continue
+            idle_polls = 0
+            claimed = main.claim_store.stats["claimed"]
+            await main.process_pages(pages)
+            if main.claim_store.stats["claimed"] == claimed:
+                # Everything left is being answered by other instances
+                await asyncio.sleep(0.2)
+        stats = dict(main.claim_store.stats)
+    finally:
+        await main.shutdown_services()
+    print(json.dumps({"openai_calls": client.calls, "claims": stats}), flush=True)
+
+
+def serve_fake_notion(notion, port):
+    import uvicorn
+    from fake_notion import create_app
+
+    server = uvicorn.Server(uvicorn.Config(create_app(notion), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def run_round(notion, args, instances, workdir):
+    notion.pages.clear()
+    notion.children.clear()
+    page_ids = [notion.add_page(f"Benchmark prompt {i + 1}") for i in range(args.pages)]
+    env = dict(
+        os.environ,
+        NOTION_API_BASE=f"http://127.0.0.1:{args.port}/v1",
+        NOTION_DB_ID=notion.database_id,
+        NOTION_API_KEY="benchmark",
+        OPENAI_API_KEY="benchmark",
+        CLAIMS_DB=os.path.join(workdir, "claims.db"),
+        WORKER_POOL_MODE="1",
+        OPENAI_CONCURRENCY=str(args.concurrency),
+        NOTION_RATE="1000",
+        NOTION_BURST="100",
+        RESPONSE_CACHE="0",
+        FAST_MODE="1",
+    )
+    workers = []
+    for n in range(instances):
+        instance_dir = os.path.join(workdir, f"instance{n}")
+        os.makedirs(instance_dir)
+        workers.append(subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "benchmark.py"), "--worker", "--latency", str(args.latency)],
+            cwd=instance_dir, env=dict(env, WORKER_ID=f"bench-{n}"),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        ))
+    for worker in workers:
+        if worker.stdout.readline().strip() != "READY":
+            raise RuntimeError("benchmark worker failed to start")
+    started = time.monotonic()
+    open(os.path.join(workdir, "start"), "w").close()
+    while any(notion.status(page_id) != "Done" for page_id in page_ids):
+        time.sleep(0.02)
+    elapsed = time.monotonic() - started
+    results = [json.loads(worker.communicate()[0].strip().splitlines()[-1]) for worker in workers]
+    openai_calls = sum(result["openai_calls"] for result in results)
+    return {
+        "instances": instances,
+        "pages": args.pages,
+        "seconds": round(elapsed, 2),
+        "pages_per_second": round(args.pages / elapsed, 2),
+        "openai_calls": openai_calls,
+        "duplicates": openai_calls - args.pages,
+        "per_instance": [result["openai_calls"] for result in results],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scale-out drain benchmark")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--instances", default="1,2,4", help="comma-separated instance counts")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per OpenAI completion")
+    parser.add_argument("--concurrency", type=int, default=2, help="OpenAI workers per instance")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        asyncio.run(run_worker(args))
+        return
+
+    from fake_notion import FakeNotion
+
+    notion = FakeNotion()
+    serve_fake_notion(notion, args.port)
+    rows = []
+    for instances in [int(n) for n in args.instances.split(",")]:
+        with tempfile.TemporaryDirectory() as workdir:
+            rows.append(run_round(notion, args, instances, workdir))
+        row = rows[-1]
+        print(
+            f"{row['instances']} instance(s): {row['pages']} pages in {row['seconds']:.2f}s "
+            f"({row['pages_per_second']:.1f} pages/s, speedup {rows[0]['seconds'] / row['seconds']:.2f}x), "
+            f"duplicates={row['duplicates']}, split={row['per_instance']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
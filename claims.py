@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+
+import aiosqlite
+
+CLAIMS_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS work_claims (
+        page_id TEXT PRIMARY KEY,
+        owner TEXT,
+        state TEXT,
+        expires_at REAL,
+        heartbeat_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_work_claims_owner ON work_claims (owner, state)",
+)
+
+# A claim is taken if nobody holds it, its lease (or done retention) has run
+# out, or this owner already holds it. One statement, so it is atomic even
+# with several processes on the same file.
+CLAIM_SQL = """
+    INSERT INTO work_claims (page_id, owner, state, expires_at, heartbeat_at)
+    VALUES (?, ?, 'active', ?, ?)
+    ON CONFLICT (page_id) DO UPDATE SET
+        owner = excluded.owner, state = 'active',
+        expires_at = excluded.expires_at, heartbeat_at = excluded.heartbeat_at
+    WHERE work_claims.expires_at < ? OR (work_claims.state = 'active' AND work_claims.owner = excluded.owner)
+"""
+
+
+class ClaimStore:
+    """Lease-based work claims shared by every bot instance.
+
+    Claims live in a SQLite file that all instances open (same host or a
+    shared volume with working file locks). An instance claims a page before
+    generating its reply and holds the claim for ``lease`` seconds, renewed
+    by a heartbeat while the page is in progress, so a crashed instance's
+    pages become claimable again once its lease runs out. Finished pages
+    stay claimed for ``done_retention`` seconds so an instance working from
+    a slightly stale poll does not answer them a second time.
+    """
+
+    def __init__(self, path, owner, lease=60.0, done_retention=600.0):
+        self.path = path
+        self.owner = owner
+        self.lease = lease
+        self.done_retention = done_retention
+        self._db = None
+        self._heartbeat_task = None
+        self.stats = {"claimed": 0, "contended": 0, "renewed": 0, "lost": 0}
+
+    async def open(self):
+        if self._db is not None:
+            return
+        db = await aiosqlite.connect(self.path)
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA busy_timeout=5000")
+        for statement in CLAIMS_SCHEMA:
+            await db.execute(statement)
+        await db.commit()
+        self._db = db
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        logging.info(f"Claim store opened at {self.path} as {self.owner} (lease {self.lease:.0f}s)")
+
+    async def close(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        if self._db is not None:
+            db, self._db = self._db, None
+            # Hand unfinished work straight to the other instances
+            await db.execute("DELETE FROM work_claims WHERE owner = ? AND state = 'active'", (self.owner,))
+            await db.commit()
+            await db.close()
+
+    async def claim(self, page_id):
+        """Claim a page for this instance; False if another instance holds it"""
+        now = time.time()
+        cursor = await self._db.execute(CLAIM_SQL, (page_id, self.owner, now + self.lease, now, now))
+        await self._db.commit()
+        if cursor.rowcount == 1:
+            self.stats["claimed"] += 1
+            return True
+        self.stats["contended"] += 1
+        return False
+
+    async def complete(self, page_id):
+        """Mark a claimed page finished; it stays reserved for done_retention seconds"""
+        now = time.time()
+        cursor = await self._db.execute(
+            "UPDATE work_claims SET state = 'done', expires_at = ?, heartbeat_at = ? WHERE page_id = ? AND owner = ?",
+            (now + self.done_retention, now, page_id, self.owner)
+        )
+        await self._db.commit()
+        if cursor.rowcount == 0:
+            # The lease ran out and another instance claimed the page meanwhile
+            self.stats["lost"] += 1
+            logging.warning(f"Claim on page {page_id} was lost before it finished")
+
+    async def release(self, page_id):
+        """Give up a claim without finishing, so another instance may take the page"""
+        await self._db.execute(
+            "DELETE FROM work_claims WHERE page_id = ? AND owner = ? AND state = 'active'", (page_id, self.owner)
+        )
+        await self._db.commit()
+
+    async def renew(self):
+        """Extend the lease on every page this instance is still working on"""
+        now = time.time()
+        cursor = await self._db.execute(
+            "UPDATE work_claims SET expires_at = ?, heartbeat_at = ? WHERE owner = ? AND state = 'active'",
+            (now + self.lease, now, self.owner)
+        )
+        await self._db.commit()
+        self.stats["renewed"] += max(0, cursor.rowcount)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.renew()
+            except Exception as e:
+                logging.error(f"Claim heartbeat failed: {e}")
+
+    def describe(self):
+        return " ".join(f"{key}={value}" for key, value in self.stats.items())
@@ -0,0 +1,192 @@
+import hashlib
+import re
+
+# "// PYTHON CODE BLOCK 1" header and "=====" separator written by format_code_output
+NOTION_HEADER_RE = re.compile(r"//\s+(\S+)\s+CODE BLOCK\b")
+NOTION_SEPARATOR = "=" * 40
+
+# Candidate fences: runs of three or more backticks or tildes. Only these are
+# looked at one by one, by where they sit on their line; the text between
+# them is sliced out whole. Each alternative starts with a literal, which the
+# regex engine searches for much faster than a repeated class.
+FENCE_RUN_RE = re.compile(r"```+|~~~+")
+# Info string allowed after a backtick fence that opens at the end of a prose line
+MID_LINE_INFO_RE = re.compile(r"[\w+#.-]*")
+BLANK_LINES_RE = re.compile(r"\n\s*\n")
+
+
+class IncrementalCodeExtractor:
+    """Split a reply into prose and fenced code blocks in one pass, as chunks arrive.
+
+    Feed chunks in order with ``feed`` (or the whole reply at once);
+    ``text()`` returns the prose seen so far with code blocks removed and
+    runs of blank lines collapsed (what the Response cell shows), and
+    ``blocks`` holds the completed blocks as {'language', 'code'} dicts.
+
+    Fences follow CommonMark: up to three spaces of indent, then three or
+    more backticks or tildes; the language is the first word of the info
+    string, kept as written so tags like ``c++`` or ``objective-c`` survive.
+    A block only ends at a fence of the same character that is at least as
+    long and has no language, so a ```` ```` ```` block can quote ``` ``` ```
+    fences and a ``~~~`` block can hold backtick fences. An unterminated
+    fence runs to the end of the reply. Beyond CommonMark, a backtick fence
+    with at most a one-word language that ends a line of prose (``Here it
+    is: ```python``) also opens a block, as the old regex extraction
+    allowed; the prose before it is kept.
+    With ``notion_format=True`` the ``// LANG CODE BLOCK N`` sections that
+    format_code_output writes to the Code Output property are read instead.
+    """
+
+    def __init__(self, notion_format=False):
+        self.notion_format = notion_format
+        self.blocks = []
+        self._text = []
+        self._code = []
+        self._language = None
+        self._fence = None
+        self._partial = ""
+
+    def feed(self, chunk):
+        data = self._partial + chunk
+        cut = data.rfind("\n") + 1
+        self._partial = data[cut:]
+        if cut:
+            self._scan(data[:cut])
+
+    def _scan(self, text):
+        """Tokenize complete lines: one regex pass finds the fence markers, everything between is sliced"""
+        if self.notion_format:
+            for line in text.splitlines():
+                self._notion_line(line)
+            return
+        pos = 0
+        line_end = -1
+        for match in FENCE_RUN_RE.finditer(text):
+            start = match.start()
+            if start < line_end:
+                continue  # only the first marker on a line can be a fence
+            line_start = text.rfind("\n", 0, start) + 1
+            line_end = text.find("\n", start)
+            if line_end < 0:
+                line_end = len(text)
+            marker, info = match.group(), text[match.end():line_end].strip()
+            prefix = text[line_start:start]
+            at_line_start = len(prefix) <= 3 and not prefix.strip(" ")
+            if self._fence is not None:
+                # Only a bare fence of the same character, at least as long, closes the block
+                if at_line_start and marker[0] == self._fence[0] and len(marker) >= self._fence[1] and not info:
+                    self._code.append(text[pos:line_start])
+                    self._end_block()
+                    pos = line_end
+            elif at_line_start:
+                # A backtick fence's info string may not contain backticks (that is inline code)
+                if not (marker[0] == "`" and "`" in info):
+                    self._text.append(text[pos:line_start])
+                    self._open_block(marker, info)
+                    pos = line_end + 1
+            elif marker[0] == "`" and prefix.strip() and "`" not in prefix and MID_LINE_INFO_RE.fullmatch(info):
+                self._text.append(text[pos:start].rstrip() + "\n")
+                self._open_block(marker, info)
+                pos = line_end + 1
+        (self._code if self._fence is not None else self._text).append(text[pos:])
+
+    def _open_block(self, marker, info):
+        self._fence = (marker[0], len(marker))
+        self._language = info.split()[0].strip("{}.") if info else "text"
+
+    def _end_block(self):
+        self.blocks.append({"language": self._language, "code": "".join(self._code).strip()})
+        self._code = []
+        self._fence = None
+
+    def _notion_line(self, line):
+        header = NOTION_HEADER_RE.match(line) if line.startswith("//") else None
+        if header:
+            if self._fence is not None:
+                self._end_block()
+            self._fence = ("//", 0)
+            self._language = header.group(1).lower()
+        elif line.startswith(NOTION_SEPARATOR) and self._fence is not None:
+            self._end_block()
+        else:
+            (self._code if self._fence is not None else self._text).append(line + "\n")
+
+    def text(self):
+        """Prose so far, including an unfinished last line unless it may be a fence"""
+        text = "".join(self._text)
+        if self._fence is None and self._partial.lstrip()[:1] not in ("`", "~", "/") and "```" not in self._partial:
+            text += self._partial
+        return BLANK_LINES_RE.sub("\n\n", text).strip()
+
+    def close(self):
+        """Flush the last line; an unterminated fence becomes a block of its own"""
+        if self._partial:
+            self._scan(self._partial)
+            self._partial = ""
+        if self._fence is not None:
+            self._end_block()
+        return self.text(), self.blocks
+
+
+def extract_code_blocks(text, notion_format=False):
+    """Return (text without code blocks, [{'language', 'code'}, ...]) in a single pass"""
+    extractor = IncrementalCodeExtractor(notion_format)
+    extractor.feed(text)
+    return extractor.close()
+
+
+def extract_from_stream(chunks, notion_format=False):
+    """Same as extract_code_blocks for an iterable of text chunks"""
+    extractor = IncrementalCodeExtractor(notion_format)
+    for chunk in chunks:
+        extractor.feed(chunk)
+    return extractor.close()
+
+
+# File extension per fence language, for saved and exported blocks
+EXTENSIONS = {
+    "python": "py",
+    "py": "py",
+    "javascript": "js",
+    "js": "js",
+    "typescript": "ts",
+    "ts": "ts",
+    "java": "java",
+    "cpp": "cpp",
+    "c++": "cpp",
+    "c#": "cs",
+    "csharp": "cs",
+    "c": "c",
+    "html": "html",
+    "css": "css",
+    "json": "json",
+    "xml": "xml",
+    "yaml": "yaml",
+    "yml": "yml",
+    "bash": "sh",
+    "shell": "sh",
+    "sh": "sh",
+    "sql": "sql",
+    "php": "php",
+    "ruby": "rb",
+    "go": "go",
+    "rust": "rs",
+    "swift": "swift",
+    "kotlin": "kt",
+    "scala": "scala",
+}
+
+
+def get_extension(language):
+    """File extension for a block's language ("txt" if unknown)"""
+    return EXTENSIONS.get(language.lower(), "txt")
+
+
+def code_hash(code):
+    """Content address of a block (the sha256 the memory database's code tables and exports use)"""
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def export_filename(digest, language):
+    """File name for an exported block: the start of its content hash plus the language's extension"""
+    return f"{digest[:16]}.{get_extension(language)}"
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: the real bot against local Notion and OpenAI stand-ins.
+Usage: python e2e_benchmark.py [--pages 50,200] [--openai-latency 0.5] [--notion-rate-limit 3]
+                               [--env KEY=VALUE ...] [--batch] [--output results.json] [--compare old.json]
+
+Serves fake_notion.py and fake_openai.py on local ports (each with its own
+latency, error rate and rate limit), seeds a synthetic backlog and runs
+``python main.py`` unchanged in a fresh directory with FAST_MODE=1, pointed
+at the stand-ins through NOTION_API_BASE and OPENAI_BASE_URL. Once every page
+is Done the bot is stopped with SIGINT. For each backlog size it reports
+prompts/sec, p50/p99 end-to-end latency (page added, or bot's first request
+if later, until Status is Done), Notion and OpenAI requests per prompt and
+memory database growth per prompt, and writes all runs to a JSON file.
+With ``--batch`` the backlog is answered by ``python main.py batch`` instead,
+through the stand-in's Batch API, and the run ends when that command exits.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MEMORY_DB_FILE = "notion_bot_memory.db"
+
+# Bot settings that would point a run at real services or shared state
+ISOLATED_ENV = ("TENANTS_FILE", "CLAIMS_DB", "WEBHOOK_MODE", "OPENAI_BASE_URL", "NOTION_API_BASE")
+
+PROMPT_TOPICS = [
+    "binary search", "HTTP caching", "Python generators", "SQL joins", "rate limiting",
+    "async IO", "hash tables", "TLS handshakes", "git rebase", "unit testing",
+]
+
+
+def serve(app, port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def file_size(path):
+    """Size of a SQLite database including its WAL file"""
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def empty_db_size(path):
+    """Size of a freshly initialised memory database, the baseline for growth"""
+    sys.path.insert(0, HERE)
+    from memory_db import MemoryDB
+
+    async def init():
+        db = MemoryDB(path)
+        await db.init()
+        await db.close()
+
+    asyncio.run(init())
+    return file_size(path)
+
+
+def seed(notion, count, arrival_rate):
+    """Add the backlog: all at once, or ``arrival_rate`` pages per second from a thread"""
+    prompts = [f"Prompt {i + 1}: explain {PROMPT_TOPICS[i % len(PROMPT_TOPICS)]} with an example" for i in range(count)]
+    if not arrival_rate:
+        for prompt in prompts:
+            notion.add_page(prompt)
+        return None
+
+    def trickle():
+        for prompt in prompts:
+            notion.add_page(prompt)
+            time.sleep(1 / arrival_rate)
+
+    thread = threading.Thread(target=trickle, daemon=True)
+    thread.start()
+    return thread
+
+
+def run_once(notion, openai, args, pages, overrides):
+    notion.reset()
+    openai.requests.clear()
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, MEMORY_DB_FILE)
+        baseline = empty_db_size(db_path)
+        env = {key: value for key, value in os.environ.items() if key not in ISOLATED_ENV}
+        env.update(
+            NOTION_API_BASE=f"http://127.0.0.1:{args.notion_port}/v1",
+            OPENAI_BASE_URL=f"http://127.0.0.1:{args.openai_port}/v1",
+            NOTION_DB_ID=notion.database_id,
+            NOTION_API_KEY="benchmark",
+            OPENAI_API_KEY="benchmark",
+            FAST_MODE="1",
+        )
+        env.update(overrides)
+        seeder = seed(notion, pages, args.arrival_rate)
+        log = open(os.path.join(workdir, "bot.log"), "w")
+        command = [sys.executable, os.path.join(HERE, "main.py")] + (["batch"] if args.batch else [])
+        bot = subprocess.Popen(command, cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + args.timeout
+        try:
+            while time.monotonic() < deadline and bot.poll() is None:
+                timings = notion.timings()
+                if len(timings) == pages and all(done for _, done in timings):
+                    break
+                time.sleep(0.05)
+        finally:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+                bot.wait()
+            log.close()
+        if seeder is not None:
+            seeder.join()
+        if not notion.first_request_at:
+            with open(os.path.join(workdir, "bot.log")) as f:
+                raise RuntimeError(f"bot never contacted Notion:\n{f.read()[-2000:]}")
+        growth = file_size(db_path) - baseline
+
+    started = notion.first_request_at
+    timings = notion.timings()
+    done = [finished for _, finished in timings if finished]
+    latencies = [finished - max(added, started) for added, finished in timings if finished]
+    elapsed = (max(done) - started) if done else None
+    return {
+        "pages": pages,
+        "completed": len(done),
+        "seconds": round(elapsed, 3) if elapsed else None,
+        "prompts_per_second": round(len(done) / elapsed, 3) if elapsed else None,
+        "latency_p50": round(percentile(latencies, 50), 3) if latencies else None,
+        "latency_p99": round(percentile(latencies, 99), 3) if latencies else None,
+        "notion_requests": dict(notion.requests),
+        "openai_requests": dict(openai.requests),
+        "notion_requests_per_prompt": round(notion.requests["total"] / max(1, len(done)), 2),
+        "openai_requests_per_prompt": round(openai.requests["total"] / max(1, len(done)), 2),
+        "memory_db_growth_bytes": growth,
+        "memory_db_bytes_per_prompt": round(growth / max(1, len(done))),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run):
+    print(
+        f"{run['completed']}/{run['pages']} prompts in {run['seconds']}s "
+        f"({run['prompts_per_second']} prompts/s), latency p50={run['latency_p50']}s p99={run['latency_p99']}s, "
+        f"requests/prompt notion={run['notion_requests_per_prompt']} openai={run['openai_requests_per_prompt']}, "
+        f"memory db +{run['memory_db_bytes_per_prompt']} B/prompt"
+    )
+
+
+COMPARED = ("prompts_per_second", "latency_p50", "latency_p99", "notion_requests_per_prompt",
+            "openai_requests_per_prompt", "memory_db_bytes_per_prompt")
+
+
+def compare(previous, current):
+    """Print each metric's change from a previous results file, matching runs by backlog size"""
+    before = {run["pages"]: run for run in previous["runs"]}
+    print(f"\nCompared with {previous.get('git_commit')} ({previous.get('timestamp')}):")
+    for run in current["runs"]:
+        old = before.get(run["pages"])
+        if old is None:
+            continue
+        changes = []
+        for key in COMPARED:
+            if old.get(key) and run.get(key) is not None:
+                changes.append(f"{key} {old[key]} -> {run[key]} ({(run[key] - old[key]) / old[key]:+.1%})")
+        print(f"- {run['pages']} pages: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end bot benchmark against local stand-ins")
+    parser.add_argument("--pages", default="50", help="comma-separated backlog sizes, one run each")
+    parser.add_argument("--arrival-rate", type=float, default=0.0, help="pages added per second (0 = whole backlog up front)")
+    parser.add_argument("--notion-latency", type=float, default=0.05)
+    parser.add_argument("--notion-error-rate", type=float, default=0.0)
+    parser.add_argument("--notion-rate-limit", type=float, default=3.0, help="Notion requests per second before 429 (0 = unlimited)")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--openai-rpm", type=int, default=0, help="OpenAI requests per minute before 429 (0 = unlimited)")
+    parser.add_argument("--batch", action="store_true", help="run `main.py batch` instead of the polling bot")
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="seconds until a stand-in batch completes")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra bot setting (repeatable)")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for each run")
+    parser.add_argument("--notion-port", type=int, default=8765)
+    parser.add_argument("--openai-port", type=int, default=8767)
+    parser.add_argument("--output", default="e2e_benchmark.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    import fake_notion
+    import fake_openai
+
+    overrides = dict(item.split("=", 1) for item in args.env)
+    notion = fake_notion.FakeNotion(latency=args.notion_latency, error_rate=args.notion_error_rate,
+                                    rate_limit=args.notion_rate_limit)
+    openai = fake_openai.FakeOpenAI(latency=args.openai_latency, error_rate=args.openai_error_rate, rpm=args.openai_rpm,
+                                    batch_latency=args.batch_latency)
+    serve(fake_notion.create_app(notion), args.notion_port)
+    serve(fake_openai.create_app(openai), args.openai_port)
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "runs": [],
+    }
+    for pages in [int(n) for n in args.pages.split(",")]:
+        run = run_once(notion, openai, args, pages, overrides)
+        results["runs"].append(run)
+        print_run(run)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
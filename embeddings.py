@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import re
+
+import numpy as np
+
+
+class HashingEmbedder:
+    """Deterministic, offline embedder based on signed feature hashing.
+
+    Words and word bigrams are hashed into ``dim`` buckets, so similar texts
+    share buckets without any model download or network call. Good enough
+    to rank past prompts by topical overlap, and stable across runs.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _embed_one(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if h >> 63 else -1.0
+        return vec
+
+    async def embed(self, texts):
+        return normalize(np.stack([self._embed_one(t) for t in texts]))
+
+
+class OpenAIEmbedder:
+    """Embedder backed by the OpenAI embeddings endpoint"""
+
+    def __init__(self, client, model="text-embedding-3-small"):
+        self.client = client
+        self.model = model
+        self.name = model
+        self.dim = None
+
+    async def embed(self, texts):
+        res = await self.client.embeddings.create(model=self.model, input=list(texts))
+        vectors = np.array([d.embedding for d in res.data], dtype=np.float32)
+        self.dim = vectors.shape[1]
+        return normalize(vectors)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SemanticIndex:
+    """Vector store for memory entries with batched cosine top-k search.
+
+    Vectors are persisted one row per memory entry in MemoryDB's
+    ``memory_vectors`` table (float32 blobs) and held in memory as a single
+    contiguous float32 matrix that grows by doubling, so a query is one
+    matrix-vector product over every stored entry.
+    """
+
+    def __init__(self, memory_db, embedder):
+        self.memory_db = memory_db
+        self.embedder = embedder
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _append(self, ids, vectors):
+        needed = self._size + len(ids)
+        if self._matrix is None or needed > len(self._matrix):
+            capacity = max(64, needed * 2)
+            matrix = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            new_ids = np.empty(capacity, dtype=np.int64)
+            if self._matrix is not None and self._size:
+                matrix[:self._size] = self._matrix[:self._size]
+                new_ids[:self._size] = self._ids[:self._size]
+            self._matrix, self._ids = matrix, new_ids
+        self._matrix[self._size:needed] = vectors
+        self._ids[self._size:needed] = ids
+        self._size = needed
+
+    async def load(self, backfill_batch=256):
+        """Load the stored vectors for the current embedder into memory,
+        embedding any entries stored before semantic mode was switched on"""
+        self.clear()
+        while True:
+            missing = await self.memory_db.get_entries_without_vector(self.embedder.name, backfill_batch)
+            if not missing:
+                break
+            vectors = (await self.embedder.embed([prompt for _, prompt in missing])).astype(np.float32)
+            await self.memory_db.add_vectors(
+                [(entry_id, self.embedder.name, v.tobytes()) for (entry_id, _), v in zip(missing, vectors)]
+            )
+        rows = await self.memory_db.get_vectors(self.embedder.name)
+        if rows:
+            ids = np.array([r[0] for r in rows], dtype=np.int64)
+            vectors = np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+            self._append(ids, vectors)
+        logging.info(f"Semantic index loaded {self._size} vector(s) ({self.embedder.name})")
+
+    async def add(self, entry_id, text):
+        vector = (await self.embedder.embed([text]))[0].astype(np.float32)
+        await self.memory_db.add_vectors([(entry_id, self.embedder.name, vector.tobytes())])
+        self._append(np.array([entry_id], dtype=np.int64), vector[None, :])
+
+    async def search(self, text, k=5, min_score=0.0):
+        """Return up to k (entry_id, score) pairs, most similar first"""
+        if not self._size or k <= 0:
+            return []
+        query = (await self.embedder.embed([text]))[0]
+        scores = self._matrix[:self._size] @ query
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._ids[i]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+    def discard(self, entry_ids):
+        """Drop the vectors of deleted memory entries"""
+        if not self._size or not len(entry_ids):
+            return
+        keep = ~np.isin(self._ids[:self._size], np.asarray(entry_ids, dtype=np.int64))
+        count = int(keep.sum())
+        self._matrix[:count] = self._matrix[:self._size][keep]
+        self._ids[:count] = self._ids[:self._size][keep]
+        self._size = count
+
+    def clear(self):
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = None
+        self._size = 0
+
+
+def make_embedder(name, openai_client=None, dim=512):
+    """Build the embedder named by the EMBEDDER setting ("hashing" or "openai")"""
+    if name == "openai" and openai_client is not None:
+        return OpenAIEmbedder(openai_client)
+    if name != "hashing":
+        logging.warning(f"Unknown or unavailable embedder '{name}', using hashing embedder")
+    return HashingEmbedder(dim)
@@ -2,106 +2,32 @@
 """
 Utility script to extract code blocks from Notion AI Bot responses.
 Usage: python extract_code.py <response_text_file>
+       python extract_code.py --batch <file or directory>... [--db notion_bot_memory.db] [--output extracted_code]
+
+Batch mode runs without prompts: it walks the given files and directories
+(and/or reads the bot's memory database), extracts in a process pool and
+writes each distinct block once as <sha256 prefix>.<ext>, recorded in
+manifest.json in the output directory. Blocks already exported by an earlier
+run are skipped.
 """
 
+import argparse
+import fnmatch
+import json
+import sqlite3
 import sys
-import re
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_code_blocks(text):
-    """Extract all code blocks from text"""
-    code_block_pattern = r'```(\w+)?\n(.*?)```'
-    matches = re.findall(code_block_pattern, text, re.DOTALL)
-    
-    extracted_blocks = []
-    for language, code in matches:
-        lang = language or 'text'
-        extracted_blocks.append({
-            'language': lang,
-            'code': code.strip(),
-            'filename': f"extracted_code_{len(extracted_blocks) + 1}.{get_extension(lang)}"
-        })
-    
-    return extracted_blocks
+from code_extractor import code_hash, export_filename, extract_code_blocks, get_extension
 
-def extract_from_notion_format(text):
-    """Extract code blocks from Notion's formatted output"""
-    # Handle the format: // LANGUAGE CODE BLOCK N
-    import re
-    
-    blocks = []
-    lines = text.split('\n')
-    current_block = []
-    current_language = 'text'
-    in_code_block = False
-    
-    for line in lines:
-        if line.startswith('// ') and 'CODE BLOCK' in line:
-            # Save previous block if exists
-            if current_block:
-                blocks.append({
-                    'language': current_language,
-                    'code': '\n'.join(current_block).strip(),
-                    'filename': f"extracted_code_{len(blocks) + 1}.{get_extension(current_language)}"
-                })
-            
-            # Start new block
-            current_block = []
-            in_code_block = True
-            # Extract language from line like "// PYTHON CODE BLOCK 1"
-            lang_match = re.search(r'// (\w+) CODE BLOCK', line)
-            if lang_match:
-                current_language = lang_match.group(1).lower()
-        elif line.startswith('=' * 40) and in_code_block:
-            # End of code block
-            if current_block:
-                blocks.append({
-                    'language': current_language,
-                    'code': '\n'.join(current_block).strip(),
-                    'filename': f"extracted_code_{len(blocks) + 1}.{get_extension(current_language)}"
-                })
-            current_block = []
-            in_code_block = False
-        elif in_code_block and line.strip():
-            current_block.append(line)
-    
-    # Handle last block
-    if current_block:
-        blocks.append({
-            'language': current_language,
-            'code': '\n'.join(current_block).strip(),
-            'filename': f"extracted_code_{len(blocks) + 1}.{get_extension(current_language)}"
-        })
-    
-    return blocks
+MANIFEST = 'manifest.json'
 
-def get_extension(language):
-    """Get file extension based on language"""
-    extensions = {
-        'python': 'py',
-        'javascript': 'js',
-        'typescript': 'ts',
-        'java': 'java',
-        'cpp': 'cpp',
-        'c': 'c',
-        'html': 'html',
-        'css': 'css',
-        'json': 'json',
-        'xml': 'xml',
-        'yaml': 'yaml',
-        'yml': 'yml',
-        'bash': 'sh',
-        'shell': 'sh',
-        'sql': 'sql',
-        'php': 'php',
-        'ruby': 'rb',
-        'go': 'go',
-        'rust': 'rs',
-        'swift': 'swift',
-        'kotlin': 'kt',
-        'scala': 'scala'
-    }
-    return extensions.get(language.lower(), 'txt')
+def with_filenames(blocks):
+    """Add the filename each block is saved under"""
+    for i, block in enumerate(blocks, 1):
+        block['filename'] = f"extracted_code_{i}.{get_extension(block['language'])}"
+    return blocks
 
 def save_code_blocks(blocks, output_dir="extracted_code"):
     """Save code blocks to files"""
@@ -118,13 +44,143 @@ def save_code_blocks(blocks, output_dir="extracted_code"):
     
     return saved_files
 
+def extract_all(text):
+    """Markdown fences first, then the Code Output property's "// LANG CODE BLOCK N" format"""
+    _, blocks = extract_code_blocks(text)
+    if not blocks:
+        _, blocks = extract_code_blocks(text, notion_format=True)
+    return blocks
+
+def extract_file(path):
+    """Worker: (path, [(language, code), ...]) for one text file"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        blocks = extract_all(f.read())
+    return path, [(block['language'], block['code']) for block in blocks]
+
+def extract_text(item):
+    """Worker: (source, [(language, code), ...]) for one (source, text) pair"""
+    source, text = item
+    return source, [(block['language'], block['code']) for block in extract_all(text or '')]
+
+def find_files(paths, patterns):
+    """Files given directly, plus files under given directories whose names match a pattern"""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                    yield os.path.join(root, name)
+
+def blocks_from_db(db_path, workers):
+    """(source, language, code) for every code block in the bot's memory database.
+
+    Reads the code_blocks/code_snippets tables when the database has them
+    (no parsing at all); older databases have their stored responses
+    extracted in the process pool instead.
+    """
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        has_table = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'code_snippets'").fetchone()
+        if has_table:
+            rows = db.execute(
+                "SELECT c.memory_id, c.language, s.code FROM code_blocks c JOIN code_snippets s ON s.hash = c.hash "
+                "ORDER BY c.memory_id, c.position"
+            )
+            for memory_id, language, code in rows:
+                yield f"memory:{memory_id}", language, code
+            return
+        rows = [(f"memory:{entry_id}", response) for entry_id, response in db.execute("SELECT id, response FROM memory")]
+    finally:
+        db.close()
+    for source, blocks in run_pool(extract_text, rows, workers):
+        for language, code in blocks:
+            yield source, language, code
+
+def run_pool(fn, items, workers):
+    """Map fn over items in a process pool (in-process for a single worker or a single item)"""
+    if workers <= 1 or len(items) <= 1:
+        yield from map(fn, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(fn, items, chunksize=max(1, len(items) // (workers * 8)))
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    """Write the manifest atomically so an interrupted run never leaves it half written"""
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def export_blocks(blocks, output_dir):
+    """Write (source, language, code) blocks content-addressed; returns (written, skipped, total)"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    written = skipped = total = 0
+    for source, language, code in blocks:
+        total += 1
+        digest = code_hash(code)
+        entry = manifest.get(digest)
+        if entry is None:
+            filename = export_filename(digest, language)
+            path = os.path.join(output_dir, filename)
+            if not os.path.exists(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(code)
+                written += 1
+            else:
+                skipped += 1
+            entry = manifest[digest] = {'file': filename, 'language': language, 'size': len(code.encode()), 'sources': []}
+        else:
+            skipped += 1
+        if source not in entry['sources']:
+            entry['sources'].append(source)
+    save_manifest(output_dir, manifest)
+    return written, skipped, total
+
+def batch_main(args):
+    workers = args.workers or os.cpu_count() or 1
+    patterns = args.pattern.split(',')
+
+    def blocks():
+        files = list(find_files(args.paths, patterns))
+        for path, found in run_pool(extract_file, files, workers):
+            for language, code in found:
+                yield path, language, code
+        if args.db:
+            yield from blocks_from_db(args.db, workers)
+
+    written, skipped, total = export_blocks(blocks(), args.output)
+    print(f"{total} code block(s): {written} written, {skipped} already exported or duplicate -> {args.output}/")
+
 def main():
-    if len(sys.argv) != 2:
+    parser = argparse.ArgumentParser(description="Extract code blocks from bot responses")
+    parser.add_argument('paths', nargs='*', help="response text files, or directories in batch mode")
+    parser.add_argument('--batch', action='store_true', help="non-interactive, content-addressed export")
+    parser.add_argument('--db', help="also export the code stored in this memory database (implies --batch)")
+    parser.add_argument('--output', default='extracted_code')
+    parser.add_argument('--workers', type=int, default=0, help="extraction processes (default: CPU count)")
+    parser.add_argument('--pattern', default='*.txt,*.md', help="file name patterns to read from directories")
+    args = parser.parse_args()
+    if args.batch or args.db:
+        batch_main(args)
+        return
+    if len(args.paths) != 1:
         print("Usage: python extract_code.py <response_text_file>")
         print("Example: python extract_code.py response.txt")
+        print("Batch:   python extract_code.py --batch <file or directory>... [--db notion_bot_memory.db]")
         sys.exit(1)
     
-    input_file = sys.argv[1]
+    input_file = args.paths[0]
     
     if not os.path.exists(input_file):
         print(f"Error: File '{input_file}' not found")
@@ -134,10 +190,7 @@ def main():
         with open(input_file, 'r', encoding='utf-8') as f:
             text = f.read()
         
-        # Try both extraction methods
-        blocks = extract_code_blocks(text)
-        if not blocks:
-            blocks = extract_from_notion_format(text)
+        blocks = with_filenames(extract_all(text))
         
         if not blocks:
             print("No code blocks found in the text.")
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the parts of the Notion API the bot uses.
+Usage: python fake_notion.py [--port 8765] [--pages 50] [--latency 0.0] [--error-rate 0.0] [--rate-limit 0]
+
+Serves /v1/databases/{id}/query, /v1/pages/{id} and /v1/blocks/{id}/children
+from memory, with the same filter, pagination and filter_properties behaviour
+the bot relies on, and counts every request. Requests can be slowed down,
+failed with 500s at a given rate, or answered with 429 + Retry-After above a
+requests-per-second limit, like the real API's average rate cap. Point the bot at it with
+NOTION_API_BASE=http://127.0.0.1:8765/v1, or mount ``create_app()`` in-process
+with ``httpx.ASGITransport``.
+"""
+
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+MAX_PAGE_SIZE = 100
+MAX_CHILDREN_PER_REQUEST = 100
+MAX_RICH_TEXT_CHARS = 2000
+
+# Property name -> property id, as Notion reports them (the title is always "title")
+PROPERTY_IDS = {
+    "Prompt": "title",
+    "Status": "stat",
+    "Response": "resp",
+    "Code Output": "code",
+    "Generated Date": "gend",
+}
+
+
+def notion_now():
+    """Notion rounds last_edited_time down to the minute"""
+    return datetime.now(timezone.utc).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class FakeNotion:
+    """In-memory pages of a single database plus request counters.
+
+    ``latency`` delays every response, ``error_rate`` is the fraction of
+    requests answered with a 500, and ``rate_limit`` (requests per second,
+    0 for none) answers 429 with a Retry-After header once a token bucket of
+    ``burst`` requests runs dry. Each page records when it was added and when
+    its Status first became Done, for end-to-end latency.
+    """
+
+    def __init__(self, database_id="fake-db", latency=0.0, error_rate=0.0, rate_limit=0.0, burst=3, seed=None):
+        self.database_id = database_id
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.pages = {}
+        self.children = {}
+        self.requests = Counter()
+        self.first_request_at = None
+        self._order = itertools.count()
+        self._random = random.Random(seed)
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+
+    def reset(self):
+        self.pages.clear()
+        self.children.clear()
+        self.requests.clear()
+        self.first_request_at = None
+
+    def rate_limited(self):
+        """Seconds to wait if this request is over the rate limit, else None"""
+        if not self.rate_limit:
+            return None
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return None
+        return (1 - self._tokens) / self.rate_limit
+
+    def failed(self):
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def add_page(self, prompt, status="Pending", response="", last_edited_time=None):
+        page_id = str(uuid.uuid4())
+        self.pages[page_id] = {
+            "object": "page",
+            "id": page_id,
+            "_order": next(self._order),
+            "created_time": last_edited_time or notion_now(),
+            "last_edited_time": last_edited_time or notion_now(),
+            "_added_at": time.time(),
+            "_done_at": None,
+            "archived": False,
+            "parent": {"type": "database_id", "database_id": self.database_id},
+            "properties": {
+                "Prompt": {"id": "title", "type": "title", "title": [{"type": "text", "text": {"content": prompt}, "plain_text": prompt}]},
+                "Status": {"id": "stat", "type": "select", "select": {"name": status} if status else None},
+                "Response": {"id": "resp", "type": "rich_text", "rich_text": [{"type": "text", "text": {"content": response}}] if response else []},
+                "Code Output": {"id": "code", "type": "rich_text", "rich_text": []},
+                "Generated Date": {"id": "gend", "type": "date", "date": None},
+            },
+        }
+        return page_id
+
+    def status(self, page_id):
+        select = self.pages[page_id]["properties"]["Status"]["select"]
+        return select["name"] if select else None
+
+    def response_text(self, page_id):
+        return "".join(part["text"]["content"] for part in self.pages[page_id]["properties"]["Response"]["rich_text"])
+
+    def public(self, page, only=None):
+        page = {k: v for k, v in page.items() if not k.startswith("_")}
+        if only:
+            page["properties"] = {
+                name: prop for name, prop in page["properties"].items()
+                if name in only or prop["id"] in only
+            }
+        return page
+
+    def matches(self, page, condition):
+        if "and" in condition:
+            return all(self.matches(page, c) for c in condition["and"])
+        if "or" in condition:
+            return any(self.matches(page, c) for c in condition["or"])
+        if condition.get("timestamp") == "last_edited_time":
+            value = parse_time(page["last_edited_time"])
+            check = condition["last_edited_time"]
+            if "on_or_after" in check:
+                return value >= parse_time(check["on_or_after"])
+            if "after" in check:
+                return value > parse_time(check["after"])
+            if "before" in check:
+                return value < parse_time(check["before"])
+            return True
+        prop = page["properties"].get(condition.get("property"))
+        if prop is None:
+            return False
+        if "select" in condition:
+            name = (prop["select"] or {}).get("name")
+            check = condition["select"]
+            if "equals" in check:
+                return name == check["equals"]
+            if "does_not_equal" in check:
+                return name != check["does_not_equal"]
+            return True
+        if "rich_text" in condition:
+            empty = not prop["rich_text"]
+            check = condition["rich_text"]
+            if "is_empty" in check:
+                return empty
+            if "is_not_empty" in check:
+                return not empty
+            return True
+        return True
+
+    def query(self, body, filter_properties=None):
+        pages = [p for p in list(self.pages.values()) if not p["archived"]]
+        if body.get("filter"):
+            pages = [p for p in pages if self.matches(p, body["filter"])]
+        pages.sort(key=lambda p: (p["last_edited_time"], p["_order"]))
+        start = int(body.get("start_cursor") or 0)
+        size = min(int(body.get("page_size") or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+        chunk = pages[start:start + size]
+        has_more = start + size < len(pages)
+        return {
+            "object": "list",
+            "results": [self.public(p, filter_properties) for p in chunk],
+            "has_more": has_more,
+            "next_cursor": str(start + size) if has_more else None,
+        }
+
+    def update_page(self, page_id, body):
+        page = self.pages[page_id]
+        for name, value in body.get("properties", {}).items():
+            prop = page["properties"].setdefault(name, {"id": PROPERTY_IDS.get(name, name), "type": next(iter(value))})
+            for key, content in value.items():
+                if key == "rich_text":
+                    for part in content:
+                        if len(part["text"]["content"]) > MAX_RICH_TEXT_CHARS:
+                            return error(400, "validation_error", f"{name}.rich_text content is longer than {MAX_RICH_TEXT_CHARS} characters")
+                prop[key] = content
+        page["last_edited_time"] = notion_now()
+        if page["_done_at"] is None and self.status(page_id) == "Done":
+            page["_done_at"] = time.time()
+        return self.public(page)
+
+    def timings(self):
+        """(added_at, done_at) wall-clock times of every page, done_at None while unfinished"""
+        return [(page["_added_at"], page["_done_at"]) for page in list(self.pages.values())]
+
+    def append_children(self, block_id, body):
+        children = body.get("children", [])
+        if len(children) > MAX_CHILDREN_PER_REQUEST:
+            return error(400, "validation_error", f"body.children length should be <= {MAX_CHILDREN_PER_REQUEST}")
+        for child in children:
+            for part in child.get(child.get("type"), {}).get("rich_text", []):
+                if len(part["text"]["content"]) > MAX_RICH_TEXT_CHARS:
+                    return error(400, "validation_error", f"rich_text content is longer than {MAX_RICH_TEXT_CHARS} characters")
+        self.children.setdefault(block_id, []).extend(children)
+        if block_id in self.pages:
+            self.pages[block_id]["last_edited_time"] = notion_now()
+        return {"object": "list", "results": children}
+
+
+def error(status, code, message):
+    return JSONResponse({"object": "error", "status": status, "code": code, "message": message}, status_code=status)
+
+
+def create_app(notion=None):
+    notion = notion or FakeNotion()
+    app = FastAPI(docs_url=None, redoc_url=None)
+    app.state.notion = notion
+
+    @app.middleware("http")
+    async def count_requests(request: Request, call_next):
+        notion.requests["total"] += 1
+        notion.requests[f"{request.method} {request.url.path.split('/')[2] if request.url.path.count('/') > 1 else ''}"] += 1
+        if notion.first_request_at is None:
+            notion.first_request_at = time.time()
+        if notion.latency:
+            await asyncio.sleep(notion.latency)
+        retry_after = notion.rate_limited()
+        if retry_after is not None:
+            notion.requests["429"] += 1
+            response = error(429, "rate_limited", "You have been rate limited. Please try again in a few minutes.")
+            response.headers["Retry-After"] = f"{retry_after:.2f}"
+            return response
+        if notion.failed():
+            notion.requests["500"] += 1
+            return error(500, "internal_server_error", "Unexpected error occurred.")
+        return await call_next(request)
+
+    @app.post("/v1/databases/{database_id}/query")
+    async def query_database(database_id: str, request: Request):
+        body = await request.json() if await request.body() else {}
+        only = request.query_params.getlist("filter_properties") or None
+        return notion.query(body, only)
+
+    @app.get("/v1/pages/{page_id}")
+    async def get_page(page_id: str):
+        if page_id not in notion.pages:
+            return error(404, "object_not_found", f"Could not find page with ID: {page_id}")
+        return notion.public(notion.pages[page_id])
+
+    @app.patch("/v1/pages/{page_id}")
+    async def update_page(page_id: str, request: Request):
+        if page_id not in notion.pages:
+            return error(404, "object_not_found", f"Could not find page with ID: {page_id}")
+        return notion.update_page(page_id, await request.json())
+
+    @app.patch("/v1/blocks/{block_id}/children")
+    async def append_children(block_id: str, request: Request):
+        return notion.append_children(block_id, await request.json())
+
+    return app
+
+
+def main():
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local stand-in Notion API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=0, help="number of Pending pages to seed")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before answering 429 (0 = unlimited)")
+    args = parser.parse_args()
+
+    notion = FakeNotion(latency=args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit)
+    for i in range(args.pages):
+        notion.add_page(f"Synthetic prompt {i + 1}: explain topic {i + 1} briefly")
+    print(f"Fake Notion on http://127.0.0.1:{args.port}/v1 (database id: {notion.database_id})")
+    uvicorn.run(create_app(notion), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API.
+Usage: python fake_openai.py [--port 8767] [--latency 0.5] [--error-rate 0.0] [--rpm 0] [--batch-latency 2.0]
+
+Serves POST /v1/chat/completions (plain and streamed) with a canned reply
+built from the last user message, after a configurable delay. It can fail a
+fraction of requests with 500s and answer 429 with Retry-After once a
+requests-per-minute limit is exceeded, and counts every request. The Batch
+API is there too (file upload and download, create and retrieve a batch): a
+batch completes ``--batch-latency`` seconds after it is created, with failed
+requests (same error rate) in its error file. Point the
+bot at it with OPENAI_BASE_URL=http://127.0.0.1:8767/v1, or mount
+``create_app()`` in-process with ``httpx.ASGITransport``.
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+class FakeOpenAI:
+    """Reply generator plus the latency, error and rate-limit knobs"""
+
+    def __init__(self, latency=0.5, per_token_latency=0.0, error_rate=0.0, rpm=0, reply_words=120, seed=None,
+                 batch_latency=2.0):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.reply_words = reply_words
+        self.batch_latency = batch_latency
+        self.requests = Counter()
+        self.files = {}
+        self.batches = {}
+        self._random = random.Random(seed)
+        self._window = []
+
+    def reply(self, prompt):
+        words = " ".join(f"word{i}" for i in range(self.reply_words))
+        return f"Answer to: {prompt}\n\n{words}.\n\n```python\nprint({prompt[:40]!r})\n```"
+
+    def rate_limited(self):
+        """Seconds until a slot frees up if this request is over the per-minute limit, else None"""
+        if not self.rpm:
+            return None
+        now = time.monotonic()
+        self._window = [t for t in self._window if now - t < 60]
+        if len(self._window) >= self.rpm:
+            return 60 - (now - self._window[0])
+        self._window.append(now)
+        return None
+
+    def failed(self):
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def delay(self, completion_tokens):
+        return self.latency + self.per_token_latency * completion_tokens
+
+    def add_file(self, data):
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        self.files[file_id] = data
+        return file_id
+
+    def finish_batch(self, entry):
+        """Answer a due batch's requests and write its output and error files"""
+        batch = entry["batch"]
+        if batch["status"] != "in_progress" or time.monotonic() - entry["created"] < self.batch_latency:
+            return
+        output, errors = [], []
+        for item in entry["requests"]:
+            line = {"id": f"batch_req_{uuid.uuid4().hex[:16]}", "custom_id": item["custom_id"], "error": None}
+            if self.failed():
+                self.requests["batch_500"] += 1
+                line["response"] = {"status_code": 500, "body": {"error": {"message": "The server had an error", "type": "server_error"}}}
+                errors.append(json.dumps(line))
+            else:
+                self.requests["batch_ok"] += 1
+                line["response"] = {"status_code": 200, "body": completion(self, item["body"])}
+                output.append(json.dumps(line))
+        if output:
+            batch["output_file_id"] = self.add_file("\n".join(output).encode())
+        if errors:
+            batch["error_file_id"] = self.add_file("\n".join(errors).encode())
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        batch["request_counts"] = {"total": len(entry["requests"]), "completed": len(output), "failed": len(errors)}
+
+
+def count_words(text):
+    return max(1, len(text.split()))
+
+
+def completion(openai, body):
+    """Chat completion response body for a request body"""
+    prompt = body["messages"][-1]["content"]
+    content = openai.reply(prompt)
+    prompt_tokens = sum(count_words(m["content"]) for m in body["messages"])
+    completion_tokens = count_words(content)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def multipart_fields(body, content_type):
+    """Fields of a multipart/form-data body (just enough for the SDK's file upload)"""
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    fields = {}
+    for part in body.split(b"--" + boundary)[1:-1]:
+        head, _, value = part[2:-2].partition(b"\r\n\r\n")
+        name = re.search(rb'name="([^"]*)"', head)
+        if name:
+            fields[name.group(1).decode()] = value
+    return fields
+
+
+def error(status, message, error_type, headers=None):
+    return JSONResponse({"error": {"message": message, "type": error_type, "code": None}}, status_code=status, headers=headers)
+
+
+def create_app(openai=None):
+    openai = openai or FakeOpenAI()
+    app = FastAPI(docs_url=None, redoc_url=None)
+    app.state.openai = openai
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        openai.requests["total"] += 1
+        body = await request.json()
+        retry_after = openai.rate_limited()
+        if retry_after is not None:
+            openai.requests["429"] += 1
+            return error(429, "Rate limit reached", "requests", {"retry-after": f"{retry_after:.1f}"})
+        if openai.failed():
+            openai.requests["500"] += 1
+            return error(500, "The server had an error while processing your request", "server_error")
+        response = completion(openai, body)
+        content = response["choices"][0]["message"]["content"]
+        completion_tokens = response["usage"]["completion_tokens"]
+        completion_id, created, model = response["id"], response["created"], response["model"]
+        openai.requests["ok"] += 1
+
+        if body.get("stream"):
+            async def events():
+                pieces = content.split(" ")
+                step = openai.delay(completion_tokens) / max(1, len(pieces))
+                for i, piece in enumerate(pieces):
+                    await asyncio.sleep(step)
+                    delta = {"content": piece if i == 0 else " " + piece}
+                    if i == 0:
+                        delta["role"] = "assistant"
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                done = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                }
+                yield f"data: {json.dumps(done)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(openai.delay(completion_tokens))
+        return response
+
+    @app.post("/v1/files")
+    async def upload_file(request: Request):
+        openai.requests["total"] += 1
+        fields = multipart_fields(await request.body(), request.headers["content-type"])
+        file_id = openai.add_file(fields["file"])
+        return {
+            "id": file_id, "object": "file", "bytes": len(fields["file"]), "created_at": int(time.time()),
+            "filename": "batch.jsonl", "purpose": fields.get("purpose", b"").decode(),
+        }
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        openai.requests["total"] += 1
+        if file_id not in openai.files:
+            return error(404, f"No such file: {file_id}", "invalid_request_error")
+        return Response(openai.files[file_id], media_type="application/octet-stream")
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        openai.requests["total"] += 1
+        body = await request.json()
+        data = openai.files.get(body.get("input_file_id"))
+        if data is None:
+            return error(400, "Unknown input_file_id", "invalid_request_error")
+        requests = [json.loads(line) for line in data.decode().splitlines() if line.strip()]
+        openai.requests["batch_requests"] += len(requests)
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}", "object": "batch", "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+            "status": "in_progress", "created_at": int(time.time()), "output_file_id": None, "error_file_id": None,
+            "request_counts": {"total": len(requests), "completed": 0, "failed": 0},
+        }
+        openai.batches[batch["id"]] = {"batch": batch, "requests": requests, "created": time.monotonic()}
+        return batch
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        openai.requests["total"] += 1
+        entry = openai.batches.get(batch_id)
+        if entry is None:
+            return error(404, f"No such batch: {batch_id}", "invalid_request_error")
+        openai.finish_batch(entry)
+        return entry["batch"]
+
+    return app
+
+
+def main():
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local stand-in OpenAI API")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per completion")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="extra seconds per completion token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before answering 429 (0 = unlimited)")
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="seconds until a batch completes")
+    args = parser.parse_args()
+
+    openai = FakeOpenAI(args.latency, args.per_token_latency, args.error_rate, args.rpm, batch_latency=args.batch_latency)
+    print(f"Fake OpenAI on http://127.0.0.1:{args.port}/v1")
+    uvicorn.run(create_app(openai), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,29 @@
-import os, asyncio, random, logging
-from datetime import datetime
+import os, asyncio, random, logging, time, socket, json
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-import httpx
 import openai
 from openai import AsyncOpenAI
 from concurrent.futures import ThreadPoolExecutor
 import aiosqlite
 from memory_db import MemoryDB
-import ast
+from worker_pool import PromptWorkerPool
+from notion_client import NotionClient, NOTION_API_BASE
+from embeddings import SemanticIndex, make_embedder
+from summarizer import make_summarizer
+from tokens import count_tokens, pack_history, MESSAGE_OVERHEAD
+from response_cache import ResponseCache
+from code_extractor import IncrementalCodeExtractor, export_filename, extract_code_blocks
+from rate_limit import TokenBucket, call_with_retries
+from text_splitter import split_text, rich_text, batched, RICH_TEXT_LIMIT
+from claims import ClaimStore
+from activity import ActivityTracker
+from model_router import ModelRouter, ModelSpec, make_providers, load_model_config
+from batch_api import FINISHED_STATES, make_batch_backends
+from tenants import Tenant, TenantScheduler, current_tenant, load_tenant_config
+from metrics import (
+    REGISTRY, STAGE_SECONDS, OPENAI_REQUESTS, OPENAI_TOKENS, OPENAI_COST, SLEEP_SECONDS, PROMPTS,
+    MODEL_REQUESTS, MODEL_COST, timed,
+)
 
 # Load environment variables
 load_dotenv()
@@ -26,139 +42,543 @@ logging.basicConfig(
 NOTION_DB_ID = os.getenv("NOTION_DB_ID")
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-NOTION_HEADERS = {
-    "Authorization": f"Bearer {NOTION_API_KEY}",
-    "Notion-Version": "2022-06-28",
-    "Content-Type": "application/json"
-}
+
+def notion_headers(token):
+    return {
+        "Authorization": f"Bearer {token}",
+        "Notion-Version": "2022-06-28",
+        "Content-Type": "application/json"
+    }
+
+NOTION_HEADERS = notion_headers(NOTION_API_KEY)
 
 # === Configurable Delays and Intervals ===
 FAST_MODE = os.getenv("FAST_MODE", "0") == "1"
 MIN_POLL_INTERVAL = int(os.getenv("MIN_POLL_INTERVAL", 30))
 MAX_POLL_INTERVAL = int(os.getenv("MAX_POLL_INTERVAL", 300))
-PROMPT_DELAY_MIN = float(os.getenv("PROMPT_DELAY_MIN", 2.0))
-PROMPT_DELAY_MAX = float(os.getenv("PROMPT_DELAY_MAX", 5.0))
-NOTION_QUERY_DELAY_MIN = float(os.getenv("NOTION_QUERY_DELAY_MIN", 0.5))
-NOTION_QUERY_DELAY_MAX = float(os.getenv("NOTION_QUERY_DELAY_MAX", 2.0))
-NOTION_UPDATE_DELAY_MIN = float(os.getenv("NOTION_UPDATE_DELAY_MIN", 1.0))
-NOTION_UPDATE_DELAY_MAX = float(os.getenv("NOTION_UPDATE_DELAY_MAX", 3.0))
+# Upstream pacing: token buckets per API instead of fixed sleeps. Notion allows
+# an average of 3 requests/second per integration; OPENAI_RPM should match
+# your OpenAI tier. Failed calls are retried up to RETRY_ATTEMPTS times.
+NOTION_RATE = float(os.getenv("NOTION_RATE", 3.0))
+NOTION_BURST = float(os.getenv("NOTION_BURST", 5))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", 500))
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", 4))
 JITTER = float(os.getenv("JITTER", 5.0))
 CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", 5))
 INACTIVITY_RESET_HOURS = int(os.getenv("INACTIVITY_RESET_HOURS", 24))
+# Memory expiry: entries older than MEMORY_RETENTION_HOURS (0 = keep) are deleted in
+# batches of EXPIRY_BATCH_SIZE, at most EXPIRY_MAX_BATCHES per poll
+MEMORY_RETENTION_HOURS = float(os.getenv("MEMORY_RETENTION_HOURS", 0))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", 500))
+EXPIRY_MAX_BATCHES = int(os.getenv("EXPIRY_MAX_BATCHES", 4))
+# Memory tiers: the newest MEMORY_VERBATIM_ENTRIES stay verbatim (0 = never compact), older
+# ones are summarized by MEMORY_SUMMARIZER ("extractive" or "openai"), MEMORY_COMPACT_BATCH
+# per poll; only the newest MEMORY_ARCHIVE_ENTRIES (0 = all) keep their original reply archived,
+# and beyond MEMORY_MAX_ENTRIES (0 = no cap) the oldest are deleted
+MEMORY_VERBATIM_ENTRIES = int(os.getenv("MEMORY_VERBATIM_ENTRIES", 50))
+MEMORY_SUMMARIZER = os.getenv("MEMORY_SUMMARIZER", "extractive")
+MEMORY_SUMMARY_CHARS = int(os.getenv("MEMORY_SUMMARY_CHARS", 600))
+MEMORY_COMPACT_BATCH = int(os.getenv("MEMORY_COMPACT_BATCH", 20))
+MEMORY_ARCHIVE_ENTRIES = int(os.getenv("MEMORY_ARCHIVE_ENTRIES", 1000))
+MEMORY_MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", 10000))
 # New: Notion response block size (default 1900)
 NOTION_MAX_CHARS_PER_BLOCK = int(os.getenv("NOTION_MAX_CHARS_PER_BLOCK", 1900))
 LAST_ACTIVITY_FILE = "last_activity.txt"
-
-def update_last_activity():
-    with open(LAST_ACTIVITY_FILE, "w") as f:
-        f.write(datetime.now().isoformat())
-
-def get_last_activity():
-    if not os.path.exists(LAST_ACTIVITY_FILE):
-        return None
-    with open(LAST_ACTIVITY_FILE, "r") as f:
-        ts = f.read().strip()
-        try:
-            return datetime.fromisoformat(ts)
-        except Exception:
-            return None
+# Worker pool mode: process pending prompts concurrently with separate OpenAI/Notion limits
+WORKER_POOL_MODE = os.getenv("WORKER_POOL_MODE", "0") == "1"
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", 4))
+NOTION_WRITE_CONCURRENCY = int(os.getenv("NOTION_WRITE_CONCURRENCY", 2))
+# Context selection: "recent" (last CONTEXT_WINDOW pairs) or "semantic" (most similar past pairs)
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "recent")
+EMBEDDER = os.getenv("EMBEDDER", "hashing")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 512))
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", 0.15))
+# Token budgets: history is packed under CONTEXT_TOKEN_BUDGET, and the reply
+# gets at most MAX_RESPONSE_TOKENS (less if the prompt nearly fills the model)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+MAX_RESPONSE_TOKENS = int(os.getenv("MAX_RESPONSE_TOKENS", 1000))
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", 16385))
+# Response cache for repeated prompts, keyed on the normalized prompt plus a hash of the
+# RESPONSE_CACHE_CONTEXT_TURNS prompts before it (scope "recent"), all earlier context ("context") or nothing ("prompt")
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 86400))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0))
+RESPONSE_CACHE_SCOPE = os.getenv("RESPONSE_CACHE_SCOPE", "recent")
+RESPONSE_CACHE_CONTEXT_TURNS = int(os.getenv("RESPONSE_CACHE_CONTEXT_TURNS", 2))
+# Event-driven ingestion: pages arrive via app.py's /webhook/notion and polling
+# becomes a slow reconciliation sweep that catches anything a webhook missed
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "0") == "1"
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 900))
+NOTION_WEBHOOK_SECRET = os.getenv("NOTION_WEBHOOK_SECRET")
+# Incremental polling: only pages edited since the last poll (minus a safety
+# margin) are queried; every FULL_SCAN_EVERY polls a full scan catches
+# anything left behind, e.g. pages whose processing failed
+FULL_SCAN_EVERY = int(os.getenv("FULL_SCAN_EVERY", 10))
+POLL_CURSOR_MARGIN = int(os.getenv("POLL_CURSOR_MARGIN", 120))
+POLL_CURSOR_KEY = "poll_cursor"
+# Streaming: show the reply in Notion while it is being generated
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "0") == "1"
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", 1.5))
+# Appended to partial previews, so a preview left behind by a failed stream can be recognized
+PARTIAL_SUFFIX = " …"
+# Durable job queue: workers claim a page's job before working on it. Give each
+# bot instance sharing a database its own WORKER_ID; a restart with the same
+# id takes its unfinished jobs straight back, other ids wait out the lease.
+WORKER_ID = os.getenv("WORKER_ID", socket.gethostname())
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 600))
+# Scale-out: instances sharing this SQLite file split the backlog via leased claims
+CLAIMS_DB = os.getenv("CLAIMS_DB")
+CLAIM_LEASE_SECONDS = float(os.getenv("CLAIM_LEASE_SECONDS", 60))
+CLAIM_DONE_RETENTION = float(os.getenv("CLAIM_DONE_RETENTION", 600))
+# Multi-tenant mode: serve every database listed in this JSON config file
+TENANTS_FILE = os.getenv("TENANTS_FILE")
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", 2))
+TENANT_MAX_CONNECTIONS = int(os.getenv("TENANT_MAX_CONNECTIONS", 2))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", 4))
+# Model routing: MODELS_FILE lists the models to choose from per prompt (see
+# models.example.json); without it every prompt goes to OPENAI_MODEL
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+MODELS_FILE = os.getenv("MODELS_FILE")
+MODEL_TEMPERATURE = float(os.getenv("MODEL_TEMPERATURE", 0.3))
+ROUTER_LATENCY_WEIGHT = float(os.getenv("ROUTER_LATENCY_WEIGHT", 0.001))
+ROUTER_HEDGE_AFTER = os.getenv("ROUTER_HEDGE_AFTER", "0")
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", 100))
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+# Batch mode (python main.py batch): the pending backlog goes out as bulk jobs
+# through the providers' batch APIs, slower to come back but cheaper per prompt
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 1000))
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", 30))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", 86400))
+BATCH_COST_FACTOR = float(os.getenv("BATCH_COST_FACTOR", 0.5))
+BATCH_STATE_KEY = "batches_in_flight"
+# Estimated OpenAI prices (USD per 1K tokens) for OPENAI_MODEL, used for the cost metric
+OPENAI_PROMPT_COST_PER_1K = float(os.getenv("OPENAI_PROMPT_COST_PER_1K", 0.0005))
+OPENAI_COMPLETION_COST_PER_1K = float(os.getenv("OPENAI_COMPLETION_COST_PER_1K", 0.0015))
+# Shared Notion HTTP client (connection pooling, keep-alive, HTTP/2 when available)
+NOTION_MAX_CONNECTIONS = int(os.getenv("NOTION_MAX_CONNECTIONS", 10))
+NOTION_HTTP2 = os.getenv("NOTION_HTTP2", "1") == "1"
 
 if FAST_MODE:
     MIN_POLL_INTERVAL = 2
     MAX_POLL_INTERVAL = 5
-    PROMPT_DELAY_MIN = PROMPT_DELAY_MAX = 0.1
-    NOTION_QUERY_DELAY_MIN = NOTION_QUERY_DELAY_MAX = 0.1
-    NOTION_UPDATE_DELAY_MIN = NOTION_UPDATE_DELAY_MAX = 0.1
+    BATCH_POLL_INTERVAL = 1
     JITTER = 0
     logging.info("FAST_MODE enabled: All delays minimized for instant response.")
 
-# Async OpenAI client
+# Async OpenAI client (retries are handled by call_with_retries, not the SDK)
 try:
-    async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 except Exception:
     async_openai_client = None
 
+# One rate limiter per upstream, shared by every worker
+notion_limiter = TokenBucket(NOTION_RATE, NOTION_BURST, name="Notion")
+openai_limiter = TokenBucket(OPENAI_RPM / 60, max(1, OPENAI_CONCURRENCY), name="OpenAI")
+
 # ThreadPool for sync OpenAI fallback
 thread_pool = ThreadPoolExecutor()
 
+# Completion providers and the router that picks a model for each prompt
+if MODELS_FILE:
+    model_specs, provider_config = load_model_config(MODELS_FILE)
+else:
+    model_specs, provider_config = [ModelSpec(
+        OPENAI_MODEL,
+        context_tokens=MODEL_CONTEXT_TOKENS,
+        max_output_tokens=MAX_RESPONSE_TOKENS,
+        prompt_cost_per_1k=OPENAI_PROMPT_COST_PER_1K,
+        completion_cost_per_1k=OPENAI_COMPLETION_COST_PER_1K,
+    )], {}
+router = ModelRouter(
+    model_specs,
+    make_providers(
+        model_specs,
+        async_openai_client,
+        lambda: openai.OpenAI(api_key=OPENAI_API_KEY),
+        thread_pool,
+        anthropic_api_key=ANTHROPIC_API_KEY,
+        extra=provider_config,
+    ),
+    latency_weight=ROUTER_LATENCY_WEIGHT,
+    hedge_after=ROUTER_HEDGE_AFTER if ROUTER_HEDGE_AFTER == "auto" else float(ROUTER_HEDGE_AFTER),
+    window=ROUTER_WINDOW,
+)
+
+# Bulk submission for `python main.py batch`, for the providers that support it
+batch_backends = make_batch_backends(router.providers)
+
 # Initialize async memory system
 memory_db = MemoryDB()
 
-async def get_pending_prompts():
-    url = f"https://api.notion.com/v1/databases/{NOTION_DB_ID}/query"
+# Time of the last processed prompt, held in memory and stored in the memory database
+activity = ActivityTracker(memory_db, legacy_file=LAST_ACTIVITY_FILE)
+
+# bot_state key (per tenant namespace) holding the cutoff of an inactivity reset that is still being worked off
+EXPIRY_CUTOFF_KEY = "memory_expiry_cutoff"
+
+# Vector index over memory entries, used when CONTEXT_MODE=semantic
+semantic_index = SemanticIndex(memory_db, make_embedder(EMBEDDER, async_openai_client, EMBEDDING_DIM))
+
+# Summarizer for compacting older memory entries
+summarizer = make_summarizer(MEMORY_SUMMARIZER, async_openai_client, MEMORY_SUMMARY_CHARS)
+
+# Cache of previous replies, stored in the memory database
+response_cache = ResponseCache(
+    memory_db,
+    ttl=RESPONSE_CACHE_TTL,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    similarity=RESPONSE_CACHE_SIMILARITY,
+    scope=RESPONSE_CACHE_SCOPE,
+    context_turns=RESPONSE_CACHE_CONTEXT_TURNS,
+)
+
+# One long-lived Notion client shared by every request
+notion_client = NotionClient(
+    NOTION_HEADERS,
+    base_url=os.getenv("NOTION_API_BASE", NOTION_API_BASE),
+    max_connections=NOTION_MAX_CONNECTIONS,
+    max_keepalive=NOTION_MAX_CONNECTIONS,
+    http2=NOTION_HTTP2,
+    rate_limiter=notion_limiter,
+    max_attempts=RETRY_ATTEMPTS,
+)
+
+# Work claims shared with other bot instances (only when CLAIMS_DB is set)
+claim_store = ClaimStore(
+    CLAIMS_DB, f"{WORKER_ID}-{os.getpid()}", lease=CLAIM_LEASE_SECONDS, done_retention=CLAIM_DONE_RETENTION
+) if CLAIMS_DB else None
+
+# The database configured by NOTION_DB_ID/NOTION_API_KEY, in the default memory namespace
+default_tenant = Tenant(
+    "default", NOTION_DB_ID, notion_client, memory_db, response_cache, semantic_index,
+    max_concurrency=OPENAI_CONCURRENCY,
+)
+
+# The scheduler run_tenants() is serving, so change notifications reach the right tenant
+tenant_scheduler = None
+
+def active_tenant():
+    """The tenant whose page is being processed (the default one outside the scheduler)"""
+    return current_tenant.get(default_tenant)
+
+def make_tenant(config):
+    """Build a Tenant from a TENANTS_FILE entry, with its own client, caps and memory namespace"""
+    name = config["name"]
+    notion_rate = float(config.get("notion_rate", NOTION_RATE))
+    tenant_db = memory_db.namespaced(name)
+    openai_rpm = config.get("openai_rpm")
+    return Tenant(
+        name,
+        config["database_id"],
+        NotionClient(
+            notion_headers(config["token"]),
+            base_url=os.getenv("NOTION_API_BASE", NOTION_API_BASE),
+            max_connections=int(config.get("max_connections", TENANT_MAX_CONNECTIONS)),
+            max_keepalive=int(config.get("max_connections", TENANT_MAX_CONNECTIONS)),
+            http2=NOTION_HTTP2,
+            rate_limiter=TokenBucket(notion_rate, config.get("notion_burst", max(1, notion_rate)), name=f"Notion[{name}]"),
+            max_attempts=RETRY_ATTEMPTS,
+        ),
+        tenant_db,
+        ResponseCache(
+            tenant_db,
+            ttl=RESPONSE_CACHE_TTL,
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            similarity=RESPONSE_CACHE_SIMILARITY,
+            scope=RESPONSE_CACHE_SCOPE,
+            context_turns=RESPONSE_CACHE_CONTEXT_TURNS,
+        ),
+        SemanticIndex(tenant_db, semantic_index.embedder),
+        max_concurrency=int(config.get("max_concurrency", TENANT_MAX_CONCURRENCY)),
+        openai_limiter=TokenBucket(float(openai_rpm) / 60, name=f"OpenAI[{name}]") if openai_rpm else None,
+    )
+
+# Live counters fed by the pipeline, shown by the web dashboard (app.py /status)
+pipeline_stats = {
+    "polls": 0,
+    "found": 0,
+    "processed": 0,
+    "failed": 0,
+    "last_check": None,
+    "last_processed": None,
+}
+
+@timed(STAGE_SECONDS, stage="get_pending_prompts")
+async def get_pending_prompts(full_scan=False):
+    """Fetch every pending page, following pagination cursors.
+
+    Unless ``full_scan`` is set, only pages edited since the stored
+    last_edited_time high-water mark are requested. Only the title (prompt)
+    property is returned, since that is all the bot reads.
+    """
+    tenant = active_tenant()
+    url = f"/databases/{tenant.database_id}/query"
+    conditions = [
+        {"property": "Status", "select": {"equals": "Pending"}},
+        {"property": "Response", "rich_text": {"is_empty": True}}
+    ]
+    since = None if full_scan else await tenant.memory_db.get_state(POLL_CURSOR_KEY)
+    if since:
+        conditions.append({"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": since}})
     body = {
-        "filter": {
-            "and": [
-                {"property": "Status", "select": {"equals": "Pending"}},
-                {"property": "Response", "rich_text": {"is_empty": True}}
-            ]
-        }
+        "filter": {"and": conditions},
+        "sorts": [{"timestamp": "last_edited_time", "direction": "ascending"}],
+        "page_size": 100,
     }
-    await asyncio.sleep(random.uniform(NOTION_QUERY_DELAY_MIN, NOTION_QUERY_DELAY_MAX))
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.post(url, headers=NOTION_HEADERS, json=body, timeout=10)
+    params = {"filter_properties": "title"}
+    # Taken before the query so edits made while it runs are caught next time
+    cursor_time = datetime.now(timezone.utc) - timedelta(seconds=POLL_CURSOR_MARGIN)
+    results = []
+    try:
+        while True:
+            res = await tenant.notion_client.post(url, params=params, json=body)
             if res.status_code != 200:
                 logging.error(f"Failed to fetch prompts: {res.status_code} - {res.text}")
-                return []
-            return res.json().get("results", [])
-        except Exception as e:
-            logging.error(f"Error fetching prompts: {e}")
-            return []
-
-async def ask_chatgpt_with_context(prompt):
-    # Fetch last CONTEXT_WINDOW prompt/response pairs for context
-    recent_pairs = await memory_db.get_recent_prompts(limit=CONTEXT_WINDOW)
-    recent_pairs = list(recent_pairs)  # Ensure it's a sequence for reversed()
-    messages = []
-    for prev_prompt, prev_response in reversed(recent_pairs):
-        messages.append({"role": "user", "content": prev_prompt})
-        messages.append({"role": "assistant", "content": prev_response})
+                return results
+            data = res.json()
+            results.extend(data.get("results", []))
+            if not data.get("has_more") or not data.get("next_cursor"):
+                break
+            body["start_cursor"] = data["next_cursor"]
+    except Exception as e:
+        logging.error(f"Error fetching prompts: {e}")
+        return results
+    await tenant.memory_db.set_state(POLL_CURSOR_KEY, cursor_time.strftime("%Y-%m-%dT%H:%M:%S.000Z"))
+    pipeline_stats["polls"] += 1
+    pipeline_stats["found"] += len(results)
+    pipeline_stats["last_check"] = datetime.now().isoformat(timespec="seconds")
+    return results
+
+async def build_context_messages(prompt):
+    """Build chat messages for a prompt with history packed under the token budget.
+
+    Returns (messages, prompt_tokens, max_tokens): the tokens the messages
+    take up (counted while packing, so the router needn't count them again)
+    and the reply allowance left in the largest configured model's context
+    window.
+    """
+    tenant = active_tenant()
+    if CONTEXT_MODE == "semantic":
+        # Fetch the CONTEXT_WINDOW most similar past prompt/response pairs, most similar first,
+        # so a tight budget drops the least similar ones rather than the oldest
+        matches = await tenant.semantic_index.search(prompt, k=CONTEXT_WINDOW, min_score=SEMANTIC_MIN_SCORE)
+        history = await tenant.memory_db.get_context_entries(ids=[entry_id for entry_id, _ in matches])
+    else:
+        # Fetch last CONTEXT_WINDOW prompt/response pairs for context
+        history = await tenant.memory_db.get_context_entries(limit=CONTEXT_WINDOW)
+    prompt_tokens = count_tokens(prompt) + MESSAGE_OVERHEAD
+    context_tokens = router.context_tokens()  # the router picks a model that fits
+    budget = min(CONTEXT_TOKEN_BUDGET, context_tokens - MAX_RESPONSE_TOKENS - prompt_tokens)
+    messages, history_tokens = pack_history(history, max(0, budget))
     messages.append({"role": "user", "content": prompt})
+    max_tokens = max(1, min(MAX_RESPONSE_TOKENS, context_tokens - history_tokens - prompt_tokens))
+    return messages, history_tokens + prompt_tokens, max_tokens
+
+async def fetch_page(page_id):
+    """Fetch a single page, or None if it can't be read"""
     try:
-        if async_openai_client:
-            res = await async_openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                temperature=0.3,
-                max_tokens=1000,
-                presence_penalty=0.1,
-                frequency_penalty=0.1
-            )
-            response = res.choices[0].message.content
-            return response
-        else:
-            # Fallback: run sync OpenAI in thread pool
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(thread_pool, sync_ask_chatgpt, prompt)
-            return response
+        res = await active_tenant().notion_client.get(f"/pages/{page_id}")
+        if res.status_code != 200:
+            logging.error(f"Failed to fetch page {page_id}: {res.status_code}")
+            return None
+        return res.json()
     except Exception as e:
-        logging.error(f"Error calling ChatGPT: {e}")
-        return f"Error processing request: {str(e)}"
+        logging.error(f"Error fetching page {page_id}: {e}")
+        return None
 
-def extract_code_blocks(response):
-    """Extract code blocks from response and return both cleaned response and code"""
-    import re
-    
-    code_block_pattern = r'```(\w+)?\n(.*?)```'
-    matches = re.findall(code_block_pattern, response, flags=re.DOTALL)
-    
-    extracted_codes = []
-    cleaned_response = response
-    
-    for language, code in matches:
-        lang = language or 'text'
-        extracted_codes.append({
-            'language': lang,
-            'code': code.strip()
-        })
-    
-    # Remove code blocks from the main response
-    cleaned_response = re.sub(code_block_pattern, '', response, flags=re.DOTALL)
-    cleaned_response = re.sub(r'\n\s*\n', '\n\n', cleaned_response)  # Clean up extra newlines
-    cleaned_response = cleaned_response.strip()
-    
-    return cleaned_response, extracted_codes
+def normalize_id(notion_id):
+    return (notion_id or "").replace("-", "").lower()
+
+def in_database(page, tenant):
+    """True unless the page's parent is a database other than the tenant's"""
+    parent = page.get("parent", {})
+    return parent.get("type") != "database_id" or normalize_id(parent.get("database_id")) == normalize_id(tenant.database_id)
+
+def is_pending(page, unfinished_job=False):
+    """Same condition as the get_pending_prompts filter: Status is Pending and Response is empty.
+
+    A page with an unfinished job only needs Status Pending: its Response may
+    still hold the partial preview of a stream that was cut off.
+    """
+    props = page.get("properties", {})
+    status = (props.get("Status", {}).get("select") or {}).get("name")
+    response = props.get("Response", {}).get("rich_text") or []
+    return in_database(page, active_tenant()) and status == "Pending" and (unfinished_job or not response) and not page.get("archived")
+
+def has_partial_response(page):
+    """True if a Pending page's Response is a streaming preview left behind by a failed stream"""
+    props = page.get("properties", {})
+    status = (props.get("Status", {}).get("select") or {}).get("name")
+    text = "".join(part.get("plain_text") or part.get("text", {}).get("content", "")
+                   for part in props.get("Response", {}).get("rich_text") or [])
+    return status == "Pending" and text.endswith(PARTIAL_SUFFIX)
+
+def page_ids_from_event(payload):
+    """Page IDs from a Notion webhook event or a relay post ({"page_id": ...} / {"page_ids": [...]})"""
+    if "page_ids" in payload:
+        return [str(page_id) for page_id in payload["page_ids"]]
+    if "page_id" in payload:
+        return [str(payload["page_id"])]
+    entity = payload.get("entity") or {}
+    if entity.get("type") == "page" and entity.get("id"):
+        return [entity["id"]]
+    return []
+
+def database_id_from_event(payload):
+    """Database the event's page lives in: Notion's ``data.parent`` or a relay's "database_id" (None if not given)"""
+    if payload.get("database_id"):
+        return str(payload["database_id"])
+    parent = (payload.get("data") or {}).get("parent") or {}
+    if parent.get("type") in ("database", "database_id"):
+        return parent.get("database_id") or parent.get("id")
+    return None
+
+async def ingest_page_ids(page_ids, database_id=None):
+    """Fetch pages named by a change notification and queue the pending ones for processing.
+
+    With the multi-tenant scheduler running, each page goes to the tenant that
+    owns its database: the one named by ``database_id`` when the event says,
+    otherwise the first tenant whose client can read the page and whose
+    database it is in.
+    """
+    if tenant_scheduler is None:
+        tenants = [default_tenant]
+    else:
+        tenants = [
+            tenant for tenant in tenant_scheduler.tenants
+            if database_id is None or normalize_id(tenant.database_id) == normalize_id(database_id)
+        ]
+        if not tenants:
+            logging.warning(f"Change notification for database {database_id}, which no tenant serves")
+            return 0
+    dead = {}
+    queued = 0
+    for page_id in dict.fromkeys(page_ids):
+        for tenant in tenants:
+            token = current_tenant.set(tenant)
+            try:
+                if tenant.name not in dead:
+                    dead[tenant.name] = await tenant.memory_db.get_dead_letter_page_ids()
+                if page_id in dead[tenant.name]:
+                    break
+                page = await fetch_page(page_id)
+                if page is None or not in_database(page, tenant):
+                    continue
+                if is_pending(page):
+                    if tenant_scheduler is None:
+                        queued += bool(prompt_pool.submit(page))
+                    else:
+                        queued += tenant_scheduler.enqueue(tenant, [page])
+                break
+            finally:
+                current_tenant.reset(token)
+    if queued:
+        logging.info(f"Queued {queued} page(s) from change notifications")
+    return queued
+
+_ingest_tasks = set()
+
+def enqueue_page_ids(page_ids, database_id=None):
+    """Schedule ingestion in the background so webhook requests return immediately"""
+    task = asyncio.create_task(ingest_page_ids(page_ids, database_id))
+    _ingest_tasks.add(task)
+    task.add_done_callback(_ingest_tasks.discard)
+    return task
+
+async def write_partial_response(page_id, text):
+    """Show in-progress reply text in the Response cell (Status is left untouched)"""
+    preview = text[:NOTION_MAX_CHARS_PER_BLOCK - len(PARTIAL_SUFFIX)] + PARTIAL_SUFFIX
+    payload = {"properties": {"Response": {"rich_text": [{"text": {"content": preview}}]}}}
+    try:
+        res = await active_tenant().notion_client.patch(f"/pages/{page_id}", json=payload)
+        if res.status_code != 200:
+            logging.warning(f"Failed to write partial response to page {page_id}: {res.status_code}")
+    except Exception as e:
+        logging.warning(f"Error writing partial response to page {page_id}: {e}")
+
+async def clear_partial_response(page_id):
+    """Empty the Response cell again so the page matches the pending filters; True on success"""
+    payload = {"properties": {"Response": {"rich_text": []}}}
+    try:
+        res = await active_tenant().notion_client.patch(f"/pages/{page_id}", json=payload)
+        if res.status_code == 200:
+            return True
+        logging.warning(f"Failed to clear partial response on page {page_id}: {res.status_code}")
+    except Exception as e:
+        logging.warning(f"Error clearing partial response on page {page_id}: {e}")
+    return False
+
+async def stream_chatgpt(messages, prompt_tokens, max_tokens, page_id):
+    """Stream a completion, flushing the prose seen so far to Notion at most every STREAM_FLUSH_INTERVAL seconds"""
+    extractor = IncrementalCodeExtractor()
+    started = time.monotonic()
+    state = {"last_flush": None, "flush_task": None}
+
+    def on_delta(delta):
+        extractor.feed(delta)
+        now = time.monotonic()
+        last_flush, flush_task = state["last_flush"], state["flush_task"]
+        due = last_flush is None or now - last_flush >= STREAM_FLUSH_INTERVAL
+        if due and (flush_task is None or flush_task.done()):
+            text = extractor.text()
+            if text:
+                if last_flush is None:
+                    logging.info(f"First partial text for page {page_id} after {now - started:.2f}s")
+                # Flush in the background so reading the stream is never blocked on Notion
+                state["flush_task"] = asyncio.create_task(write_partial_response(page_id, text))
+                state["last_flush"] = now
+
+    try:
+        completion = await router.stream(messages, prompt_tokens, max_tokens, MODEL_TEMPERATURE, on_delta)
+    except Exception:
+        # A preview left in Response would hide the page from the pending filters for good
+        if state["flush_task"] is not None:
+            await asyncio.gather(state["flush_task"], return_exceptions=True)
+        if state["last_flush"] is not None:
+            await clear_partial_response(page_id)
+        raise
+    if state["flush_task"] is not None:
+        await state["flush_task"]  # the final update_response must land after the last partial write
+    return completion
+
+@timed(STAGE_SECONDS, stage="ask_chatgpt")
+async def ask_chatgpt_with_context(prompt, page_id=None):
+    tenant = active_tenant()
+    messages, prompt_tokens, max_tokens = await build_context_messages(prompt)
+    if RESPONSE_CACHE:
+        cached = await tenant.response_cache.get(prompt, messages[:-1])
+        if cached is not None:
+            logging.info("Response cache hit - skipping OpenAI call")
+            OPENAI_REQUESTS.inc(result="cache_hit")
+            return cached
+    async def complete():
+        if STREAM_RESPONSES and page_id:
+            return await stream_chatgpt(messages, prompt_tokens, max_tokens, page_id)
+        return await router.complete(messages, prompt_tokens, max_tokens, MODEL_TEMPERATURE)
+
+    # Errors propagate once retries run out, so they are never written to the page as a "response"
+    if tenant.openai_limiter is not None:
+        await tenant.openai_limiter.acquire()  # per-tenant cap, on top of the shared OpenAI limit
+    try:
+        completion = await call_with_retries(
+            complete, openai_limiter, RETRY_ATTEMPTS, classify=router.classify, description="Completion"
+        )
+    except Exception:
+        OPENAI_REQUESTS.inc(result="error")
+        raise
+    OPENAI_REQUESTS.inc(result="ok")
+    record_openai_usage(completion)
+    response = completion.text
+    if RESPONSE_CACHE:
+        await tenant.response_cache.put(prompt, messages[:-1], response)
+    return response
+
+def record_openai_usage(completion):
+    """Count tokens (as reported by the API, or estimated locally) and the estimated cost of the routed model"""
+    OPENAI_TOKENS.inc(completion.prompt_tokens, kind="prompt")
+    OPENAI_TOKENS.inc(completion.completion_tokens, kind="completion")
+    OPENAI_COST.inc(completion.cost)
 
 def format_code_output(codes):
     """Format extracted codes for Notion storage"""
@@ -174,47 +594,18 @@ def format_code_output(codes):
     
     return output
 
-def sync_ask_chatgpt(prompt):
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
-    res = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.3,
-        max_tokens=1000,  # Increased for better code responses
-        presence_penalty=0.1,
-        frequency_penalty=0.1
-    )
-    return res.choices[0].message.content
-
+@timed(STAGE_SECONDS, stage="update_response")
 async def update_response(page_id, response):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
+    url = f"/pages/{page_id}"
     current_time = datetime.now()
     
     # Extract code blocks and clean response
     cleaned_response, extracted_codes = extract_code_blocks(response)
     code_output = format_code_output(extracted_codes)
     
-    # Handle long responses
-    max_chars_per_block = NOTION_MAX_CHARS_PER_BLOCK
-    response_blocks = []
-    
-    if len(cleaned_response) <= max_chars_per_block:
-        response_blocks = [cleaned_response]
-    else:
-        # Split by sentences to avoid cutting in the middle
-        sentences = cleaned_response.split('. ')
-        current_block = ""
-        
-        for sentence in sentences:
-            if len(current_block + sentence + '. ') <= max_chars_per_block:
-                current_block += sentence + '. '
-            else:
-                if current_block:
-                    response_blocks.append(current_block.strip())
-                current_block = sentence + '. '
-        
-        if current_block:
-            response_blocks.append(current_block.strip())
+    # Handle long responses (leave room for the continuation note on the first block)
+    max_chars_per_block = min(NOTION_MAX_CHARS_PER_BLOCK, RICH_TEXT_LIMIT - 100)
+    response_blocks = split_text(cleaned_response, max_chars_per_block)
     
     # Update with first block
     first_block = response_blocks[0]
@@ -232,103 +623,563 @@ async def update_response(page_id, response):
     
     # Add code output if there are extracted codes
     if code_output:
-        payload["properties"]["Code Output"] = {"rich_text": [{"text": {"content": code_output}}]}
+        payload["properties"]["Code Output"] = {"rich_text": rich_text(code_output)}
         logging.info(f"Extracted {len(extracted_codes)} code block(s) for page {page_id}")
-    await asyncio.sleep(random.uniform(NOTION_UPDATE_DELAY_MIN, NOTION_UPDATE_DELAY_MAX))
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.patch(url, headers=NOTION_HEADERS, json=payload, timeout=10)
-            if res.status_code != 200:
-                logging.error(f"Failed to update page {page_id}: {res.status_code}")
-                return False
-            
-            # Add additional blocks as comments if response was split
-            if len(response_blocks) > 1:
-                try:
-                    await add_response_blocks_as_comments(page_id, response_blocks[1:])
-                except Exception as e:
-                    logging.warning(f"Could not add comment blocks to page {page_id}: {e}")
-                    logging.warning("This might be due to missing 'Insert content' permission in your Notion integration")
-                    logging.warning("Only the first part of the response was saved. Additional parts:")
-                    for i, block in enumerate(response_blocks[1:], 2):
-                        logging.warning(f"Part {i}: {block[:100]}...")
-            
-            return True
-        except Exception as e:
-            logging.error(f"Error updating page {page_id}: {e}")
+    try:
+        res = await active_tenant().notion_client.patch(url, json=payload)
+        if res.status_code != 200:
+            logging.error(f"Failed to update page {page_id}: {res.status_code}")
             return False
+        
+        # Add additional blocks as comments if response was split
+        if len(response_blocks) > 1:
+            try:
+                await add_response_blocks_as_comments(page_id, response_blocks[1:])
+            except Exception as e:
+                logging.warning(f"Could not add comment blocks to page {page_id}: {e}")
+                logging.warning("This might be due to missing 'Insert content' permission in your Notion integration")
+                logging.warning("Only the first part of the response was saved. Additional parts:")
+                for i, block in enumerate(response_blocks[1:], 2):
+                    logging.warning(f"Part {i}: {block[:100]}...")
+        
+        return True
+    except Exception as e:
+        logging.error(f"Error updating page {page_id}: {e}")
+        return False
 
+@timed(STAGE_SECONDS, stage="add_response_blocks")
 async def add_response_blocks_as_comments(page_id, blocks):
-    """Add additional response blocks as comments to the Notion page"""
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-    
-    for i, block in enumerate(blocks, 2):
-        comment_text = f"Response Part {i}/{len(blocks) + 1}:\n\n{block}"
-        
-        payload = {
-            "children": [
-                {
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [
-                            {
-                                "type": "text",
-                                "text": {"content": comment_text}
-                            }
-                        ]
-                    }
-                }
-            ]
+    """Append the remaining response parts to the Notion page, up to 100 blocks per request"""
+    url = f"/blocks/{page_id}/children"
+    total = len(blocks) + 1
+    children = [
+        {
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [
+                    {"type": "text", "text": {"content": f"Response Part {i}/{total}:\n\n"}},
+                    {"type": "text", "text": {"content": block}}
+                ]
+            }
         }
-        
-        await asyncio.sleep(random.uniform(NOTION_UPDATE_DELAY_MIN, NOTION_UPDATE_DELAY_MAX))
-        async with httpx.AsyncClient() as client:
+        for i, block in enumerate(blocks, 2)
+    ]
+    
+    for batch in batched(children):
+        try:
+            res = await active_tenant().notion_client.patch(url, json={"children": batch})
+            if res.status_code != 200:
+                logging.error(f"Failed to add {len(batch)} response block(s) to page {page_id}: {res.status_code}")
+            else:
+                logging.info(f"Added {len(batch)} response block(s) to page {page_id}")
+        except Exception as e:
+            logging.error(f"Error adding response blocks to page {page_id}: {e}")
+
+def job_page(job):
+    """Minimal page dict for a stored job, enough for the pipeline stages"""
+    return {"id": job["page_id"], "properties": {"Prompt": {"title": [{"text": {"content": job["prompt"]}}]}}}
+
+async def store_reply(page_id, prompt_text, reply):
+    """Save a generated reply on its job and in memory (safe to repeat)"""
+    tenant = active_tenant()
+    # Extract code blocks for memory storage
+    _, extracted_codes = extract_code_blocks(reply)
+    entry_id = await tenant.memory_db.save_job_reply(page_id, prompt_text, reply, extracted_codes)
+    if CONTEXT_MODE == "semantic":
+        await tenant.semantic_index.add(entry_id, prompt_text)
+
+async def finish_claim(page_id):
+    """Mark the shared claim finished; it stays reserved so a stale poll elsewhere doesn't answer the page again"""
+    if claim_store:
+        await claim_store.complete(page_id)
+
+async def release_claim(page_id):
+    """Give up the shared claim on a page this instance won't finish, instead of leaving it to the lease"""
+    if claim_store:
+        await claim_store.release(page_id)
+
+async def claim_page(page_id, prompt_text, worker_id=WORKER_ID, lease=JOB_LEASE_SECONDS):
+    """Claim a page's job (and its shared claim); the job, or None if another instance or worker holds it"""
+    tenant = active_tenant()
+    if claim_store and not await claim_store.claim(page_id):
+        logging.info(f"Skipping page {page_id}: claimed by another instance")
+        return None
+    try:
+        job = await tenant.memory_db.upsert_job(page_id, prompt_text)
+        claimed = await tenant.memory_db.claim_job(page_id, worker_id, lease)
+    except Exception:
+        await release_claim(page_id)
+        raise
+    if not claimed:
+        logging.info(f"Skipping page {page_id}: claimed by another worker")
+        await release_claim(page_id)
+        return None
+    return job
+
+async def saved_reply(job):
+    """Reply a previous run already generated for a job (stored in memory if that step was missed)"""
+    logging.info(f"Resuming page {job['page_id']} from its saved reply ({job['state']})")
+    if job["memory_id"] is None:
+        await store_reply(job["page_id"], job["prompt"], job["reply"])
+    return job["reply"]
+
+async def fail_job(page_id, prompt_text, error):
+    """Record a page whose reply could not be generated as a dead letter"""
+    tenant = active_tenant()
+    await tenant.memory_db.add_dead_letter(page_id, "generate", str(error), prompt_text)
+    await tenant.memory_db.set_job_state(page_id, "failed", str(error))
+    await release_claim(page_id)
+    pipeline_stats["failed"] += 1
+    PROMPTS.inc(result="failed")
+
+@timed(STAGE_SECONDS, stage="generate_reply")
+async def generate_reply(page):
+    """Pipeline stage 1: ask ChatGPT for a page's prompt and store the exchange in memory.
+
+    Progress is kept in the jobs table, so a page whose reply was already
+    generated (e.g. before a crash) reuses the saved reply instead of paying
+    for a new one.
+    """
+    prompt_text = page["properties"]["Prompt"]["title"][0]["text"]["content"]
+    page_id = page["id"]
+    job = await claim_page(page_id, prompt_text)
+    if job is None:
+        return None
+    if job["state"] in ("generated", "written"):
+        return await saved_reply(job)
+    logging.info(f"Processing: {prompt_text[:50]}...")
+
+    # Use previous context for ChatGPT
+    try:
+        reply = await ask_chatgpt_with_context(prompt_text, page_id)
+    except Exception as e:
+        logging.error(f"Error calling ChatGPT for page {page_id}: {e}")
+        await fail_job(page_id, prompt_text, e)
+        return None
+
+    await store_reply(page_id, prompt_text, reply)
+    return reply
+
+@timed(STAGE_SECONDS, stage="write_reply")
+async def write_reply(page, reply):
+    """Pipeline stage 2: write the reply back to the Notion page"""
+    tenant = active_tenant()
+    page_id = page["id"]
+    ok = await update_response(page_id, reply)
+    if ok:
+        logging.info(f"Updated page: {page_id}")
+        await tenant.memory_db.set_job_state(page_id, "written")
+    else:
+        logging.error(f"Failed to update page: {page_id}")
+        # The job stays "generated", so a retry writes the saved reply without a new OpenAI call
+        await tenant.memory_db.add_dead_letter(page_id, "write", "Notion update failed", reply)
+    activity.touch()  # Update on every processed prompt (stored in the background)
+    if ok:
+        await tenant.memory_db.set_job_state(page_id, "done")
+        pipeline_stats["processed"] += 1
+        pipeline_stats["last_processed"] = datetime.now().isoformat(timespec="seconds")
+        PROMPTS.inc(result="processed")
+        await finish_claim(page_id)
+    else:
+        pipeline_stats["failed"] += 1
+        PROMPTS.inc(result="failed")
+        await release_claim(page_id)
+    return ok
+
+# Shared worker pool used when WORKER_POOL_MODE is enabled
+prompt_pool = PromptWorkerPool(
+    generate_reply,
+    write_reply,
+    openai_concurrency=OPENAI_CONCURRENCY,
+    notion_concurrency=NOTION_WRITE_CONCURRENCY,
+)
+
+# Gauges read from live objects whenever /metrics is scraped
+IN_FLIGHT = REGISTRY.gauge("notion_bot_in_flight", "Pages currently in the worker pool")
+CACHE_LOOKUPS = REGISTRY.gauge("notion_bot_response_cache_lookups", "Response cache lookups by result", ["result"])
+MODEL_ROLLING_LATENCY = REGISTRY.gauge(
+    "notion_bot_model_rolling_latency_seconds", "Latency over the router's recent window per model", ["model", "quantile"]
+)
+MODEL_ROLLING_ERRORS = REGISTRY.gauge("notion_bot_model_rolling_error_rate", "Error rate over the router's recent window per model", ["model"])
+
+def collect_metrics():
+    IN_FLIGHT.set(prompt_pool.in_flight())
+    for result in ("hits", "near_hits", "misses"):
+        CACHE_LOOKUPS.set(response_cache.stats[result], result=result)
+    for name, stats in router.stats.items():
+        for quantile in (0.5, 0.95):
+            MODEL_ROLLING_LATENCY.set(stats.latency(quantile, 0), model=name, quantile=quantile)
+        MODEL_ROLLING_ERRORS.set(stats.error_rate(), model=name)
+
+REGISTRY.add_collector(collect_metrics)
+
+async def process_pages(pages):
+    """Run pages through generate and write, on the worker pool when it is enabled"""
+    if WORKER_POOL_MODE or WEBHOOK_MODE:
+        for p in pages:
+            prompt_pool.submit(p)
+        await prompt_pool.drain()
+    else:
+        for p in pages:
+            await process_page(p)
+
+async def process_page(page):
+    """Generate and write one page; True once its reply is in Notion"""
+    reply = await generate_reply(page)
+    return reply is not None and await write_reply(page, reply)
+
+async def unfinished_pages():
+    """Pages of the active tenant's jobs that a previous run left unfinished.
+
+    Each page is re-read first: one that is no longer pending (answered by
+    another instance, or edited meanwhile) just has its job closed.
+    """
+    tenant = active_tenant()
+    dead = await tenant.memory_db.get_dead_letter_page_ids()
+    pages = []
+    for job in await tenant.memory_db.get_unfinished_jobs():
+        if job["page_id"] in dead:
+            continue
+        page = await fetch_page(job["page_id"])
+        if page is None:
+            continue
+        if is_pending(page, unfinished_job=True):
+            pages.append(job_page(job))
+        else:
+            await tenant.memory_db.set_job_state(job["page_id"], "done")
+    if pages:
+        logging.info(f"Resuming {len(pages)} unfinished job(s) from the last run")
+    return pages
+
+async def resume_jobs():
+    """Finish jobs a previous run left unfinished, each from its last completed stage"""
+    pages = await unfinished_pages()
+    if pages:
+        await process_pages(pages)
+
+async def load_batches():
+    """Batches submitted by an earlier `batch` run that have not been collected yet"""
+    return json.loads(await active_tenant().memory_db.get_state(BATCH_STATE_KEY) or "[]")
+
+async def save_batches(batches):
+    await active_tenant().memory_db.set_state(BATCH_STATE_KEY, json.dumps(batches))
+
+def batch_model(prompt_tokens, max_tokens):
+    """Best routed model whose provider has a batch API, or None"""
+    for spec in router.rank(prompt_tokens, max_tokens):
+        if spec.provider in batch_backends:
+            return spec
+    return None
+
+async def submit_batches(pages, batches):
+    """Claim pages and submit their prompts as bulk jobs, one batch per model and BATCH_MAX_REQUESTS.
+
+    Pages with a saved reply or a response cache hit need no request and are
+    returned as (page, reply) pairs; pages no batch-capable model fits are
+    returned for the interactive pipeline. Each submitted batch is recorded
+    in bot_state before the next one goes out, so an interrupted run resumes
+    polling instead of paying twice; pages whose batch could not be
+    submitted are released again before the error is raised.
+    """
+    tenant = active_tenant()
+    worker_id = f"{WORKER_ID}-batch"
+    ready, interactive, requests = [], [], {}
+    for page in pages:
+        prompt_text = page["properties"]["Prompt"]["title"][0]["text"]["content"]
+        # Claimed under a separate worker id with a lease covering the whole batch window,
+        # so an interactive bot on the same host leaves these pages alone meanwhile
+        job = await claim_page(page["id"], prompt_text, worker_id, BATCH_TIMEOUT)
+        if job is None:
+            continue
+        if job["state"] in ("generated", "written"):
+            ready.append((page, await saved_reply(job)))
+            continue
+        messages, prompt_tokens, max_tokens = await build_context_messages(prompt_text)
+        if RESPONSE_CACHE:
+            cached = await tenant.response_cache.get(prompt_text, messages[:-1])
+            if cached is not None:
+                OPENAI_REQUESTS.inc(result="cache_hit")
+                await store_reply(page["id"], prompt_text, cached)
+                ready.append((page, cached))
+                continue
+        spec = batch_model(prompt_tokens, max_tokens)
+        if spec is None:
+            # Handed to the interactive pipeline, which claims the job under its own worker id
+            await tenant.memory_db.release_job(page["id"], worker_id)
+            interactive.append(page)
+            continue
+        requests.setdefault(spec.name, []).append({
+            "custom_id": page["id"],
+            "model": spec.model,
+            "messages": messages,
+            "max_tokens": router.reply_tokens(spec, prompt_tokens, max_tokens),
+            "temperature": spec.temperature if spec.temperature is not None else MODEL_TEMPERATURE,
+            "prompt": prompt_text,
+            "prompt_tokens": prompt_tokens,
+        })
+    specs = {spec.name: spec for spec in router.models}
+    unsubmitted = [r["custom_id"] for model_requests in requests.values() for r in model_requests]
+    for name, model_requests in requests.items():
+        backend = batch_backends[specs[name].provider]
+        for chunk in batched(model_requests, BATCH_MAX_REQUESTS):
             try:
-                res = await client.patch(url, headers=NOTION_HEADERS, json=payload, timeout=10)
-                if res.status_code != 200:
-                    logging.error(f"Failed to add comment block {i} to page {page_id}: {res.status_code}")
-                else:
-                    logging.info(f"Added response block {i} as comment to page {page_id}")
-            except Exception as e:
-                logging.error(f"Error adding comment block {i} to page {page_id}: {e}")
+                batch_id = await call_with_retries(
+                    lambda chunk=chunk: backend.submit(chunk), openai_limiter, RETRY_ATTEMPTS,
+                    classify=router.classify, description="Batch submit"
+                )
+            except Exception:
+                # Otherwise the jobs stay claimed for the whole BATCH_TIMEOUT lease
+                for page_id in unsubmitted:
+                    await tenant.memory_db.release_job(page_id, worker_id)
+                    await release_claim(page_id)
+                raise
+            del unsubmitted[:len(chunk)]
+            batches.append({
+                "id": batch_id,
+                "model": name,
+                "submitted": time.time(),
+                "pages": {r["custom_id"]: r["prompt"] for r in chunk},
+                "prompt_tokens": {r["custom_id"]: r["prompt_tokens"] for r in chunk},
+                "context": {r["custom_id"]: r["messages"][:-1] for r in chunk} if RESPONSE_CACHE else {},
+            })
+            await save_batches(batches)
+            logging.info(f"Submitted batch {batch_id}: {len(chunk)} prompt(s) for {name}")
+    return ready, interactive
+
+async def collect_batch(batch, state):
+    """Store a finished batch's replies like interactive ones; (page, reply) pairs to write"""
+    tenant = active_tenant()
+    spec = next((s for s in router.models if s.name == batch["model"]), None)
+    try:
+        results = await batch_backends[spec.provider].results(batch["id"]) if spec else {}
+    except Exception as e:
+        logging.error(f"Failed to read results of batch {batch['id']}: {e}")
+        results = {}
+    ready = []
+    for page_id, prompt_text in batch["pages"].items():
+        result = results.get(page_id)
+        if result is None or isinstance(result, Exception):
+            error = result or f"No reply in batch {batch['id']} ({state})"
+            logging.error(f"Batch request for page {page_id} failed: {error}")
+            OPENAI_REQUESTS.inc(result="error")
+            MODEL_REQUESTS.inc(model=batch["model"], result="error")
+            await fail_job(page_id, prompt_text, error)
+            continue
+        if result.prompt_tokens is None:
+            result.prompt_tokens = batch["prompt_tokens"][page_id]
+        if result.completion_tokens is None:
+            result.completion_tokens = count_tokens(result.text)
+        result.model = batch["model"]
+        result.cost = spec.cost(result.prompt_tokens, result.completion_tokens) * BATCH_COST_FACTOR
+        OPENAI_REQUESTS.inc(result="ok")
+        MODEL_REQUESTS.inc(model=batch["model"], result="batch")
+        MODEL_COST.inc(result.cost, model=batch["model"])
+        record_openai_usage(result)
+        await store_reply(page_id, prompt_text, result.text)
+        if RESPONSE_CACHE and page_id in batch["context"]:
+            await tenant.response_cache.put(prompt_text, batch["context"][page_id], result.text)
+        ready.append((job_page({"page_id": page_id, "prompt": prompt_text}), result.text))
+    return ready
+
+async def write_replies(ready):
+    """Write replies back to Notion concurrently (paced by the shared Notion rate limiter); the number written"""
+    semaphore = asyncio.Semaphore(NOTION_WRITE_CONCURRENCY)
+
+    async def write(page, reply):
+        async with semaphore:
+            return await write_reply(page, reply)
+
+    return sum(await asyncio.gather(*(write(page, reply) for page, reply in ready)))
+
+async def run_batch(args):
+    """`python main.py batch [--no-wait]`: answer the whole pending backlog through batch APIs.
+
+    Batches left by an earlier run are polled first; new pending pages are
+    submitted, then every batch is polled each BATCH_POLL_INTERVAL seconds
+    until it finishes (or BATCH_TIMEOUT passes) and its replies are written
+    back. With ``--no-wait`` it stops after submitting; run it again later
+    to collect. Prompts in one batch share the memory context that existed
+    when it was submitted.
+    """
+    if not is_configured():
+        logging.error("Missing required environment variables!")
+        return
+    await init_services()
+    try:
+        batches = await load_batches()
+        if batches:
+            logging.info(f"Resuming {len(batches)} batch(es) submitted by an earlier run")
+        submitted = {page_id for batch in batches for page_id in batch["pages"]}
+        pages = {}
+        for page in await unfinished_pages() + await get_pending_prompts(full_scan=True):
+            if page["id"] not in submitted:
+                pages.setdefault(page["id"], page)
+        ready, interactive = await submit_batches(list(pages.values()), batches)
+        written = await write_replies(ready)
+        if interactive:
+            logging.info(f"{len(interactive)} prompt(s) fit no batch-capable model, answering them directly")
+            await process_pages(interactive)
+        if "--no-wait" in args:
+            print(f"{len(batches)} batch(es) in flight; run `python main.py batch` again to collect them.")
+            return
+        while batches:
+            for batch in list(batches):
+                spec = next((s for s in router.models if s.name == batch["model"]), None)
+                try:
+                    state, done = await batch_backends[spec.provider].status(batch["id"]) if spec else ("failed", 0)
+                except Exception as e:
+                    logging.warning(f"Could not check batch {batch['id']}: {e}")
+                    continue
+                if state not in FINISHED_STATES and time.time() - batch["submitted"] < BATCH_TIMEOUT:
+                    logging.info(f"Batch {batch['id']} ({batch['model']}): {state}, {done}/{len(batch['pages'])} done")
+                    continue
+                logging.info(f"Batch {batch['id']} {state}: collecting {len(batch['pages'])} prompt(s)")
+                written += await write_replies(await collect_batch(batch, state))
+                batches.remove(batch)
+                await save_batches(batches)
+            if batches:
+                await asyncio.sleep(BATCH_POLL_INTERVAL)
+                SLEEP_SECONDS.inc(BATCH_POLL_INTERVAL, reason="batch_poll")
+        print(f"Batch run finished: {written} page(s) written, {pipeline_stats['failed']} failed.")
+        logging.info(f"Models: {router.describe()}")
+    finally:
+        await shutdown_services()
+
+async def reset_if_inactive(tenants, expire=None):
+    """Inactivity auto-reset and retention window, worked off in bounded batches.
+
+    After INACTIVITY_RESET_HOURS without activity every entry stored until
+    then is forgotten, in every tenant; with MEMORY_RETENTION_HOURS set,
+    entries older than that are forgotten continuously. Entries are only
+    deleted for the tenants in ``expire`` (all of them by default), at most
+    EXPIRY_MAX_BATCHES batches each per call, so a large table never holds
+    up the loop, and entries written after the cutoff are kept.
+    """
+    idle = activity.idle_seconds()
+    if idle is not None and idle > INACTIVITY_RESET_HOURS * 3600:
+        logging.info(f"No activity for {INACTIVITY_RESET_HOURS} hours. Resetting memory.")
+        now = datetime.now().isoformat()
+        for tenant in tenants:
+            # Each tenant works off its own cutoff, on its own polls
+            await tenant.memory_db.set_state(EXPIRY_CUTOFF_KEY, now)
+            await tenant.response_cache.clear()
+        activity.touch()  # Reset the timer; the entries are expired below over the next polls
+    retention = ""
+    if MEMORY_RETENTION_HOURS > 0:
+        retention = (datetime.now() - timedelta(hours=MEMORY_RETENTION_HOURS)).isoformat()
+    for tenant in tenants if expire is None else expire:
+        reset_cutoff = await tenant.memory_db.get_state(EXPIRY_CUTOFF_KEY, "")
+        cutoff = max(reset_cutoff, retention)
+        if not cutoff:
+            continue
+        expired = await tenant.memory_db.expire_entries(cutoff, batch_size=EXPIRY_BATCH_SIZE, max_batches=EXPIRY_MAX_BATCHES)
+        if expired:
+            tenant.semantic_index.discard(expired)
+            logging.info(f"[{tenant.name}] Expired {len(expired)} memory entries older than {cutoff[:19]}")
+        if reset_cutoff and len(expired) < EXPIRY_BATCH_SIZE * EXPIRY_MAX_BATCHES:
+            await tenant.memory_db.set_state(EXPIRY_CUTOFF_KEY, "")
+
+async def compact_memory(tenants, batch=None):
+    """Compact each tenant's oldest verbatim entries into summaries, drop archives beyond
+    MEMORY_ARCHIVE_ENTRIES and enforce MEMORY_MAX_ENTRIES.
+
+    Does one bounded batch per tenant per call; returns the number of entries compacted.
+    """
+    compacted = 0
+    for tenant in tenants:
+        if MEMORY_VERBATIM_ENTRIES > 0:
+            rows = await tenant.memory_db.get_compaction_candidates(MEMORY_VERBATIM_ENTRIES, batch or MEMORY_COMPACT_BATCH)
+            summaries = []
+            for entry_id, prompt, response in rows:
+                try:
+                    summaries.append((entry_id, await summarizer.summarize(prompt, response or "")))
+                except Exception as e:
+                    logging.error(f"[{tenant.name}] Failed to summarize memory entry {entry_id}: {e}")
+                    break
+            count = await tenant.memory_db.compact_entries(summaries)
+            if count:
+                logging.info(f"[{tenant.name}] Compacted {count} memory entries ({summarizer.name})")
+            compacted += count
+        if MEMORY_ARCHIVE_ENTRIES > 0:
+            dropped = await tenant.memory_db.drop_archives(MEMORY_ARCHIVE_ENTRIES, EXPIRY_BATCH_SIZE)
+            if dropped:
+                logging.info(f"[{tenant.name}] Dropped the archived replies of {dropped} memory entries")
+        if MEMORY_MAX_ENTRIES > 0:
+            expired = await tenant.memory_db.expire_entries(
+                datetime.now().isoformat(), keep=MEMORY_MAX_ENTRIES, batch_size=EXPIRY_BATCH_SIZE, max_batches=EXPIRY_MAX_BATCHES
+            )
+            if expired:
+                tenant.semantic_index.discard(expired)
+                logging.info(f"[{tenant.name}] Dropped {len(expired)} memory entries over MEMORY_MAX_ENTRIES")
+    return compacted
+
+async def run_tenants(configs):
+    """Serve every configured database from this one process with the fair scheduler"""
+    global tenant_scheduler
+    tenants = [make_tenant(config) for config in configs]
+    if NOTION_DB_ID and NOTION_API_KEY:
+        tenants.insert(0, default_tenant)
+    for tenant in tenants:
+        if CONTEXT_MODE == "semantic" and tenant is not default_tenant:
+            await tenant.semantic_index.load()
+        await tenant.notion_client.open()
+
+    async def poll(tenant):
+        await reset_if_inactive(tenants, expire=[tenant])
+        await compact_memory([tenant])
+        pages = await get_pending_prompts(full_scan=tenant.stats["polls"] % max(1, FULL_SCAN_EVERY) == 0)
+        dead = await tenant.memory_db.get_dead_letter_page_ids()
+        return [p for p in pages if p["id"] not in dead]
+
+    scheduler = TenantScheduler(
+        tenants, poll, process_page,
+        workers=OPENAI_CONCURRENCY,
+        min_interval=MIN_POLL_INTERVAL,
+        max_interval=MAX_POLL_INTERVAL,
+        poll_concurrency=POLL_CONCURRENCY,
+        jitter=JITTER,
+    )
+    for tenant in tenants:
+        token = current_tenant.set(tenant)
+        try:
+            scheduler.enqueue(tenant, await unfinished_pages())
+        finally:
+            current_tenant.reset(token)
+    tenant_scheduler = scheduler
+    try:
+        await scheduler.run()
+    finally:
+        tenant_scheduler = None
+        logging.info(f"Tenants: {scheduler.describe()}")
+        logging.info(f"Models: {router.describe()}")
+        for tenant in tenants:
+            await tenant.notion_client.close()
 
 async def continuous_polling():
     consecutive_empty = 0
+    consecutive_errors = 0
     base_interval = MIN_POLL_INTERVAL
+    polls = 0
     while True:
         try:
-            # Inactivity auto-reset logic
-            last_activity = get_last_activity()
-            if last_activity and (datetime.now() - last_activity).total_seconds() > INACTIVITY_RESET_HOURS * 3600:
-                logging.info(f"No activity for {INACTIVITY_RESET_HOURS} hours. Resetting memory.")
-                await memory_db.clear()
-                update_last_activity()  # Reset the timer after clearing
+            await reset_if_inactive([default_tenant])
+            await compact_memory([default_tenant])
 
             logging.info("Checking for prompts...")
-            prompts = await get_pending_prompts()
+            prompts = await get_pending_prompts(full_scan=polls % max(1, FULL_SCAN_EVERY) == 0)
+            polls += 1
+            dead = await memory_db.get_dead_letter_page_ids()
+            prompts = [p for p in prompts if p["id"] not in dead]
             if prompts:
                 consecutive_empty = 0
                 logging.info(f"Found {len(prompts)} pending prompts.")
-                for p in prompts:
-                    prompt_text = p["properties"]["Prompt"]["title"][0]["text"]["content"]
-                    page_id = p["id"]
-                    logging.info(f"Processing: {prompt_text[:50]}...")
-
-                    # Use previous context for ChatGPT
-                    reply = await ask_chatgpt_with_context(prompt_text)
-
-                    # Extract code blocks for memory storage
-                    _, extracted_codes = extract_code_blocks(reply)
-
-                    # Store in memory DB
-                    await memory_db.add_entry(prompt_text, reply, page_id, extracted_codes)
-
-                    if await update_response(page_id, reply):
-                        logging.info(f"Updated page: {page_id}")
-                    else:
-                        logging.error(f"Failed to update page: {page_id}")
-                    update_last_activity()  # Update on every processed prompt
-                    await asyncio.sleep(random.uniform(PROMPT_DELAY_MIN, PROMPT_DELAY_MAX))
+                await process_pages(prompts)
+                logging.info(f"Notion client: {notion_client.describe()}")
+                logging.info(f"Models: {router.describe()}")
+                if RESPONSE_CACHE:
+                    logging.info(f"Response cache: {response_cache.describe()}")
+                if claim_store:
+                    logging.info(f"Work claims: {claim_store.describe()}")
                 sleep_time = max(1, base_interval - 10)
             else:
                 consecutive_empty += 1
@@ -337,51 +1188,200 @@ async def continuous_polling():
                     sleep_time = min(MAX_POLL_INTERVAL, base_interval + consecutive_empty * 10)
                 else:
                     sleep_time = base_interval
+            if WEBHOOK_MODE:
+                # Webhooks deliver new prompts; polling is only a reconciliation sweep
+                sleep_time = RECONCILE_INTERVAL
             jitter = random.uniform(-JITTER, JITTER)
             actual_sleep = max(1, sleep_time + jitter)
             logging.info(f"Sleeping for {actual_sleep:.1f} seconds...")
+            SLEEP_SECONDS.inc(actual_sleep, reason="poll_interval")
+            consecutive_errors = 0
             await asyncio.sleep(actual_sleep)
         except KeyboardInterrupt:
             logging.info("Bot stopped by user")
             break
         except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-            await asyncio.sleep(60)
+            consecutive_errors += 1
+            delay = min(MAX_POLL_INTERVAL, 5 * 2 ** (consecutive_errors - 1))
+            logging.error(f"Unexpected error: {e} (retrying in {delay}s)")
+            SLEEP_SECONDS.inc(delay, reason="error_backoff")
+            await asyncio.sleep(delay)
+
+def is_configured():
+    """True if there is an OpenAI key and at least one Notion database to serve"""
+    return bool(OPENAI_API_KEY and (TENANTS_FILE or (NOTION_DB_ID and NOTION_API_KEY)))
+
+async def run_bot():
+    """Resume unfinished jobs, then poll (or run the multi-tenant scheduler) until cancelled.
+
+    Expects init_services() to have run; main() and the web app both host it.
+    """
+    if TENANTS_FILE:
+        await run_tenants(load_tenant_config(TENANTS_FILE))
+    else:
+        await resume_jobs()
+        await continuous_polling()
 
 async def main():
     logging.info("Starting Notion AI Bot with async mode...")
-    if not all([NOTION_DB_ID, NOTION_API_KEY, OPENAI_API_KEY]):
+    if not is_configured():
         logging.error("Missing required environment variables!")
         return
+    await init_services()
+    try:
+        await run_bot()
+    finally:
+        await shutdown_services()
+
+async def init_services():
+    """Open the memory database, caches and the Notion client"""
     await memory_db.init()
-    await continuous_polling()
+    await response_cache.init()
+    await activity.load()
+    if CONTEXT_MODE == "semantic":
+        await semantic_index.load()
+    await notion_client.open()
+    if claim_store:
+        await claim_store.open()
 
-if __name__ == "__main__":
-    import sys
-    import asyncio
-    
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "memory":
+async def shutdown_services():
+    await prompt_pool.stop()
+    if claim_store:
+        await claim_store.close()
+    await notion_client.close()
+    await activity.flush()
+    await memory_db.close()
+
+async def dead_letters_cli(args):
+    """List failed work, retry it (saved replies are written without a new OpenAI call), or clear it"""
+    tenant = active_tenant()
+    entries = await tenant.memory_db.get_dead_letters()
+    if not args:
+        print(f"Dead letters: {len(entries)}")
+        for entry_id, timestamp, page_id, stage, error, payload in entries:
+            print(f"- {timestamp} [{stage}] {page_id}: {error}")
+    elif args[0] == "retry":
+        for entry_id, timestamp, page_id, stage, error, payload in entries:
+            if stage == "write" and payload:
+                if not await update_response(page_id, payload):
+                    print(f"Still failing: {page_id}")
+                    continue
+                await tenant.memory_db.set_job_state(page_id, "done")
+            elif stage == "generate":
+                # Picked up again by the next full scan, once a leftover streaming preview is gone
+                page = await fetch_page(page_id)
+                if page and has_partial_response(page) and not await clear_partial_response(page_id):
+                    print(f"Still failing: {page_id}")
+                    continue
+            await tenant.memory_db.delete_dead_letters(page_id)
+            print(f"Retried: {page_id} [{stage}]")
+        await tenant.notion_client.close()
+    elif args[0] == "clear":
+        await tenant.memory_db.delete_dead_letters()
+        print("Dead letters cleared.")
+
+async def code_cli(tenant, args):
+    """Stored code blocks: counts per language, one language's blocks, or export them to files"""
+    export_dir = None
+    if "--export" in args:
+        i = args.index("--export")
+        export_dir, args = args[i + 1], args[:i] + args[i + 2:]
+    language = args[0] if args else None
+    if not language and not export_dir:
+        print("Code blocks by language (blocks / distinct / bytes):")
+        for lang, blocks, distinct, size in await tenant.memory_db.code_block_stats():
+            print(f"- {lang}: {blocks} / {distinct} / {size}")
+        return
+    blocks = await tenant.memory_db.get_code_blocks(language)
+    if export_dir:
+        # One file per distinct snippet, named by content hash
+        os.makedirs(export_dir, exist_ok=True)
+        written = {}
+        for block in blocks:
+            filename = os.path.join(export_dir, export_filename(block["hash"], block["language"]))
+            if filename not in written:
+                with open(filename, "w", encoding="utf-8") as f:
+                    f.write(block["code"])
+                written[filename] = block
+        print(f"Exported {len(written)} distinct code block(s) ({len(blocks)} total) to {export_dir}")
+        return
+    print(f"{len(blocks)} {language} code block(s):")
+    for block in blocks:
+        print(f"- {block['timestamp'][:19]} {block['hash'][:12]} {block['size']}B: {block['prompt'][:80]}")
+
+async def run_cli(args):
+    """Run a memory CLI command on a single connection/event loop.
+
+    ``--tenant NAME`` runs it against a TENANTS_FILE tenant's memory namespace.
+    """
+    usage = "Usage: python main.py [batch [--no-wait]|memory|search [--rerank] <query>|entry <id>|code [language] [--export DIR]|compact|deadletters [retry|clear]|reset] [--tenant NAME]"
+    await memory_db.init()
+    await response_cache.init()
+    if "--tenant" in args:
+        i = args.index("--tenant")
+        name, args = (args[i + 1:] or [None])[0], args[:i] + args[i + 2:]
+        configs = {config["name"]: config for config in load_tenant_config(TENANTS_FILE)} if TENANTS_FILE else {}
+        if name not in configs:
+            print(f"Unknown tenant: {name}" if name else usage)
+            await memory_db.close()
+            return
+        current_tenant.set(make_tenant(configs[name]))
+    tenant = active_tenant()
+    try:
+        if not args:
+            print(usage)
+        elif args[0] == "memory":
             # Show memory statistics
-            count = asyncio.run(memory_db.count())
-            print(f"Total prompts processed: {count}")
+            count = await tenant.memory_db.count()
+            print(f"Total prompts processed: {count} ({await tenant.memory_db.count_compacted()} compacted)")
             print("\nRecent prompts:")
-            recent = asyncio.run(memory_db.get_recent_entries(5))
+            recent = await tenant.memory_db.get_recent_entries(5)
             for entry in recent:
-                timestamp, prompt, response, code_blocks = entry
-                code_info = f" ({len(ast.literal_eval(code_blocks))} code blocks)" if code_blocks else ""
-                print(f"- {timestamp}: {prompt[:100]}...{code_info}")
-        elif sys.argv[1] == "search" and len(sys.argv) > 2:
-            # Search memory
-            query = " ".join(sys.argv[2:])
-            results = asyncio.run(memory_db.search_memory(query))
+                timestamp, prompt, response, code_count, entry_id = entry
+                code_info = f" ({code_count} code blocks)" if code_count else ""
+                print(f"- #{entry_id} {timestamp}: {prompt[:100]}...{code_info}")
+        elif args[0] == "search" and len([a for a in args[1:] if a != "--rerank"]) > 0:
+            # Search memory (full-text, BM25 ranked; --rerank re-orders the top hits by fuzzy similarity)
+            rerank = "--rerank" in args
+            query = " ".join(a for a in args[1:] if a != "--rerank")
+            results = await tenant.memory_db.search_memory(query, rerank=rerank)
             print(f"Search results for '{query}':")
-            for similarity, prompt, response, timestamp, code_blocks in results:
-                print(f"- {similarity:.2f}: {prompt[:100]}...")
-        elif sys.argv[1] == "reset":
-            asyncio.run(memory_db.clear())
+            for score, prompt, response, timestamp, code_count, entry_id in results:
+                # BM25 scores on a small archive are tiny, so keep significant digits rather than decimals
+                print(f"- #{entry_id} {score:.4g}: {prompt[:100]}...")
+        elif args[0] == "entry" and len(args) > 1 and args[1].isdigit():
+            # Show one entry in full; a compacted entry's original reply comes back from its archive
+            entry = await tenant.memory_db.get_entry(int(args[1]))
+            if entry is None:
+                print(f"No memory entry #{args[1]}")
+            else:
+                timestamp, prompt, response, _ = entry
+                print(f"#{args[1]} ({timestamp})\n\nPrompt:\n{prompt}\n\nResponse:\n{response}")
+        elif args[0] == "code":
+            await code_cli(tenant, args[1:])
+        elif args[0] == "compact":
+            # Compact everything outside the verbatim tier now instead of a batch per poll
+            total = 0
+            while count := await compact_memory([tenant], batch=500):
+                total += count
+            print(f"Compacted {total} memory entries.")
+        elif args[0] == "deadletters":
+            await dead_letters_cli(args[1:])
+        elif args[0] == "reset":
+            await tenant.memory_db.clear()
+            await tenant.response_cache.clear()
             print("Memory reset. All previous prompts forgotten.")
         else:
-            print("Usage: python main.py [memory|search <query>|reset]")
+            print(usage)
+    finally:
+        await memory_db.close()
+
+if __name__ == "__main__":
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        asyncio.run(run_batch(sys.argv[2:]))
+    elif len(sys.argv) > 1:
+        asyncio.run(run_cli(sys.argv[1:]))
     else:
-        asyncio.run(main())
\ No newline at end of file
+        asyncio.run(main())
@@ -1,63 +1,790 @@
+import asyncio
+import json
+import logging
+import re
+import time
+import zlib
 import aiosqlite
 from datetime import datetime
 import ast
+from tokens import count_tokens
+from code_extractor import code_hash
+from metrics import MEMORY_DB_SECONDS, instrument_methods
+
+# Connection tuning applied once when the long-lived connection is opened.
+# WAL lets readers run alongside the writer and makes commits append-only;
+# synchronous=NORMAL is durable under WAL except for power loss.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA busy_timeout=5000",
+)
+
+# SQL is kept in constants so every call hits sqlite3's per-connection
+# prepared statement cache instead of re-preparing the query.
+INSERT_ENTRY_SQL = (
+    "INSERT INTO memory (timestamp, page_id, prompt, response, code_blocks, prompt_tokens, response_tokens, namespace) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+CONTEXT_COLUMNS = "id, prompt, response, prompt_tokens, response_tokens"
+RECENT_PROMPTS_SQL = "SELECT prompt, response FROM memory WHERE namespace = ? ORDER BY id DESC LIMIT ?"
+CODE_COUNT_SQL = "(SELECT COUNT(*) FROM code_blocks c WHERE c.memory_id = {}.id)"
+RECENT_ENTRIES_SQL = (
+    f"SELECT timestamp, prompt, response, {CODE_COUNT_SQL.format('memory')}, id FROM memory "
+    "WHERE namespace = ? ORDER BY id DESC LIMIT ?"
+)
+# Expiry first looks up the newest expired entry with one seek on
+# idx_memory_namespace_timestamp, then deletes oldest-first batches walked
+# along idx_memory_namespace up to that id, so only expired rows are read
+# (timestamps grow with ids; the timestamp check guards against clock steps).
+EXPIRY_CUTOFF_ID_SQL = (
+    "SELECT id FROM memory WHERE namespace = ? AND timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 1"
+)
+EXPIRED_IDS_SQL = "SELECT id FROM memory WHERE namespace = ? AND id <= ? AND timestamp < ? ORDER BY id LIMIT ?"
+
+# Memory tiers: the newest entries stay verbatim; older ones are compacted,
+# i.e. their response is replaced by a short summary (which is what context,
+# search and the FTS index then see) and the original response and code
+# blocks are kept zlib-compressed in the ``archive`` column. Past a further
+# bound the archive itself is dropped and only the summary remains. The partial
+# indexes cover only verbatim / archived rows, so finding the next ones to
+# compact or strip does not walk over everything already done.
+COMPACTION_CANDIDATES_SQL = (
+    "SELECT id, prompt, response FROM memory WHERE namespace = ? AND compacted = 0 AND id < ? ORDER BY id LIMIT ?"
+)
+ARCHIVED_IDS_SQL = (
+    "SELECT id FROM memory WHERE namespace = ? AND archive IS NOT NULL AND id < ? ORDER BY id LIMIT ?"
+)
+
+# Columns added after the original schema; init() adds any that are missing
+# so older databases are migrated in place.
+MEMORY_COLUMNS = (
+    ("prompt_tokens", "INTEGER"),
+    ("response_tokens", "INTEGER"),
+    ("namespace", "TEXT NOT NULL DEFAULT ''"),
+    ("compacted", "INTEGER NOT NULL DEFAULT 0"),
+    ("archive", "BLOB"),
+)
+NAMESPACE_COLUMNS = (("namespace", "TEXT NOT NULL DEFAULT ''"),)
+
+# Full-text index over the memory table. It is an external-content FTS5 table,
+# so the text is stored once (in memory) and the triggers keep the index in
+# step with every insert, update and delete. Code is searched as part of the
+# reply text it came in; the code tables hold no separate index.
+FTS_SCHEMA = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+        prompt, response,
+        content='memory', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_fts_insert AFTER INSERT ON memory BEGIN
+        INSERT INTO memory_fts (rowid, prompt, response)
+        VALUES (new.id, new.prompt, new.response);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_fts_delete AFTER DELETE ON memory BEGIN
+        INSERT INTO memory_fts (memory_fts, rowid, prompt, response)
+        VALUES ('delete', old.id, old.prompt, old.response);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_fts_update AFTER UPDATE OF prompt, response ON memory BEGIN
+        INSERT INTO memory_fts (memory_fts, rowid, prompt, response)
+        VALUES ('delete', old.id, old.prompt, old.response);
+        INSERT INTO memory_fts (rowid, prompt, response)
+        VALUES (new.id, new.prompt, new.response);
+    END
+    """,
+)
+# Dropped before FTS_SCHEMA recreates them when an older database still has
+# the index with its always-empty code_blocks column
+FTS_DROP = (
+    "DROP TRIGGER IF EXISTS memory_fts_insert",
+    "DROP TRIGGER IF EXISTS memory_fts_delete",
+    "DROP TRIGGER IF EXISTS memory_fts_update",
+    "DROP TABLE IF EXISTS memory_fts",
+)
+# bm25() weights per column: prompt matches count five times a response match.
+# bm25 is "lower is better", so it is negated into a positive score.
+SEARCH_SQL = """
+    SELECT -bm25(memory_fts, 10.0, 2.0) AS score,
+           m.prompt, m.response, m.timestamp, {code_count}, m.id
+    FROM memory_fts
+    JOIN memory m ON m.id = memory_fts.rowid
+    WHERE memory_fts MATCH ? AND m.namespace = ?
+    ORDER BY bm25(memory_fts, 10.0, 2.0)
+    LIMIT ?
+""".format(code_count=CODE_COUNT_SQL.format("m"))
+
+# One embedding per memory entry, stored as a raw float32 blob. Rows go away
+# with their memory entry.
+VECTOR_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS memory_vectors (
+        memory_id INTEGER PRIMARY KEY,
+        model TEXT,
+        vector BLOB
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_vectors_delete AFTER DELETE ON memory BEGIN
+        DELETE FROM memory_vectors WHERE memory_id = old.id;
+    END
+    """,
+)
+
+# Code blocks extracted from replies, one row per block of a memory entry.
+# The code itself is stored once per distinct content hash in code_snippets,
+# so a snippet repeated across replies costs one copy. Rows go away with
+# their memory entry, and a snippet with it once nothing refers to it.
+CODE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS code_snippets (
+        hash TEXT PRIMARY KEY,
+        code TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS code_blocks (
+        memory_id INTEGER,
+        position INTEGER,
+        language TEXT,
+        hash TEXT,
+        size INTEGER,
+        namespace TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (memory_id, position)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_code_blocks_language ON code_blocks (namespace, language, memory_id)",
+    "CREATE INDEX IF NOT EXISTS idx_code_blocks_hash ON code_blocks (hash)",
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_code_blocks_delete AFTER DELETE ON memory BEGIN
+        DELETE FROM code_blocks WHERE memory_id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS code_snippets_release AFTER DELETE ON code_blocks BEGIN
+        DELETE FROM code_snippets WHERE hash = old.hash
+            AND NOT EXISTS (SELECT 1 FROM code_blocks WHERE hash = old.hash);
+    END
+    """,
+)
+INSERT_SNIPPET_SQL = "INSERT OR IGNORE INTO code_snippets (hash, code) VALUES (?, ?)"
+INSERT_CODE_BLOCK_SQL = (
+    "INSERT OR REPLACE INTO code_blocks (memory_id, position, language, hash, size, namespace) VALUES (?, ?, ?, ?, ?, ?)"
+)
+# bot_state key set once memory.code_blocks strings have been moved into the tables
+CODE_MIGRATED_KEY = "code_blocks_migrated"
+
+# Small key/value store for bot state that must survive restarts
+STATE_SCHEMA = "CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT)"
+
+# Work that failed after all retries. Pages listed here are skipped by the
+# poller until the entry is retried or cleared from the CLI.
+DEAD_LETTER_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS dead_letters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        page_id TEXT,
+        stage TEXT,
+        error TEXT,
+        payload TEXT,
+        namespace TEXT NOT NULL DEFAULT ''
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_dead_letters_page ON dead_letters (page_id)",
+)
+
+# One row per Notion page: how far its prompt has got through the pipeline.
+# fetched -> generated (reply saved) -> written (Notion updated) -> done;
+# failed once the prompt is dead-lettered. A worker claims a job before
+# working on it; claims expire after a lease so a crashed worker's jobs are
+# picked up again.
+JOB_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        page_id TEXT PRIMARY KEY,
+        prompt TEXT,
+        state TEXT,
+        reply TEXT,
+        memory_id INTEGER,
+        attempts INTEGER DEFAULT 0,
+        claimed_by TEXT,
+        claimed_at REAL,
+        created_at TEXT,
+        updated_at TEXT,
+        error TEXT,
+        namespace TEXT NOT NULL DEFAULT ''
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state)",
+)
+JOB_COLUMNS = ("page_id", "prompt", "state", "reply", "memory_id", "attempts", "claimed_by", "claimed_at", "error")
+JOB_SQL = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE page_id = ?"
+UNFINISHED_STATES = ("fetched", "generated", "written")
+
+def build_fts_query(query):
+    """Turn free text into an FTS5 query: words are quoted and OR-ed, and words of 2+ chars are prefix-matched"""
+    terms = re.findall(r"\w+", query.lower())
+    return " OR ".join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
 
 class MemoryDB:
-    def __init__(self, db_path="notion_bot_memory.db"):
+    """Async SQLite store for memory, bot state, jobs and dead letters.
+
+    Rows belong to a namespace (one per Notion database); ``namespaced()``
+    returns a view that shares this connection but only sees its own rows.
+    The default namespace is the empty string.
+    """
+
+    def __init__(self, db_path="notion_bot_memory.db", namespace=""):
         self.db_path = db_path
+        self.namespace = namespace
+        self._root = self
+        self._db = None
+        self._open_lock = asyncio.Lock()
+
+    def namespaced(self, namespace):
+        """A MemoryDB over the same database and connection, scoped to ``namespace``"""
+        view = MemoryDB(self.db_path, namespace)
+        view._root = self._root
+        return view
+
+    def _state_key(self, key):
+        return f"{self.namespace}:{key}" if self.namespace else key
+
+    async def _conn(self):
+        """Return the shared connection, opening it on first use"""
+        if self._root is not self:
+            return await self._root._conn()
+        if self._db is None:
+            async with self._open_lock:
+                if self._db is None:
+                    db = await aiosqlite.connect(self.db_path, cached_statements=256)
+                    for pragma in PRAGMAS:
+                        await db.execute(pragma)
+                    self._db = db
+        return self._db
+
+    async def connection(self):
+        """Shared connection for stores kept in the same database file"""
+        return await self._conn()
 
     async def init(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS memory (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT,
-                    page_id TEXT,
-                    prompt TEXT,
-                    response TEXT,
-                    code_blocks TEXT
-                )
-            """)
+        db = await self._conn()
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS memory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                page_id TEXT,
+                prompt TEXT,
+                response TEXT,
+                code_blocks TEXT
+            )
+        """)
+        await self.ensure_columns("memory", MEMORY_COLUMNS)
+        # id is the rowid, so it is already indexed; timestamp gets its own index
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_memory_timestamp ON memory (timestamp)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_memory_namespace ON memory (namespace, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_memory_namespace_timestamp ON memory (namespace, timestamp)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_memory_verbatim ON memory (namespace, id) WHERE compacted = 0")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_memory_archived ON memory (namespace, id) WHERE archive IS NOT NULL")
+        async with db.execute("SELECT sql FROM sqlite_master WHERE name = 'memory_fts'") as cursor:
+            row = await cursor.fetchone()
+        fts_exists = row is not None and "code_blocks" not in row[0]
+        if row is not None and not fts_exists:
+            for statement in FTS_DROP:
+                await db.execute(statement)
+        for statement in FTS_SCHEMA:
+            await db.execute(statement)
+        if not fts_exists:
+            # First run on an existing database (or on the older index layout): index the rows already stored
+            await db.execute("INSERT INTO memory_fts (memory_fts) VALUES ('rebuild')")
+        for statement in VECTOR_SCHEMA:
+            await db.execute(statement)
+        for statement in CODE_SCHEMA:
+            await db.execute(statement)
+        await db.execute(STATE_SCHEMA)
+        for statement in DEAD_LETTER_SCHEMA:
+            await db.execute(statement)
+        for statement in JOB_SCHEMA:
+            await db.execute(statement)
+        for table in ("dead_letters", "jobs"):
+            await self.ensure_columns(table, NAMESPACE_COLUMNS)
+        await db.commit()
+        await self._migrate_code_blocks()
+
+    async def _migrate_code_blocks(self, batch_size=500):
+        """One-time move of the old ``str(list)`` code_blocks column into the code tables"""
+        db = await self._conn()
+        async with db.execute("SELECT value FROM bot_state WHERE key = ?", (CODE_MIGRATED_KEY,)) as cursor:
+            if await cursor.fetchone():
+                return
+        migrated = 0
+        while True:
+            async with db.execute(
+                "SELECT id, code_blocks, namespace FROM memory WHERE code_blocks IS NOT NULL LIMIT ?", (batch_size,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                break
+            for memory_id, code_blocks, namespace in rows:
+                try:
+                    blocks = ast.literal_eval(code_blocks) if code_blocks else []
+                except (ValueError, SyntaxError):
+                    blocks = []
+                await self._insert_code_blocks(db, memory_id, blocks, namespace)
+                migrated += len(blocks)
+            await db.executemany("UPDATE memory SET code_blocks = NULL WHERE id = ?", [(row[0],) for row in rows])
             await db.commit()
+        await db.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (CODE_MIGRATED_KEY, datetime.now().isoformat()))
+        await db.commit()
+        if migrated:
+            logging.info(f"Moved {migrated} stored code block(s) into the code_blocks table")
+
+    @staticmethod
+    async def _insert_code_blocks(db, memory_id, blocks, namespace):
+        """Insert a memory entry's code blocks (dicts with language and code); the caller commits"""
+        for position, block in enumerate(blocks):
+            code = block.get("code", "")
+            digest = code_hash(code)
+            language = (block.get("language") or "text").lower()
+            await db.execute(INSERT_SNIPPET_SQL, (digest, code))
+            await db.execute(INSERT_CODE_BLOCK_SQL, (memory_id, position, language, digest, len(code.encode()), namespace))
+
+    async def ensure_columns(self, table, columns):
+        """Add any of the (name, type) columns missing from an existing table"""
+        db = await self._conn()
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        for column, column_type in columns:
+            if column not in existing:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    async def close(self):
+        """Close the shared connection (a namespaced view leaves it to its parent)"""
+        if self._root is self and self._db is not None:
+            db, self._db = self._db, None
+            await db.close()
 
     async def add_entry(self, prompt, response, page_id, code_blocks=None):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "INSERT INTO memory (timestamp, page_id, prompt, response, code_blocks) VALUES (?, ?, ?, ?, ?)",
-                (datetime.now().isoformat(), page_id, prompt, response, str(code_blocks or []))
-            )
-            await db.commit()
+        """Store an exchange and its extracted code blocks (dicts with language and code)"""
+        db = await self._conn()
+        cursor = await db.execute(
+            INSERT_ENTRY_SQL,
+            (datetime.now().isoformat(), page_id, prompt, response, None,
+             count_tokens(prompt), count_tokens(response), self.namespace)
+        )
+        await self._insert_code_blocks(db, cursor.lastrowid, code_blocks or [], self.namespace)
+        await db.commit()
+        return cursor.lastrowid
+
+    async def get_code_blocks(self, language=None, limit=None):
+        """Stored code blocks, newest entry first, as dicts (memory_id, position, language, hash, size, timestamp, prompt, code)"""
+        db = await self._conn()
+        sql = (
+            "SELECT c.memory_id, c.position, c.language, c.hash, c.size, m.timestamp, m.prompt, s.code "
+            "FROM code_blocks c JOIN code_snippets s ON s.hash = c.hash JOIN memory m ON m.id = c.memory_id "
+            "WHERE c.namespace = ?"
+        )
+        params = [self.namespace]
+        if language:
+            sql += " AND c.language = ?"
+            params.append(language.lower())
+        sql += " ORDER BY c.memory_id DESC, c.position"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        columns = ("memory_id", "position", "language", "hash", "size", "timestamp", "prompt", "code")
+        async with db.execute(sql, params) as cursor:
+            return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+
+    async def code_block_stats(self):
+        """(language, blocks, distinct snippets, total bytes) per language, most blocks first"""
+        db = await self._conn()
+        async with db.execute(
+            "SELECT language, COUNT(*), COUNT(DISTINCT hash), SUM(size) FROM code_blocks "
+            "WHERE namespace = ? GROUP BY language ORDER BY COUNT(*) DESC",
+            (self.namespace,)
+        ) as cursor:
+            return await cursor.fetchall()
 
     async def get_recent_prompts(self, limit=10):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT prompt, response FROM memory ORDER BY id DESC LIMIT ?", (limit,)) as cursor:
-                return await cursor.fetchall()
+        db = await self._conn()
+        async with db.execute(RECENT_PROMPTS_SQL, (self.namespace, limit)) as cursor:
+            return await cursor.fetchall()
 
     async def get_recent_entries(self, limit=10):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT timestamp, prompt, response, code_blocks FROM memory ORDER BY id DESC LIMIT ?", (limit,)) as cursor:
-                return await cursor.fetchall()
-
-    async def search_memory(self, query, limit=10):
-        import difflib
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT prompt, response, timestamp, code_blocks FROM memory") as cursor:
-                all_entries = await cursor.fetchall()
-                results = []
-                for prompt, response, timestamp, code_blocks in all_entries:
-                    similarity = difflib.SequenceMatcher(None, query.lower(), prompt.lower()).ratio()
-                    if similarity > 0.3:
-                        results.append((similarity, prompt, response, timestamp, code_blocks))
-                results.sort(key=lambda x: x[0], reverse=True)
-                return results[:limit]
+        db = await self._conn()
+        async with db.execute(RECENT_ENTRIES_SQL, (self.namespace, limit)) as cursor:
+            return await cursor.fetchall()
+
+    async def get_context_entries(self, limit=10, ids=None):
+        """Context rows (prompt, response, prompt_tokens, response_tokens), most relevant first.
+
+        Takes the latest ``limit`` entries, newest first, or the given entry
+        ``ids`` in the order given (e.g. most similar first). Token counts are
+        cached in the row; rows written before the columns existed are counted
+        once here and saved.
+        """
+        db = await self._conn()
+        if ids is not None:
+            if not ids:
+                return []
+            placeholders = ",".join("?" * len(ids))
+            sql = f"SELECT {CONTEXT_COLUMNS} FROM memory WHERE id IN ({placeholders})"
+            params = tuple(ids)
+        else:
+            sql = f"SELECT {CONTEXT_COLUMNS} FROM memory WHERE namespace = ? ORDER BY id DESC LIMIT ?"
+            params = (self.namespace, limit)
+        async with db.execute(sql, params) as cursor:
+            rows = await cursor.fetchall()
+        if ids is not None:
+            order = {entry_id: i for i, entry_id in enumerate(ids)}
+            rows.sort(key=lambda row: order[row[0]])
+        entries = []
+        missing = []
+        for entry_id, prompt, response, prompt_tokens, response_tokens in rows:
+            if prompt_tokens is None or response_tokens is None:
+                prompt_tokens, response_tokens = count_tokens(prompt), count_tokens(response)
+                missing.append((prompt_tokens, response_tokens, entry_id))
+            entries.append((prompt, response, prompt_tokens, response_tokens))
+        if missing:
+            await db.executemany("UPDATE memory SET prompt_tokens = ?, response_tokens = ? WHERE id = ?", missing)
+            await db.commit()
+        return entries
+
+    async def add_vectors(self, rows):
+        """Store (memory_id, model, vector_bytes) rows, replacing any existing vector"""
+        db = await self._conn()
+        await db.executemany(
+            "INSERT OR REPLACE INTO memory_vectors (memory_id, model, vector) VALUES (?, ?, ?)", rows
+        )
+        await db.commit()
+
+    async def get_entries_without_vector(self, model, limit=256):
+        db = await self._conn()
+        async with db.execute(
+            """SELECT m.id, m.prompt FROM memory m
+               LEFT JOIN memory_vectors v ON v.memory_id = m.id AND v.model = ?
+               WHERE v.memory_id IS NULL AND m.namespace = ? ORDER BY m.id LIMIT ?""",
+            (model, self.namespace, limit)
+        ) as cursor:
+            return await cursor.fetchall()
+
+    async def get_vectors(self, model):
+        db = await self._conn()
+        async with db.execute(
+            """SELECT v.memory_id, v.vector FROM memory_vectors v
+               JOIN memory m ON m.id = v.memory_id
+               WHERE v.model = ? AND m.namespace = ? ORDER BY v.memory_id""",
+            (model, self.namespace)
+        ) as cursor:
+            return await cursor.fetchall()
+
+    async def search_memory(self, query, limit=10, rerank=False):
+        """Ranked full-text search over prompts and responses (code included, as it appears in the reply).
+
+        Results come back best-first as (score, prompt, response, timestamp,
+        number of code blocks, entry id) with BM25 scores. With ``rerank=True`` the top ``limit``
+        hits are re-ordered by difflib similarity to the prompt, and the score
+        becomes that ratio.
+        """
+        fts_query = build_fts_query(query)
+        if not fts_query:
+            return []
+        db = await self._conn()
+        async with db.execute(SEARCH_SQL, (fts_query, self.namespace, limit)) as cursor:
+            results = await cursor.fetchall()
+        if rerank:
+            import difflib
+            query_lower = query.lower()
+            results = [
+                (difflib.SequenceMatcher(None, query_lower, prompt.lower()).ratio(), prompt, response, timestamp, code_count, entry_id)
+                for _, prompt, response, timestamp, code_count, entry_id in results
+            ]
+            results.sort(key=lambda x: x[0], reverse=True)
+        return results
+
+    async def get_state(self, key, default=None):
+        db = await self._conn()
+        async with db.execute("SELECT value FROM bot_state WHERE key = ?", (self._state_key(key),)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else default
+
+    async def set_state(self, key, value):
+        db = await self._conn()
+        await db.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (self._state_key(key), value))
+        await db.commit()
+
+    async def add_dead_letter(self, page_id, stage, error, payload=None):
+        db = await self._conn()
+        await db.execute(
+            "INSERT INTO dead_letters (timestamp, page_id, stage, error, payload, namespace) VALUES (?, ?, ?, ?, ?, ?)",
+            (datetime.now().isoformat(), page_id, stage, error, payload, self.namespace)
+        )
+        await db.commit()
+
+    async def get_dead_letters(self):
+        db = await self._conn()
+        async with db.execute(
+            "SELECT id, timestamp, page_id, stage, error, payload FROM dead_letters WHERE namespace = ? ORDER BY id",
+            (self.namespace,)
+        ) as cursor:
+            return await cursor.fetchall()
+
+    async def get_dead_letter_page_ids(self):
+        db = await self._conn()
+        async with db.execute("SELECT DISTINCT page_id FROM dead_letters WHERE namespace = ?", (self.namespace,)) as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+    async def delete_dead_letters(self, page_id=None):
+        db = await self._conn()
+        if page_id is None:
+            await db.execute("DELETE FROM dead_letters WHERE namespace = ?", (self.namespace,))
+        else:
+            await db.execute("DELETE FROM dead_letters WHERE page_id = ? AND namespace = ?", (page_id, self.namespace))
+        await db.commit()
+
+    async def get_job(self, page_id):
+        db = await self._conn()
+        async with db.execute(JOB_SQL, (page_id,)) as cursor:
+            row = await cursor.fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+
+    async def upsert_job(self, page_id, prompt):
+        """Record a fetched prompt and return its job.
+
+        An unfinished job for the same prompt keeps its progress. A page that
+        is pending again after its job finished (its reply was cleared, or the
+        prompt changed) starts a fresh job, so the old reply is never reused.
+        """
+        db = await self._conn()
+        now = datetime.now().isoformat()
+        job = await self.get_job(page_id)
+        if job is None:
+            await db.execute(
+                "INSERT INTO jobs (page_id, prompt, state, created_at, updated_at, namespace) VALUES (?, ?, 'fetched', ?, ?, ?)",
+                (page_id, prompt, now, now, self.namespace)
+            )
+        elif job["state"] == "done" or (job["prompt"] != prompt and job["state"] == "failed"):
+            await db.execute(
+                """UPDATE jobs SET prompt = ?, state = 'fetched', reply = NULL, memory_id = NULL,
+                   attempts = 0, error = NULL, created_at = ?, updated_at = ? WHERE page_id = ?""",
+                (prompt, now, now, page_id)
+            )
+        elif job["state"] == "failed":
+            await db.execute(
+                "UPDATE jobs SET state = 'fetched', error = NULL, updated_at = ? WHERE page_id = ?", (now, page_id)
+            )
+        else:
+            return job
+        await db.commit()
+        return await self.get_job(page_id)
+
+    async def claim_job(self, page_id, worker_id, lease_seconds):
+        """Claim an unfinished job for worker_id; False if another worker holds a live claim"""
+        db = await self._conn()
+        now = time.time()
+        cursor = await db.execute(
+            """UPDATE jobs SET claimed_by = ?, claimed_at = ?, attempts = attempts + 1
+               WHERE page_id = ? AND state IN (?, ?, ?)
+                 AND (claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?)""",
+            (worker_id, now, page_id, *UNFINISHED_STATES, worker_id, now - lease_seconds)
+        )
+        await db.commit()
+        return cursor.rowcount == 1
+
+    async def release_job(self, page_id, worker_id):
+        """Drop worker_id's claim on a job it won't finish, so another worker can take it right away"""
+        db = await self._conn()
+        await db.execute(
+            "UPDATE jobs SET claimed_by = NULL, claimed_at = NULL WHERE page_id = ? AND claimed_by = ?",
+            (page_id, worker_id)
+        )
+        await db.commit()
+
+    async def save_job_reply(self, page_id, prompt, reply, code_blocks=None):
+        """Save a job's reply, then its memory entry, and return the entry id.
+
+        The reply is committed first so it is never paid for twice. The memory
+        entry is only added if the job has none yet, so calling this again
+        after a crash does not duplicate the row.
+        """
+        db = await self._conn()
+        await db.execute(
+            "UPDATE jobs SET state = 'generated', reply = ?, updated_at = ? WHERE page_id = ?",
+            (reply, datetime.now().isoformat(), page_id)
+        )
+        await db.commit()
+        job = await self.get_job(page_id)
+        if job and job["memory_id"] is not None:
+            return job["memory_id"]
+        # A crash between the two commits leaves the entry without its job link
+        async with db.execute(
+            "SELECT id FROM memory WHERE page_id = ? AND prompt = ? AND response = ? ORDER BY id DESC LIMIT 1",
+            (page_id, prompt, reply)
+        ) as cursor:
+            row = await cursor.fetchone()
+        memory_id = row[0] if row else await self.add_entry(prompt, reply, page_id, code_blocks)
+        await db.execute("UPDATE jobs SET memory_id = ? WHERE page_id = ?", (memory_id, page_id))
+        await db.commit()
+        return memory_id
+
+    async def set_job_state(self, page_id, state, error=None):
+        """Move a job to a new state; finished jobs release their claim"""
+        db = await self._conn()
+        if state in UNFINISHED_STATES:
+            sql = "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE page_id = ?"
+        else:
+            sql = "UPDATE jobs SET state = ?, error = ?, updated_at = ?, claimed_by = NULL, claimed_at = NULL WHERE page_id = ?"
+        await db.execute(sql, (state, error, datetime.now().isoformat(), page_id))
+        await db.commit()
+
+    async def get_unfinished_jobs(self):
+        db = await self._conn()
+        async with db.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE state IN (?, ?, ?) AND namespace = ? ORDER BY created_at",
+            (*UNFINISHED_STATES, self.namespace)
+        ) as cursor:
+            return [dict(zip(JOB_COLUMNS, row)) for row in await cursor.fetchall()]
 
     async def count(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT COUNT(*) FROM memory") as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row else 0
+        db = await self._conn()
+        async with db.execute("SELECT COUNT(*) FROM memory WHERE namespace = ?", (self.namespace,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+
+    async def expire_entries(self, before, keep=0, batch_size=500, max_batches=None):
+        """Delete entries older than ``before`` (ISO timestamp), oldest first, in batches.
+
+        The newest ``keep`` entries are never deleted. Each batch is its own
+        short transaction, so a large table is worked off without holding
+        the write lock or the connection for long; ``max_batches`` bounds the
+        work per call and the rest is left for the next one. Returns the
+        deleted ids.
+        """
+        bound = await self._newest_bound(keep)
+        if bound is None:
+            return []
+        db = await self._conn()
+        async with db.execute(EXPIRY_CUTOFF_ID_SQL, (self.namespace, before)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return []
+        last_id = min(row[0], bound - 1)
+        deleted = []
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            async with db.execute(EXPIRED_IDS_SQL, (self.namespace, last_id, before, batch_size)) as cursor:
+                ids = [r[0] for r in await cursor.fetchall()]
+            if not ids:
+                break
+            # memory_fts_delete and memory_vectors_delete clean up after each row
+            await db.execute(f"DELETE FROM memory WHERE id IN ({','.join('?' * len(ids))})", ids)
+            await db.commit()
+            deleted.extend(ids)
+            batches += 1
+            if len(ids) < batch_size:
+                break
+            await asyncio.sleep(0)
+        return deleted
+
+    async def _newest_bound(self, keep):
+        """Smallest id among the newest ``keep`` entries (one past the newest if keep is 0), or None if empty"""
+        db = await self._conn()
+        async with db.execute(
+            "SELECT id FROM memory WHERE namespace = ? ORDER BY id DESC LIMIT 1 OFFSET ?", (self.namespace, max(0, keep - 1))
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return row[0] if keep > 0 else row[0] + 1
+
+    async def get_compaction_candidates(self, keep, limit=50):
+        """Oldest verbatim entries outside the newest ``keep``, as (id, prompt, response)"""
+        bound = await self._newest_bound(keep)
+        if bound is None:
+            return []
+        db = await self._conn()
+        async with db.execute(COMPACTION_CANDIDATES_SQL, (self.namespace, bound, limit)) as cursor:
+            return await cursor.fetchall()
+
+    async def compact_entries(self, summaries):
+        """Replace entries' responses with summaries, given (id, summary) pairs.
+
+        The original response and code blocks are archived zlib-compressed,
+        and the token count is updated so context packing sees the summary.
+        """
+        if not summaries:
+            return 0
+        db = await self._conn()
+        ids = [entry_id for entry_id, _ in summaries]
+        async with db.execute(
+            f"SELECT id, response, code_blocks FROM memory WHERE compacted = 0 AND id IN ({','.join('?' * len(ids))})", ids
+        ) as cursor:
+            originals = {row[0]: row[1:] for row in await cursor.fetchall()}
+        updates = []
+        for entry_id, summary in summaries:
+            if entry_id not in originals:
+                continue
+            response, code_blocks = originals[entry_id]
+            archive = zlib.compress(json.dumps({"response": response, "code_blocks": code_blocks}).encode(), 9)
+            updates.append((summary, count_tokens(summary), archive, entry_id))
+        await db.executemany(
+            "UPDATE memory SET response = ?, code_blocks = NULL, response_tokens = ?, archive = ?, compacted = 1 WHERE id = ?",
+            updates
+        )
+        await db.commit()
+        return len(updates)
+
+    async def drop_archives(self, keep, limit=500):
+        """Drop the archived originals of compacted entries outside the newest ``keep``; returns how many"""
+        bound = await self._newest_bound(keep)
+        if bound is None:
+            return 0
+        db = await self._conn()
+        async with db.execute(ARCHIVED_IDS_SQL, (self.namespace, bound, limit)) as cursor:
+            ids = [row[0] for row in await cursor.fetchall()]
+        if ids:
+            await db.execute(f"UPDATE memory SET archive = NULL WHERE id IN ({','.join('?' * len(ids))})", ids)
+            await db.commit()
+        return len(ids)
+
+    async def get_entry(self, entry_id):
+        """(timestamp, prompt, response, code_blocks) of one entry, with a compacted entry's original text restored"""
+        db = await self._conn()
+        async with db.execute(
+            "SELECT timestamp, prompt, response, code_blocks, archive FROM memory WHERE id = ? AND namespace = ?",
+            (entry_id, self.namespace)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        timestamp, prompt, response, code_blocks, archive = row
+        if archive is not None:
+            original = json.loads(zlib.decompress(archive))
+            response, code_blocks = original["response"], original["code_blocks"]
+        return timestamp, prompt, response, code_blocks
+
+    async def count_compacted(self):
+        db = await self._conn()
+        async with db.execute("SELECT COUNT(*) FROM memory WHERE namespace = ? AND compacted = 1", (self.namespace,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else 0
 
     async def clear(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("DELETE FROM memory")
-            await db.commit()
\ No newline at end of file
+        db = await self._conn()
+        await db.execute("DELETE FROM memory WHERE namespace = ?", (self.namespace,))  # memory_fts_delete keeps the index in step
+        await db.commit()
+
+# Every public MemoryDB call is timed in notion_bot_memory_db_seconds{method=...}
+instrument_methods(MemoryDB, MEMORY_DB_SECONDS)
\ No newline at end of file
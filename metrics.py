@@ -0,0 +1,224 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets (seconds) wide enough for SQLite calls and OpenAI completions
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style, optionally split by labels"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a ``with`` block (also usable inside coroutines)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(_label_key(self.labelnames, labels))
+        return series["count"] if series else 0
+
+    def samples(self):
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", _format_value(bound))]), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), series["sum"]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), series["count"]
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format.
+
+    Collectors are callables run at render time, for values that already
+    live elsewhere (queue sizes, cache stats); they update gauges.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _add(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def render(self):
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "notion_bot_stage_seconds", "Time spent in each pipeline stage", ["stage"]
+)
+MEMORY_DB_SECONDS = REGISTRY.histogram(
+    "notion_bot_memory_db_seconds", "Time spent in each MemoryDB call", ["method"]
+)
+NOTION_REQUEST_SECONDS = REGISTRY.histogram(
+    "notion_bot_notion_request_seconds", "Notion HTTP request latency (per attempt)", ["method"]
+)
+NOTION_REQUESTS = REGISTRY.counter(
+    "notion_bot_notion_requests_total", "Notion HTTP requests by method and status code", ["method", "status"]
+)
+OPENAI_REQUESTS = REGISTRY.counter(
+    "notion_bot_openai_requests_total", "OpenAI completion requests by outcome", ["result"]
+)
+OPENAI_TOKENS = REGISTRY.counter(
+    "notion_bot_openai_tokens_total", "OpenAI tokens used (reported by the API, estimated when streaming)", ["kind"]
+)
+OPENAI_COST = REGISTRY.counter(
+    "notion_bot_openai_cost_usd_total", "Estimated OpenAI spend in USD"
+)
+MODEL_REQUESTS = REGISTRY.counter(
+    "notion_bot_model_requests_total", "Completion requests per routed model, by outcome", ["model", "result"]
+)
+MODEL_REQUEST_SECONDS = REGISTRY.histogram(
+    "notion_bot_model_request_seconds", "Completion latency per routed model (successful requests)", ["model"]
+)
+MODEL_COST = REGISTRY.counter(
+    "notion_bot_model_cost_usd_total", "Estimated spend in USD per routed model", ["model"]
+)
+MODEL_HEDGES = REGISTRY.counter(
+    "notion_bot_model_hedges_total", "Hedged completion requests: started, and won by the backup model", ["result"]
+)
+RATE_LIMIT_WAIT = REGISTRY.counter(
+    "notion_bot_rate_limit_wait_seconds_total", "Time spent waiting on the rate limiter", ["upstream"]
+)
+SLEEP_SECONDS = REGISTRY.counter(
+    "notion_bot_sleep_seconds_total", "Time deliberately slept (poll intervals, retry backoff)", ["reason"]
+)
+PROMPTS = REGISTRY.counter(
+    "notion_bot_prompts_total", "Prompts finished, by result", ["result"]
+)
+
+
+def timed(histogram, **labels):
+    """Decorator recording each call's duration (sync or async) in a histogram"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(cls, histogram, label="method"):
+    """Time every public coroutine method of cls, labelled by method name"""
+    for name, fn in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(fn):
+            setattr(cls, name, timed(histogram, **{label: name})(fn))
+    return cls
@@ -0,0 +1,454 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import openai
+from openai import AsyncOpenAI
+
+from metrics import MODEL_REQUESTS, MODEL_REQUEST_SECONDS, MODEL_COST, MODEL_HEDGES
+from rate_limit import RetryableError, parse_retry_after
+from tokens import count_tokens
+
+# A failed request counts as this many seconds of latency when models are ranked
+FAILURE_PENALTY_SECONDS = 30.0
+
+
+class Completion:
+    """A reply with its token usage (None where the provider didn't report it)"""
+
+    def __init__(self, text, prompt_tokens=None, completion_tokens=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.model = None
+        self.cost = 0.0
+
+
+class OpenAIProvider:
+    """Chat completions through the OpenAI SDK (or any server it can reach via OPENAI_BASE_URL).
+
+    Without an async client the sync SDK runs in ``executor``, with the same
+    messages and settings as the async path.
+    """
+
+    def __init__(self, client, sync_client_factory=None, executor=None):
+        self.client = client
+        self.sync_client_factory = sync_client_factory
+        self.executor = executor
+        self._sync_client = None
+
+    @staticmethod
+    def request_params(model, messages, max_tokens, temperature):
+        return dict(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            presence_penalty=0.1,
+            frequency_penalty=0.1,
+        )
+
+    async def complete(self, model, messages, max_tokens, temperature):
+        params = self.request_params(model, messages, max_tokens, temperature)
+        if self.client is not None:
+            res = await self.client.chat.completions.create(**params)
+        else:
+            res = await asyncio.get_running_loop().run_in_executor(self.executor, self._sync_create, params)
+        usage = getattr(res, "usage", None)
+        return Completion(
+            res.choices[0].message.content,
+            getattr(usage, "prompt_tokens", None),
+            getattr(usage, "completion_tokens", None),
+        )
+
+    def _sync_create(self, params):
+        if self._sync_client is None:
+            self._sync_client = self.sync_client_factory()
+        return self._sync_client.chat.completions.create(**params)
+
+    async def stream(self, model, messages, max_tokens, temperature):
+        if self.client is None:
+            yield (await self.complete(model, messages, max_tokens, temperature)).text
+            return
+        stream = await self.client.chat.completions.create(
+            **self.request_params(model, messages, max_tokens, temperature), stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def classify(self, e):
+        """Map an OpenAI SDK error to a RetryableError, or None if retrying won't help"""
+        if isinstance(e, openai.RateLimitError):
+            if getattr(e, "code", None) == "insufficient_quota":
+                return None
+            return RetryableError(str(e), parse_retry_after(e.response.headers.get("retry-after")), rate_limited=True)
+        if isinstance(e, (openai.APIConnectionError, openai.InternalServerError)):
+            return RetryableError(str(e))
+        if isinstance(e, openai.APIStatusError) and e.status_code >= 500:
+            return RetryableError(str(e))
+        return None
+
+
+class AnthropicProvider:
+    """Claude models through the optional ``anthropic`` SDK.
+
+    System messages move to the API's ``system`` parameter; the user and
+    assistant turns are passed through as they are.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def request_params(model, messages, max_tokens, temperature):
+        params = dict(
+            model=model,
+            messages=[{"role": m["role"], "content": m["content"]} for m in messages if m["role"] != "system"],
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        if system:
+            params["system"] = system
+        return params
+
+    async def complete(self, model, messages, max_tokens, temperature):
+        res = await self.client.messages.create(**self.request_params(model, messages, max_tokens, temperature))
+        text = "".join(block.text for block in res.content if getattr(block, "type", None) == "text")
+        return Completion(text, res.usage.input_tokens, res.usage.output_tokens)
+
+    async def stream(self, model, messages, max_tokens, temperature):
+        async with self.client.messages.stream(**self.request_params(model, messages, max_tokens, temperature)) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+    def classify(self, e):
+        """Rate limits (429), overload (529), server and connection errors are retryable"""
+        if not type(e).__module__.startswith("anthropic"):
+            return None
+        status = getattr(e, "status_code", None)
+        if status == 429:
+            return RetryableError(str(e), parse_retry_after(e.response.headers.get("retry-after")), rate_limited=True)
+        if (status is not None and status >= 500) or type(e).__name__ in ("APIConnectionError", "APITimeoutError"):
+            return RetryableError(str(e))
+        return None
+
+
+class FakeProvider:
+    """Local, deterministic stand-in: echoes the prompt after ``latency`` seconds, no network access"""
+
+    def __init__(self, latency=0.05, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+
+    def reply(self, model, messages):
+        self.calls += 1
+        if self.error_rate and (self.calls * 0.618034) % 1 < self.error_rate:
+            raise ConnectionError(f"Fake provider failure (call {self.calls})")
+        return f"[{model}] Answer to: {messages[-1]['content']}"
+
+    async def complete(self, model, messages, max_tokens, temperature):
+        await asyncio.sleep(self.latency)
+        return Completion(self.reply(model, messages))
+
+    async def stream(self, model, messages, max_tokens, temperature):
+        words = self.reply(model, messages).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            yield word if i == 0 else " " + word
+
+    def classify(self, e):
+        return RetryableError(str(e)) if isinstance(e, ConnectionError) else None
+
+
+def anthropic_provider(api_key, **options):
+    """AnthropicProvider for an API key, or None when the SDK isn't installed"""
+    try:
+        import anthropic
+    except ImportError:
+        logging.warning("An Anthropic model is configured but the anthropic package is not installed (pip install anthropic)")
+        return None
+    return AnthropicProvider(anthropic.AsyncAnthropic(api_key=api_key, max_retries=0, **options))
+
+
+def make_providers(models, openai_client=None, openai_sync_factory=None, executor=None, anthropic_api_key=None, extra=None):
+    """Providers by name for the configured ``models``.
+
+    "openai" is always there; "anthropic" (with an API key) and "fake" are
+    only built when one of the models names them. ``extra`` maps more names
+    to ``{"type": "openai" | "anthropic" | "fake", ...}`` entries, e.g. a
+    second OpenAI-compatible endpoint with ``base_url`` and ``api_key_env``,
+    or a fake with its own ``latency`` and ``error_rate``.
+    """
+    wanted = {spec.provider for spec in models}
+    providers = {"openai": OpenAIProvider(openai_client, openai_sync_factory, executor)}
+    if "fake" in wanted:
+        providers["fake"] = FakeProvider()
+    if "anthropic" in wanted and "anthropic" not in (extra or {}):
+        if not anthropic_api_key:
+            logging.warning("An Anthropic model is configured but ANTHROPIC_API_KEY is not set")
+        else:
+            provider = anthropic_provider(anthropic_api_key)
+            if provider is not None:
+                providers["anthropic"] = provider
+    for name, entry in (extra or {}).items():
+        options = dict(entry)
+        kind = options.pop("type", name)
+        api_key_env = options.pop("api_key_env", None)
+        api_key = os.getenv(api_key_env) if api_key_env else None
+        if kind == "fake":
+            providers[name] = FakeProvider(**options)
+        elif kind == "openai":
+            providers[name] = OpenAIProvider(AsyncOpenAI(api_key=api_key, max_retries=0, **options))
+        elif kind == "anthropic":
+            provider = anthropic_provider(api_key, **options)
+            if provider is not None:
+                providers[name] = provider
+        else:
+            raise ValueError(f"Unknown provider type {kind!r} for provider {name!r}")
+    return providers
+
+
+class ModelSpec:
+    """A model the router can pick: where it runs, how big it is and what it costs"""
+
+    def __init__(self, name, provider="openai", model=None, context_tokens=16385, max_output_tokens=4096,
+                 prompt_cost_per_1k=0.0, completion_cost_per_1k=0.0, latency=2.0, temperature=None):
+        self.name = name
+        self.provider = provider
+        self.model = model or name
+        self.context_tokens = context_tokens
+        self.max_output_tokens = max_output_tokens
+        self.prompt_cost_per_1k = prompt_cost_per_1k
+        self.completion_cost_per_1k = completion_cost_per_1k
+        self.latency = latency  # expected seconds per request until real samples come in
+        self.temperature = temperature
+
+    def cost(self, prompt_tokens, completion_tokens):
+        return prompt_tokens / 1000 * self.prompt_cost_per_1k + completion_tokens / 1000 * self.completion_cost_per_1k
+
+
+def load_model_config(path):
+    """Model specs and extra provider entries from a JSON config file.
+
+    The file holds ``{"models": [...], "providers": {...}}`` (or just the
+    model list); each model needs a ``name``, the other ModelSpec fields are
+    optional. ``model`` is the id sent to the API and defaults to ``name``.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    entries = config.get("models", []) if isinstance(config, dict) else config
+    providers = config.get("providers", {}) if isinstance(config, dict) else {}
+    models = []
+    names = set()
+    for entry in entries:
+        if not entry.get("name"):
+            raise ValueError(f"Model entry {entry!r} needs a name")
+        if entry["name"] in names:
+            raise ValueError(f"Duplicate model name {entry['name']!r}")
+        names.add(entry["name"])
+        models.append(ModelSpec(**entry))
+    return models, providers
+
+
+class RollingStats:
+    """Latency, cost and outcome of a model's last ``window`` requests"""
+
+    def __init__(self, window=100):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds, cost=0.0, ok=True):
+        self.samples.append((seconds, cost, ok))
+
+    def latency(self, quantile=0.5, default=None):
+        values = sorted(seconds for seconds, _, ok in self.samples if ok)
+        if not values:
+            return default
+        return values[min(len(values) - 1, int(quantile * len(values)))]
+
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, _, ok in self.samples if not ok) / len(self.samples)
+
+    def mean_cost(self):
+        costs = [cost for _, cost, ok in self.samples if ok]
+        return sum(costs) / len(costs) if costs else 0.0
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class ModelRouter:
+    """Picks a model for each completion and tracks how every model performs.
+
+    Models whose context window holds the prompt plus the expected reply
+    (the p90 of recent reply sizes, capped by ``max_tokens``) are ranked by
+    estimated cost plus ``latency_weight`` USD per second of their rolling
+    median latency, with recent failures counted as slow requests; the
+    lowest score wins and ties keep the configured order. If nothing fits,
+    the model with the largest window is used.
+
+    With ``hedge_after`` set (seconds, or "auto" for the model's rolling
+    p95), a request still running after that long is raced against the best
+    model on another provider and the first reply wins. Streamed replies
+    are not hedged, since their partial text is already on the page.
+    """
+
+    def __init__(self, models, providers, latency_weight=0.001, hedge_after=0, window=100):
+        self.providers = providers
+        self.models = []
+        for spec in models:
+            if spec.provider in providers:
+                self.models.append(spec)
+            else:
+                logging.warning(f"Model {spec.name} skipped: provider '{spec.provider}' is not available")
+        if not self.models:
+            raise ValueError("No usable models configured")
+        self.latency_weight = latency_weight
+        self.hedge_after = hedge_after
+        self.stats = {spec.name: RollingStats(window) for spec in self.models}
+        self.output_tokens = deque(maxlen=window)
+
+    def context_tokens(self):
+        """Largest context window among the models, the most a prompt can use"""
+        return max(spec.context_tokens for spec in self.models)
+
+    def expected_output(self, max_tokens):
+        if not self.output_tokens:
+            return max(1, max_tokens // 2)
+        recent = sorted(self.output_tokens)
+        return min(max_tokens, recent[int(0.9 * (len(recent) - 1))])
+
+    def score(self, spec, prompt_tokens, output_tokens):
+        stats = self.stats[spec.name]
+        seconds = stats.latency(0.5, spec.latency) + stats.error_rate() * FAILURE_PENALTY_SECONDS
+        return spec.cost(prompt_tokens, output_tokens) + self.latency_weight * seconds
+
+    def rank(self, prompt_tokens, max_tokens):
+        """Models that fit, best first"""
+        expected = self.expected_output(max_tokens)
+        fitting = [
+            spec for spec in self.models
+            if prompt_tokens + min(expected, spec.max_output_tokens) <= spec.context_tokens
+        ]
+        if not fitting:
+            return [max(self.models, key=lambda spec: spec.context_tokens)]
+        return sorted(fitting, key=lambda spec: self.score(spec, prompt_tokens, expected))
+
+    @staticmethod
+    def reply_tokens(spec, prompt_tokens, max_tokens):
+        """Reply allowance on a given model: max_tokens, capped by its output limit and what its window leaves"""
+        return max(1, min(max_tokens, spec.max_output_tokens, spec.context_tokens - prompt_tokens))
+
+    def hedge_delay(self, spec):
+        if self.hedge_after == "auto":
+            return self.stats[spec.name].latency(0.95, spec.latency * 2)
+        return float(self.hedge_after) or None
+
+    async def complete(self, messages, prompt_tokens, max_tokens, temperature):
+        """Completion from the best model, hedged with a backup on another provider when enabled.
+
+        ``prompt_tokens`` is the size of ``messages``, as counted when they were built.
+        """
+        ranked = self.rank(prompt_tokens, max_tokens)
+        primary = ranked[0]
+        backup = next((spec for spec in ranked[1:] if spec.provider != primary.provider), None)
+        delay = self.hedge_delay(primary) if backup is not None else None
+        tasks = [asyncio.create_task(self._call(primary, messages, prompt_tokens, max_tokens, temperature))]
+        try:
+            if delay is None:
+                return await tasks[0]
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                logging.info(f"{primary.name} still running after {delay:.2f}s, hedging with {backup.name}")
+                MODEL_HEDGES.inc(result="started")
+                tasks.append(asyncio.create_task(self._call(backup, messages, prompt_tokens, max_tokens, temperature)))
+            errors = []
+            pending = list(tasks)
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in [t for t in tasks if t in done]:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            MODEL_HEDGES.inc(result="won")
+                        return task.result()
+                    errors.append(task.exception())
+                pending = [t for t in pending if not t.done()]
+            raise errors[0]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def stream(self, messages, prompt_tokens, max_tokens, temperature, on_delta):
+        """Stream a completion from the best model, calling ``on_delta`` with each piece of text"""
+        spec = self.rank(prompt_tokens, max_tokens)[0]
+        return await self._call(spec, messages, prompt_tokens, max_tokens, temperature, on_delta)
+
+    async def _call(self, spec, messages, prompt_tokens, max_tokens, temperature, on_delta=None):
+        provider = self.providers[spec.provider]
+        max_tokens = self.reply_tokens(spec, prompt_tokens, max_tokens)
+        if spec.temperature is not None:
+            temperature = spec.temperature
+        stats = self.stats[spec.name]
+        started = time.perf_counter()
+        try:
+            if on_delta is None:
+                result = await provider.complete(spec.model, messages, max_tokens, temperature)
+            else:
+                parts = []
+                async for delta in provider.stream(spec.model, messages, max_tokens, temperature):
+                    parts.append(delta)
+                    on_delta(delta)
+                result = Completion("".join(parts))
+        except asyncio.CancelledError:
+            # Lost a hedged race: the time it ran is a lower bound on its latency
+            stats.record(time.perf_counter() - started)
+            MODEL_REQUESTS.inc(model=spec.name, result="cancelled")
+            raise
+        except Exception:
+            stats.record(time.perf_counter() - started, ok=False)
+            MODEL_REQUESTS.inc(model=spec.name, result="error")
+            raise
+        elapsed = time.perf_counter() - started
+        if result.prompt_tokens is None:
+            result.prompt_tokens = prompt_tokens
+        if result.completion_tokens is None:
+            result.completion_tokens = count_tokens(result.text)
+        result.model = spec.name
+        result.cost = spec.cost(result.prompt_tokens, result.completion_tokens)
+        stats.record(elapsed, result.cost)
+        self.output_tokens.append(result.completion_tokens)
+        MODEL_REQUESTS.inc(model=spec.name, result="ok")
+        MODEL_REQUEST_SECONDS.observe(elapsed, model=spec.name)
+        MODEL_COST.inc(result.cost, model=spec.name)
+        return result
+
+    def classify(self, e):
+        """Ask each provider whether an error is worth retrying"""
+        for provider in self.providers.values():
+            retryable = provider.classify(e)
+            if retryable is not None:
+                return retryable
+        return None
+
+    def describe(self):
+        parts = []
+        for spec in self.models:
+            stats = self.stats[spec.name]
+            if not len(stats):
+                continue
+            parts.append(
+                f"{spec.name} {len(stats)} req, p50 {stats.latency(0.5, 0):.2f}s, p95 {stats.latency(0.95, 0):.2f}s, "
+                f"{stats.error_rate():.0%} errors, ${stats.mean_cost():.5f}/req"
+            )
+        hedges = MODEL_HEDGES.value(result="started")
+        if hedges:
+            parts.append(f"{hedges} hedged ({MODEL_HEDGES.value(result='won')} won by the backup)")
+        return "; ".join(parts) or "no completions yet"
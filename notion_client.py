@@ -0,0 +1,197 @@
+import logging
+import time
+from collections import deque
+
+import httpx
+
+from metrics import NOTION_REQUEST_SECONDS, NOTION_REQUESTS
+from rate_limit import RetryableError, call_with_retries, parse_retry_after
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+NOTION_API_BASE = "https://api.notion.com/v1"
+
+
+class NotionClient:
+    """Long-lived, pooled HTTP client for all Notion API traffic.
+
+    One ``httpx.AsyncClient`` is shared by every call so connections (and
+    their TCP/TLS handshakes) are reused via keep-alive, and HTTP/2 is used
+    when the ``h2`` package is installed. Requests are paced by an optional
+    rate limiter and 429/5xx/network failures are retried with backoff,
+    honouring Retry-After. The client also keeps simple counters for pool
+    usage, handshakes and per-request latency.
+    """
+
+    def __init__(self, headers, base_url=NOTION_API_BASE, max_connections=10,
+                 max_keepalive=10, keepalive_expiry=60.0, http2=True, timeout=10.0,
+                 transport=None, rate_limiter=None, max_attempts=4):
+        self.headers = headers
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2_requested = http2
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.timeout = timeout
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self._client = None
+        self._latencies = deque(maxlen=1000)
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+            "connections_opened": 0,
+            "handshake_seconds": 0.0,
+            "http_versions": {},
+        }
+
+    async def open(self):
+        if self._client is not None:
+            return
+        if self.http2_requested and not HTTP2_AVAILABLE:
+            logging.info("HTTP/2 requested for Notion but 'h2' is not installed; using HTTP/1.1 keep-alive.")
+        kwargs = {}
+        if self.transport is not None:
+            kwargs["transport"] = self.transport
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=self.timeout,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            **kwargs,
+        )
+        logging.info(
+            f"Notion client opened (max_connections={self.max_connections}, "
+            f"http2={'on' if self.http2 else 'off'})"
+        )
+
+    async def close(self):
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        logging.info(f"Notion client closed. {self.describe()}")
+
+    async def request(self, method, path, **kwargs):
+        """Send a request through the shared client, with rate limiting and retries.
+
+        Returns the final response (which may still be a 429/5xx once retries
+        run out); raises the last httpx error if the request never got one.
+        """
+        last = {}
+        # Appending blocks isn't idempotent: only retry when Notion can't have applied the request,
+        # i.e. on a 429 or a connection error before it was sent (a 5xx may come after the append)
+        appending = "/children" in path
+
+        async def attempt():
+            if "response" in last:
+                self._stats["retries"] += 1
+            res = await self._send(method, path, **kwargs)
+            last["response"] = res
+            if res.status_code == 429:
+                raise RetryableError("429 Too Many Requests", parse_retry_after(res.headers.get("Retry-After")), rate_limited=True)
+            if res.status_code >= 500 and not appending:
+                raise RetryableError(f"{res.status_code} server error")
+            return res
+
+        def classify(e):
+            if not isinstance(e, httpx.TransportError):
+                return None
+            if appending and not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+                return None
+            last["response"] = None
+            return RetryableError(str(e) or type(e).__name__)
+
+        try:
+            return await call_with_retries(
+                attempt, self.rate_limiter, self.max_attempts, classify=classify,
+                description=f"Notion {method} {path}",
+            )
+        except RetryableError:
+            if last.get("response") is not None:
+                return last["response"]
+            raise
+
+    async def _send(self, method, path, **kwargs):
+        if self._client is None:
+            await self.open()
+        handshake_started = {}
+
+        async def trace(event_name, info):
+            # httpcore reports connection setup as *.started / *.complete pairs
+            if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+                handshake_started[event_name] = time.perf_counter()
+            elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                started = handshake_started.pop(event_name.replace("complete", "started"), None)
+                if started is not None:
+                    self._stats["handshake_seconds"] += time.perf_counter() - started
+                if event_name == "connection.connect_tcp.complete":
+                    self._stats["connections_opened"] += 1
+
+        extensions = kwargs.pop("extensions", {})
+        extensions.setdefault("trace", trace)
+        self._stats["requests"] += 1
+        self._stats["in_flight"] += 1
+        self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._stats["in_flight"])
+        started = time.perf_counter()
+        try:
+            res = await self._client.request(method, path, extensions=extensions, **kwargs)
+        except Exception:
+            self._stats["errors"] += 1
+            NOTION_REQUESTS.inc(method=method, status="error")
+            raise
+        finally:
+            self._stats["in_flight"] -= 1
+            elapsed = time.perf_counter() - started
+            self._latencies.append(elapsed)
+            NOTION_REQUEST_SECONDS.observe(elapsed, method=method)
+        NOTION_REQUESTS.inc(method=method, status=res.status_code)
+        versions = self._stats["http_versions"]
+        versions[res.http_version] = versions.get(res.http_version, 0) + 1
+        return res
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def patch(self, path, **kwargs):
+        return await self.request("PATCH", path, **kwargs)
+
+    def stats(self):
+        """Snapshot of pool usage and latency (seconds) for monitoring."""
+        latencies = sorted(self._latencies)
+        stats = dict(self._stats, http_versions=dict(self._stats["http_versions"]))
+        stats["max_connections"] = self.max_connections
+        if latencies:
+            stats["latency_avg"] = sum(latencies) / len(latencies)
+            stats["latency_p50"] = latencies[len(latencies) // 2]
+            stats["latency_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            stats["latency_max"] = latencies[-1]
+        return stats
+
+    def describe(self):
+        s = self.stats()
+        return (
+            f"requests={s['requests']} errors={s['errors']} retries={s['retries']} "
+            f"connections_opened={s['connections_opened']} "
+            f"handshake_total={s['handshake_seconds']:.3f}s "
+            f"peak_in_flight={s['peak_in_flight']}/{s['max_connections']} "
+            f"latency_p50={s.get('latency_p50', 0.0):.3f}s "
+            f"latency_p95={s.get('latency_p95', 0.0):.3f}s"
+        )
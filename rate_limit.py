@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from metrics import RATE_LIMIT_WAIT, SLEEP_SECONDS
+
+
+class TokenBucket:
+    """Adaptive token-bucket rate limiter for one upstream API.
+
+    ``acquire()`` waits until a request may be sent. After a 429 the rate is
+    halved and no request goes out until the Retry-After time has passed;
+    each success then nudges the rate back up towards ``rate``. Waiters are
+    served in arrival order.
+    """
+
+    def __init__(self, rate, burst=None, name="upstream", min_rate=0.1):
+        self.name = name
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(min_rate, self.max_rate)
+        self.burst = float(burst or max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self.stats = {"acquired": 0, "waited_seconds": 0.0, "rate_limited": 0}
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            started = time.monotonic()
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0 and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.stats["acquired"] += 1
+                    self.stats["waited_seconds"] += now - started
+                    RATE_LIMIT_WAIT.inc(now - started, upstream=self.name)
+                    return
+                await asyncio.sleep(max(wait, (1 - self._tokens) / self.rate))
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_rate_limited(self, retry_after=None):
+        now = time.monotonic()
+        self.stats["rate_limited"] += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0.0
+        self._updated = now
+        self._blocked_until = max(self._blocked_until, now + (retry_after if retry_after is not None else 1.0 / self.rate))
+        logging.warning(f"{self.name} rate limited; slowing to {self.rate:.2f} req/s"
+                        + (f", retrying after {retry_after:.1f}s" if retry_after is not None else ""))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter for the given (0-based) retry attempt"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RetryableError(Exception):
+    """Raised by a call that should be retried, optionally after retry_after seconds"""
+
+    def __init__(self, message, retry_after=None, rate_limited=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.rate_limited = rate_limited
+
+
+async def call_with_retries(fn, limiter=None, max_attempts=4, base_delay=1.0, max_delay=60.0,
+                            classify=None, description="request"):
+    """Run ``await fn()`` under a rate limiter, retrying transient failures.
+
+    ``classify(exc)`` turns an exception into a RetryableError (or returns
+    None for a permanent failure); RetryableError raised by ``fn`` itself is
+    always retried. The last error is re-raised once attempts run out.
+    """
+    for attempt in range(max_attempts):
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            result = await fn()
+        except Exception as e:
+            retryable = e if isinstance(e, RetryableError) else (classify(e) if classify else None)
+            if retryable is None or attempt == max_attempts - 1:
+                raise
+            if retryable.rate_limited and limiter is not None:
+                limiter.on_rate_limited(retryable.retry_after)
+            delay = retryable.retry_after if retryable.retry_after is not None else backoff_delay(attempt, base_delay, max_delay)
+            logging.warning(f"{description} failed ({e}); retry {attempt + 1}/{max_attempts - 1} in {delay:.1f}s")
+            SLEEP_SECONDS.inc(delay, reason="retry_backoff")
+            await asyncio.sleep(delay)
+        else:
+            if limiter is not None:
+                limiter.on_success()
+            return result
@@ -0,0 +1,172 @@
+import difflib
+import hashlib
+import json
+import re
+import time
+
+CACHE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        normalized_prompt TEXT,
+        context_hash TEXT,
+        response TEXT,
+        created_at REAL,
+        last_used REAL,
+        hits INTEGER DEFAULT 0,
+        namespace TEXT NOT NULL DEFAULT ''
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_response_cache_context ON response_cache (context_hash, last_used)",
+    # Eviction is per namespace, so the LRU index leads with it
+    "DROP INDEX IF EXISTS idx_response_cache_last_used",
+    "CREATE INDEX IF NOT EXISTS idx_response_cache_namespace_used ON response_cache (namespace, last_used)",
+)
+
+
+def normalize_prompt(prompt):
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", prompt.lower()).strip().rstrip("?!. ")
+
+
+class ResponseCache:
+    """SQLite-backed cache of ChatGPT replies, stored alongside MemoryDB.
+
+    Entries are keyed on the normalized prompt plus a hash of the context
+    it was asked in. With ``scope="recent"`` that is the last
+    ``context_turns`` user prompts before it, leaving out earlier turns of
+    the same prompt: the exchange the reply was stored with doesn't change
+    the key, and neither does the context window sliding past older turns.
+    A follow-up such as "now rewrite it in Rust" only hits after the same
+    question, and only prompts are hashed, so truncated or compacted replies
+    in the history don't matter. ``scope="context"`` hashes every context
+    message before the prompt's first earlier turn instead (it misses once
+    the window slides), and ``scope="prompt"`` keys on the prompt alone. Entries
+    expire after ``ttl`` seconds, the least recently used ones are evicted
+    beyond ``max_entries``, and with ``similarity`` > 0 a near-duplicate
+    prompt (difflib ratio >= similarity) under the same context also hits.
+    Entries belong to the memory database's namespace and never hit across
+    namespaces.
+    """
+
+    def __init__(self, memory_db, ttl=86400, max_entries=1000, similarity=0.0,
+                 scope="recent", context_turns=2, near_candidates=200):
+        self.memory_db = memory_db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.scope = scope
+        self.context_turns = max(1, context_turns)
+        self.near_candidates = near_candidates
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0}
+
+    async def init(self):
+        db = await self.memory_db.connection()
+        await db.execute(CACHE_SCHEMA[0])
+        await self.memory_db.ensure_columns("response_cache", (("namespace", "TEXT NOT NULL DEFAULT ''"),))
+        for statement in CACHE_SCHEMA[1:]:
+            await db.execute(statement)
+        await db.commit()
+
+    def _context_hash(self, context_messages, normalized):
+        if self.scope == "prompt":
+            return self.memory_db.namespace
+        if self.scope == "recent":
+            context = [normalize_prompt(m["content"]) for m in context_messages if m["role"] == "user"]
+            context = [prompt for prompt in context if prompt != normalized][-self.context_turns:]
+        else:
+            context = context_messages
+            for i, message in enumerate(context_messages):
+                if message["role"] == "user" and normalize_prompt(message["content"]) == normalized:
+                    context = context_messages[:i]
+                    break
+        namespace = self.memory_db.namespace
+        payload = json.dumps([namespace, context] if namespace else context, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _key(normalized, context_hash):
+        return hashlib.sha256(f"{context_hash}\0{normalized}".encode()).hexdigest()
+
+    async def get(self, prompt, context_messages):
+        """Cached reply for this prompt/context, or None"""
+        db = await self.memory_db.connection()
+        now = time.time()
+        normalized = normalize_prompt(prompt)
+        context_hash = self._context_hash(context_messages, normalized)
+        key = self._key(normalized, context_hash)
+        async with db.execute(
+            "SELECT key, response FROM response_cache WHERE key = ? AND created_at >= ?", (key, now - self.ttl)
+        ) as cursor:
+            row = await cursor.fetchone()
+        hit = "hits"
+        if row is None and self.similarity > 0:
+            row = await self._near_duplicate(db, normalized, context_hash, now)
+            hit = "near_hits"
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        await db.execute(
+            "UPDATE response_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, row[0])
+        )
+        await db.commit()
+        self.stats[hit] += 1
+        return row[1]
+
+    async def _near_duplicate(self, db, normalized, context_hash, now):
+        async with db.execute(
+            """SELECT key, response, normalized_prompt FROM response_cache
+               WHERE context_hash = ? AND created_at >= ?
+               ORDER BY last_used DESC LIMIT ?""",
+            (context_hash, now - self.ttl, self.near_candidates)
+        ) as cursor:
+            candidates = await cursor.fetchall()
+        best, best_ratio = None, self.similarity
+        matcher = difflib.SequenceMatcher(None, "", normalized)
+        for key, response, candidate in candidates:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = (key, response), ratio
+        return best
+
+    async def put(self, prompt, context_messages, response):
+        db = await self.memory_db.connection()
+        now = time.time()
+        normalized = normalize_prompt(prompt)
+        context_hash = self._context_hash(context_messages, normalized)
+        await db.execute(
+            """INSERT OR REPLACE INTO response_cache
+               (key, normalized_prompt, context_hash, response, created_at, last_used, hits, namespace)
+               VALUES (?, ?, ?, ?, ?, ?, 0, ?)""",
+            (self._key(normalized, context_hash), normalized, context_hash, response, now, now, self.memory_db.namespace)
+        )
+        await self._evict(db, now)
+        await db.commit()
+
+    async def _evict(self, db, now):
+        """Drop expired entries, then this namespace's least recently used ones beyond ``max_entries``"""
+        cursor = await db.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+        evicted = cursor.rowcount
+        cursor = await db.execute(
+            """DELETE FROM response_cache WHERE key IN (
+                   SELECT key FROM response_cache WHERE namespace = ? ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+            (self.memory_db.namespace, self.max_entries)
+        )
+        evicted += cursor.rowcount
+        self.stats["evictions"] += max(0, evicted)
+
+    async def clear(self):
+        db = await self.memory_db.connection()
+        await db.execute("DELETE FROM response_cache WHERE namespace = ?", (self.memory_db.namespace,))
+        await db.commit()
+
+    def describe(self):
+        lookups = self.stats["hits"] + self.stats["near_hits"] + self.stats["misses"]
+        hit_rate = (self.stats["hits"] + self.stats["near_hits"]) / lookups if lookups else 0.0
+        return (
+            f"hits={self.stats['hits']} near_hits={self.stats['near_hits']} "
+            f"misses={self.stats['misses']} evictions={self.stats['evictions']} hit_rate={hit_rate:.0%}"
+        )
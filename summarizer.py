@@ -0,0 +1,93 @@
+import logging
+import re
+from collections import Counter
+
+from code_extractor import extract_code_blocks
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from has have how i if in is it its of on or so that the "
+    "this to was what when which with you your".split()
+)
+
+
+def words(text):
+    return [w for w in re.findall(r"\w+", text.lower()) if w not in STOPWORDS]
+
+
+def placeholder(block):
+    """One-line stand-in for a code block, e.g. "[python code, 3 lines]" or "[code, 1 line]" when untagged"""
+    lines = block["code"].count("\n") + 1
+    kind = "code" if block["language"] == "text" else f"{block['language']} code"
+    return f"[{kind}, {lines} line{'s' if lines != 1 else ''}]"
+
+
+class ExtractiveSummarizer:
+    """Offline summarizer that keeps the reply's most representative sentences.
+
+    Code blocks (found by the shared fence tokenizer) are replaced by a
+    one-line placeholder each, then sentences are
+    scored by how often their words occur in the reply and in the prompt,
+    and the best ones are kept in their original order up to ``max_chars``.
+    Deterministic and free, so compaction works without network access.
+    """
+
+    name = "extractive"
+
+    def __init__(self, max_chars=600):
+        self.max_chars = max_chars
+
+    async def summarize(self, prompt, response):
+        text, blocks = extract_code_blocks(response)
+        code = [placeholder(block) for block in blocks]
+        sentences = [s.strip() for s in SENTENCE_RE.split(text) if len(s.strip()) > 1]
+        if not sentences:
+            return " ".join(code)[:self.max_chars]
+        frequency = Counter(words(text))
+        prompt_words = set(words(prompt))
+        scored = []
+        for i, sentence in enumerate(sentences):
+            tokens = words(sentence)
+            if not tokens:
+                continue
+            score = sum(frequency[t] + (3 if t in prompt_words else 0) for t in tokens) / len(tokens) ** 0.5
+            scored.append((score, i))
+        budget = self.max_chars - sum(len(c) + 1 for c in code)
+        chosen = []
+        for score, i in sorted(scored, reverse=True):
+            if len(sentences[i]) + 1 <= budget:
+                chosen.append(i)
+                budget -= len(sentences[i]) + 1
+        summary = " ".join([sentences[i] for i in sorted(chosen)] + code)
+        return summary or sentences[0][:self.max_chars]
+
+
+class OpenAISummarizer:
+    """Summarizer backed by a chat completion"""
+
+    def __init__(self, client, model="gpt-3.5-turbo", max_chars=600):
+        self.client = client
+        self.model = model
+        self.name = model
+        self.max_chars = max_chars
+
+    async def summarize(self, prompt, response):
+        res = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": f"Summarize the answer below in at most {self.max_chars} characters. "
+                                              "Keep facts, names and conclusions; describe code instead of quoting it."},
+                {"role": "user", "content": f"Question: {prompt}\n\nAnswer:\n{response}"},
+            ],
+            max_tokens=max(32, self.max_chars // 3),
+        )
+        return res.choices[0].message.content.strip()[:self.max_chars]
+
+
+def make_summarizer(name, openai_client=None, max_chars=600):
+    """Build the summarizer named by the MEMORY_SUMMARIZER setting ("extractive" or "openai")"""
+    if name == "openai" and openai_client is not None:
+        return OpenAISummarizer(openai_client, max_chars=max_chars)
+    if name != "extractive":
+        logging.warning(f"Unknown or unavailable summarizer '{name}', using extractive summarizer")
+    return ExtractiveSummarizer(max_chars)
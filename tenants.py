@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+
+# The tenant whose page the current task is working on. Pipeline code reads
+# the Notion client, database id and memory namespace from it.
+current_tenant = contextvars.ContextVar("current_tenant")
+
+
+class Tenant:
+    """One Notion database served by the bot.
+
+    Holds the database's own Notion client (token and rate cap), its memory
+    namespace views and its per-tenant caps, plus the scheduler's queue and
+    poll state for it.
+    """
+
+    def __init__(self, name, database_id, notion_client, memory_db, response_cache=None,
+                 semantic_index=None, max_concurrency=2, openai_limiter=None):
+        self.name = name
+        self.database_id = database_id
+        self.notion_client = notion_client
+        self.memory_db = memory_db
+        self.response_cache = response_cache
+        self.semantic_index = semantic_index
+        self.max_concurrency = max(1, max_concurrency)
+        self.openai_limiter = openai_limiter
+        self.pending = deque()
+        self.queued_ids = set()
+        self.in_flight = 0
+        self.next_poll = 0.0
+        self.empty_polls = 0
+        self.stats = {"polls": 0, "queued": 0, "processed": 0, "failed": 0}
+
+    def describe(self):
+        return (
+            f"{self.name}: queued={len(self.pending)} in_flight={self.in_flight} "
+            f"processed={self.stats['processed']} failed={self.stats['failed']} polls={self.stats['polls']}"
+        )
+
+
+def load_tenant_config(path):
+    """Tenant entries from a JSON config file.
+
+    The file holds ``{"tenants": [...]}`` (or just the list); each entry needs
+    a ``database_id`` and a ``token``, or ``token_env`` naming the environment
+    variable that holds it. ``name`` defaults to the database id.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    entries = config.get("tenants", []) if isinstance(config, dict) else config
+    tenants = []
+    names = set()
+    for entry in entries:
+        name = entry.get("name") or entry.get("database_id")
+        token = entry.get("token") or (os.getenv(entry["token_env"]) if entry.get("token_env") else None)
+        if not entry.get("database_id") or not token:
+            raise ValueError(f"Tenant {name!r} needs a database_id and a token (or token_env)")
+        if name in names:
+            raise ValueError(f"Duplicate tenant name {name!r}")
+        names.add(name)
+        tenants.append(dict(entry, name=name, token=token))
+    return tenants
+
+
+class TenantScheduler:
+    """Fair scheduler that serves many tenants from one event loop.
+
+    One poller checks each tenant when its own adaptive poll interval is
+    due (idle tenants back off towards ``max_interval``), and ``workers``
+    shared workers take queued pages round-robin across tenants, never
+    running more than a tenant's ``max_concurrency`` pages at once. A busy
+    tenant therefore cannot starve the others, and an idle one costs a
+    query per interval rather than a task or loop of its own.
+
+    ``poll(tenant)`` returns the tenant's pending pages and
+    ``process(page)`` runs one page through the pipeline; both run with
+    ``current_tenant`` set.
+    """
+
+    def __init__(self, tenants, poll, process, workers=4, min_interval=30, max_interval=300,
+                 poll_concurrency=4, jitter=5.0):
+        self.tenants = list(tenants)
+        self.poll = poll
+        self.process = process
+        self.workers = max(1, workers)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self._poll_slots = asyncio.Semaphore(max(1, poll_concurrency))
+        self._work_available = asyncio.Event()
+        self._cursor = 0
+        # Spread the first polls over one interval instead of polling every tenant at once
+        now = time.monotonic()
+        for i, tenant in enumerate(self.tenants):
+            tenant.next_poll = now + i * min_interval / max(1, len(self.tenants))
+
+    def enqueue(self, tenant, pages):
+        """Queue a tenant's pages, skipping any already queued or running. Returns the number added."""
+        added = 0
+        for page in pages:
+            if page["id"] in tenant.queued_ids:
+                continue
+            tenant.queued_ids.add(page["id"])
+            tenant.pending.append(page)
+            added += 1
+        if added:
+            tenant.stats["queued"] += added
+            self._work_available.set()
+        return added
+
+    def _next_tenant(self):
+        """Next tenant in round-robin order with queued work and room under its cap"""
+        count = len(self.tenants)
+        for offset in range(count):
+            tenant = self.tenants[(self._cursor + offset) % count]
+            if tenant.pending and tenant.in_flight < tenant.max_concurrency:
+                self._cursor = (self._cursor + offset + 1) % count
+                return tenant
+        return None
+
+    async def _worker(self):
+        while True:
+            tenant = self._next_tenant()
+            if tenant is None:
+                self._work_available.clear()
+                await self._work_available.wait()
+                continue
+            page = tenant.pending.popleft()
+            tenant.in_flight += 1
+            token = current_tenant.set(tenant)
+            try:
+                ok = await self.process(page)
+                tenant.stats["processed" if ok else "failed"] += 1
+            except Exception as e:
+                logging.error(f"[{tenant.name}] Error processing page {page['id']}: {e}")
+                tenant.stats["failed"] += 1
+            finally:
+                current_tenant.reset(token)
+                tenant.in_flight -= 1
+                tenant.queued_ids.discard(page["id"])
+                # A tenant that was at its cap may have room again
+                self._work_available.set()
+
+    async def _poll_tenant(self, tenant):
+        async with self._poll_slots:
+            token = current_tenant.set(tenant)
+            try:
+                pages = await self.poll(tenant)
+            except Exception as e:
+                logging.error(f"[{tenant.name}] Error polling: {e}")
+                pages = []
+            finally:
+                current_tenant.reset(token)
+        tenant.stats["polls"] += 1
+        added = self.enqueue(tenant, pages)
+        if added or tenant.pending or tenant.in_flight:
+            tenant.empty_polls = 0
+            interval = self.min_interval
+        else:
+            tenant.empty_polls += 1
+            interval = self.min_interval
+            if tenant.empty_polls > 5:
+                interval = min(self.max_interval, self.min_interval + tenant.empty_polls * 10)
+        if added:
+            logging.info(f"[{tenant.name}] Found {added} pending prompts.")
+        tenant.next_poll = time.monotonic() + interval + random.uniform(0, self.jitter)
+
+    async def _poller(self):
+        while True:
+            now = time.monotonic()
+            due = [tenant for tenant in self.tenants if tenant.next_poll <= now]
+            if due:
+                await asyncio.gather(*(self._poll_tenant(tenant) for tenant in due))
+            wait = min(tenant.next_poll for tenant in self.tenants) - time.monotonic()
+            await asyncio.sleep(max(0.1, wait))
+
+    async def run(self):
+        """Poll and process until cancelled"""
+        if not self.tenants:
+            logging.warning("No tenants configured; scheduler has nothing to do.")
+            return
+        logging.info(f"Scheduler serving {len(self.tenants)} tenant(s) with {self.workers} worker(s)")
+        tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self._poller()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def describe(self):
+        return "; ".join(tenant.describe() for tenant in self.tenants)
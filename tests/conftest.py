@@ -0,0 +1,72 @@
+"""Shared fixtures: main.py wired to the in-process Notion stand-in.
+
+main reads its settings and opens its log and memory database when it is
+imported, so the environment is set and the working directory moved to a
+scratch directory before any test module imports it.
+"""
+
+import asyncio
+import glob
+import os
+import sys
+import tempfile
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="notion-bot-tests-"))
+for name in ("MODELS_FILE", "TENANTS_FILE", "CLAIMS_DB", "ANTHROPIC_API_KEY", "OPENAI_BASE_URL"):
+    os.environ.pop(name, None)
+os.environ.update(
+    NOTION_DB_ID="fake-db",
+    NOTION_API_KEY="test-notion-key",
+    OPENAI_API_KEY="test-openai-key",
+    NOTION_API_BASE="http://notion.test/v1",
+    NOTION_RATE="1000",
+    NOTION_BURST="1000",
+    FAST_MODE="1",
+    RETRY_ATTEMPTS="1",
+    STREAM_RESPONSES="0",
+    WORKER_POOL_MODE="0",
+    WEBHOOK_MODE="0",
+    CONTEXT_MODE="recent",
+)
+
+import main  # noqa: E402
+from fake_notion import FakeNotion, create_app  # noqa: E402
+
+
+@pytest.fixture
+def notion(monkeypatch):
+    """A FakeNotion database served to main's Notion client through httpx.ASGITransport"""
+    fake = FakeNotion(database_id=main.NOTION_DB_ID)
+    monkeypatch.setattr(main.notion_client, "transport", httpx.ASGITransport(app=create_app(fake)))
+    return fake
+
+
+@pytest.fixture
+def fresh_db():
+    """Remove main's memory database (and the activity state read from it) once the test is done"""
+    yield main.memory_db
+    main.activity.last = main.activity._task = None
+    for path in glob.glob(main.memory_db.db_path + "*"):
+        os.remove(path)
+
+
+@pytest.fixture
+def run_bot(notion, fresh_db):
+    """Run a coroutine function with main's services open, on a fresh memory database"""
+
+    def run(test):
+        async def wrapper():
+            await main.init_services()
+            try:
+                return await test()
+            finally:
+                await main.shutdown_services()
+
+        return asyncio.run(wrapper())
+
+    return run
@@ -0,0 +1,86 @@
+"""`python main.py batch` submit/collect round-trip, on the fake provider and fake Notion"""
+
+import asyncio
+
+import pytest
+
+import main
+from batch_api import FakeBatchBackend, make_batch_backends
+from model_router import FakeProvider, ModelRouter, ModelSpec
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    router = ModelRouter([ModelSpec("fake-model", provider="fake")], {"fake": FakeProvider(latency=0)})
+    monkeypatch.setattr(main, "router", router)
+    monkeypatch.setattr(main, "batch_backends", make_batch_backends(router.providers, fake_latency=0))
+    monkeypatch.setattr(main, "BATCH_POLL_INTERVAL", 0)
+    return router
+
+
+def stored_batches():
+    async def read():
+        try:
+            return await main.load_batches()
+        finally:
+            await main.memory_db.close()
+
+    return asyncio.run(read())
+
+
+def test_batch_round_trip(notion, fresh_db, fake_models):
+    pages = [notion.add_page(f"Prompt {i}") for i in range(5)]
+    notion.add_page("Already answered", status="Done", response="Done")
+
+    asyncio.run(main.run_batch([]))
+
+    for i, page_id in enumerate(pages):
+        assert notion.status(page_id) == "Done"
+        assert notion.response_text(page_id) == f"[fake-model] Answer to: Prompt {i}"
+    assert len(main.batch_backends["fake"].batches) == 1
+    assert stored_batches() == []
+
+
+def test_no_wait_then_collect_without_resubmitting(notion, fresh_db, fake_models):
+    page_id = notion.add_page("Answer me later")
+
+    asyncio.run(main.run_batch(["--no-wait"]))
+
+    assert notion.status(page_id) == "Pending"
+    [batch] = stored_batches()
+    assert list(batch["pages"]) == [page_id]
+
+    asyncio.run(main.run_batch([]))
+
+    assert notion.status(page_id) == "Done"
+    assert len(main.batch_backends["fake"].batches) == 1
+    assert stored_batches() == []
+
+
+def test_lost_batch_becomes_dead_letters(notion, fresh_db, fake_models, monkeypatch):
+    page_id = notion.add_page("Lost in transit")
+    asyncio.run(main.run_batch(["--no-wait"]))
+
+    # A new process: the in-memory fake backend no longer knows the batch
+    monkeypatch.setitem(main.batch_backends, "fake", FakeBatchBackend(fake_models.providers["fake"], latency=0))
+    asyncio.run(main.run_batch([]))
+
+    async def dead_letters():
+        try:
+            return await main.memory_db.get_dead_letter_page_ids()
+        finally:
+            await main.memory_db.close()
+
+    assert notion.status(page_id) == "Pending"
+    assert page_id in asyncio.run(dead_letters())
+    assert stored_batches() == []
+
+
+def test_prompts_without_a_batch_model_are_answered_directly(notion, fresh_db, fake_models, monkeypatch):
+    monkeypatch.setattr(main, "batch_backends", {})
+    page_id = notion.add_page("No batch API for this one")
+
+    asyncio.run(main.run_batch([]))
+
+    assert notion.status(page_id) == "Done"
+    assert notion.response_text(page_id) == "[fake-model] Answer to: No batch API for this one"
@@ -0,0 +1,38 @@
+"""Shared work claims (claims.py) as main takes and gives them up"""
+
+import main
+from claims import ClaimStore
+
+
+def test_claims_are_released_when_the_work_is_not_finished(run_bot, monkeypatch, tmp_path):
+    path = str(tmp_path / "claims.db")
+    monkeypatch.setattr(main, "claim_store", ClaimStore(path, "this-instance"))
+
+    async def scenario():
+        other = ClaimStore(path, "other-instance")
+        await other.open()
+        try:
+            # The job is held by a worker of another process sharing the memory database
+            await main.memory_db.upsert_job("page-1", "Prompt")
+            await main.memory_db.claim_job("page-1", "someone-else", 600)
+            skipped = await main.claim_page("page-1", "Prompt")
+            after_skip = await other.claim("page-1")
+
+            job = await main.claim_page("page-2", "Prompt")
+            held = await other.claim("page-2")
+            await main.fail_job("page-2", "Prompt", RuntimeError("boom"))
+            after_failure = await other.claim("page-2")
+
+            await main.claim_page("page-3", "Prompt")
+            await main.finish_claim("page-3")
+            after_finish = await other.claim("page-3")
+        finally:
+            await other.close()
+        return skipped, after_skip, job, held, after_failure, after_finish
+
+    skipped, after_skip, job, held, after_failure, after_finish = run_bot(scenario)
+
+    assert skipped is None and after_skip
+    assert job is not None and not held
+    assert after_failure
+    assert not after_finish  # finished pages stay reserved for CLAIM_DONE_RETENTION
@@ -0,0 +1,113 @@
+"""Edge cases of the shared fence tokenizer and the block naming helpers (code_extractor.py)"""
+
+import asyncio
+
+from code_extractor import code_hash, export_filename, extract_code_blocks, extract_from_stream
+from memory_db import MemoryDB
+
+REPLY = (
+    "Intro line.\n"
+    "```python\n"
+    "def f():\n"
+    "    return 1\n"
+    "```\n"
+    "Between.\n"
+    "~~~c++ {.numberLines}\n"
+    "int main() {}\n"
+    "~~~\n"
+    "Outro.\n"
+)
+
+
+def test_prose_and_blocks_are_separated():
+    text, blocks = extract_code_blocks(REPLY)
+    assert text == "Intro line.\n\nBetween.\n\nOutro."
+    assert blocks == [
+        {"language": "python", "code": "def f():\n    return 1"},
+        {"language": "c++", "code": "int main() {}"},
+    ]
+
+
+def test_fence_on_the_first_line_without_language():
+    assert extract_code_blocks("```\nls -la\n```") == ("", [{"language": "text", "code": "ls -la"}])
+
+
+def test_longer_fence_can_quote_a_shorter_one():
+    reply = "````markdown\n```python\nx = 1\n```\n````\nDone."
+    text, blocks = extract_code_blocks(reply)
+    assert text == "Done."
+    assert blocks == [{"language": "markdown", "code": "```python\nx = 1\n```"}]
+
+
+def test_tilde_block_holds_backtick_fences():
+    _, blocks = extract_code_blocks("~~~\n```\nnot a close\n~~~\n")
+    assert blocks == [{"language": "text", "code": "```\nnot a close"}]
+
+
+def test_fence_with_a_language_does_not_close_a_block():
+    _, blocks = extract_code_blocks("```\na\n```js\nb\n```\n")
+    assert blocks == [{"language": "text", "code": "a\n```js\nb"}]
+
+
+def test_indentation_rules():
+    text, blocks = extract_code_blocks("   ```sh\n   echo hi\n   ```\n    ```\nindented four spaces is prose\n")
+    assert blocks == [{"language": "sh", "code": "echo hi"}]
+    assert "```" in text and "indented four spaces is prose" in text
+
+
+def test_backticks_in_the_info_string_are_inline_code():
+    text, blocks = extract_code_blocks("``` `inline` ```\nstill prose\n")
+    assert blocks == []
+    assert text == "``` `inline` ```\nstill prose"
+
+
+def test_unterminated_fence_runs_to_the_end():
+    text, blocks = extract_code_blocks("Start\n```go\nfunc main() {}\n")
+    assert text == "Start"
+    assert blocks == [{"language": "go", "code": "func main() {}"}]
+
+
+def test_chunk_boundaries_do_not_change_the_result():
+    expected = extract_code_blocks(REPLY)
+    for size in (1, 2, 3, 7, 64):
+        chunks = [REPLY[i:i + size] for i in range(0, len(REPLY), size)]
+        assert extract_from_stream(chunks) == expected
+
+
+def test_notion_format_round_trip():
+    import main
+
+    _, blocks = extract_code_blocks(REPLY)
+    assert extract_code_blocks(main.format_code_output(blocks), notion_format=True)[1] == blocks
+
+
+def test_fence_opening_at_the_end_of_a_prose_line():
+    reply = "Here is the code: ```python\nprint('hi')\n```\nThat's all."
+    assert extract_code_blocks(reply) == (
+        "Here is the code:\n\nThat's all.",
+        [{"language": "python", "code": "print('hi')"}],
+    )
+    assert extract_from_stream(reply[i:i + 5] for i in range(0, len(reply), 5)) == extract_code_blocks(reply)
+
+
+def test_inline_and_mid_line_markers_that_are_not_fences():
+    # Inline code, a multi-word info string and a code line quoting a fence are all left alone
+    reply = "Wrap it in ```` `x` ```` please.\nUse ``` as the fence marker\n```sh\necho '```'\n```\n"
+    text, blocks = extract_code_blocks(reply)
+    assert text == "Wrap it in ```` `x` ```` please.\nUse ``` as the fence marker"
+    assert blocks == [{"language": "sh", "code": "echo '```'"}]
+
+
+def test_stored_and_exported_blocks_share_one_content_hash(tmp_path):
+    async def scenario():
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        await db.add_entry("Hello?", "Here.", "page-1", [{"language": "C++", "code": "int main() {}"}])
+        blocks = await db.get_code_blocks()
+        await db.close()
+        return blocks
+
+    block = asyncio.run(scenario())[0]
+    assert block["hash"] == code_hash("int main() {}")
+    assert export_filename(block["hash"], block["language"]) == code_hash("int main() {}")[:16] + ".cpp"
+    assert export_filename(block["hash"], "brainfuck").endswith(".txt")
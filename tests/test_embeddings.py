@@ -0,0 +1,84 @@
+"""Hashing embedder and semantic ranking (embeddings.py)"""
+
+import asyncio
+
+import numpy as np
+
+import main
+from embeddings import HashingEmbedder, SemanticIndex
+from memory_db import MemoryDB
+
+PROMPTS = [
+    "How do I sort a list of dictionaries by key in Python?",
+    "What is the capital of France?",
+    "Explain how a Python dictionary is implemented",
+    "Best recipe for banana bread",
+]
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = HashingEmbedder(dim=64)
+    first = asyncio.run(embedder.embed(["Sort a list in Python", ""]))
+    second = asyncio.run(HashingEmbedder(dim=64).embed(["Sort a list in Python", ""]))
+    assert first.shape == (2, 64) and first.dtype == np.float32
+    assert np.array_equal(first, second)
+    assert np.isclose(np.linalg.norm(first[0]), 1.0)
+    assert not first[1].any()  # empty text stays a zero vector instead of dividing by zero
+
+
+def test_similar_texts_score_higher():
+    vectors = asyncio.run(HashingEmbedder().embed(["python list sort", "sort a python list", "banana bread recipe"]))
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+def test_semantic_index_ranks_and_persists(tmp_path):
+    async def scenario():
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        index = SemanticIndex(db, HashingEmbedder())
+        ids = []
+        for prompt in PROMPTS:
+            entry_id = await db.add_entry(prompt, "reply", "page")
+            await index.add(entry_id, prompt)
+            ids.append(entry_id)
+        ranked = await index.search("sorting a python list of dictionaries", k=2)
+        floor = await index.search("sorting a python list of dictionaries", k=4, min_score=0.99)
+        index.discard([ids[0]])
+        after_discard = await index.search("sorting a python list of dictionaries", k=1)
+        # A fresh index reads the stored vectors back and embeds entries that have none
+        late = await db.add_entry("Banana bread without eggs", "reply", "page")
+        reloaded = SemanticIndex(db, HashingEmbedder())
+        await reloaded.load()
+        banana = await reloaded.search("banana bread", k=2)
+        await db.close()
+        return ids, ranked, floor, after_discard, late, len(reloaded), banana
+
+    ids, ranked, floor, after_discard, late, size, banana = asyncio.run(scenario())
+
+    assert [entry_id for entry_id, _ in ranked] == [ids[0], ids[2]]
+    assert ranked[0][1] > ranked[1][1]
+    assert floor == []
+    assert after_discard[0][0] == ids[2]
+    assert size == len(PROMPTS) + 1
+    assert {entry_id for entry_id, _ in banana} == {ids[3], late}
+
+
+def test_semantic_context_is_packed_most_similar_first(run_bot, monkeypatch):
+    monkeypatch.setattr(main, "CONTEXT_MODE", "semantic")
+
+    async def scenario():
+        ids = []
+        for prompt in PROMPTS:
+            entry_id = await main.memory_db.add_entry(prompt, "reply", "page")
+            await main.semantic_index.add(entry_id, prompt)
+            ids.append(entry_id)
+        rows = await main.memory_db.get_context_entries(ids=[ids[2], ids[0], ids[3]])
+        # Room for one turn: the most similar (and oldest) entry must win over newer, less similar ones
+        monkeypatch.setattr(main, "CONTEXT_TOKEN_BUDGET", rows[1][2] + rows[1][3] + 10)
+        messages, _, _ = await main.build_context_messages("sorting a python list of dictionaries by key")
+        return rows, messages
+
+    rows, messages = run_bot(scenario)
+
+    assert [row[0] for row in rows] == [PROMPTS[2], PROMPTS[0], PROMPTS[3]]
+    assert [m["content"] for m in messages] == [PROMPTS[0], "reply", "sorting a python list of dictionaries by key"]
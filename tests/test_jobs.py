@@ -0,0 +1,22 @@
+"""The durable jobs table (MemoryDB.upsert_job and friends)"""
+
+import asyncio
+
+from memory_db import MemoryDB
+
+
+def test_a_finished_job_that_is_pending_again_starts_fresh(tmp_path):
+    async def scenario():
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        await db.upsert_job("page-1", "Prompt")
+        await db.save_job_reply("page-1", "Prompt", "Old reply")
+        await db.set_job_state("page-1", "done")
+        reopened = await db.upsert_job("page-1", "Prompt")
+        await db.close()
+        return reopened
+
+    reopened = asyncio.run(scenario())
+
+    assert reopened["state"] == "fetched"
+    assert reopened["reply"] is None and reopened["memory_id"] is None
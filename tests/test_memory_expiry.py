@@ -0,0 +1,55 @@
+"""Memory expiry: MemoryDB.expire_entries and the inactivity reset across tenants"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import main
+from memory_db import MemoryDB
+
+
+def test_each_poll_only_expires_its_own_tenant(run_bot):
+    other = main.make_tenant({"name": "other", "database_id": "other-db", "token": "other-token"})
+    tenants = [main.default_tenant, other]
+
+    async def scenario():
+        await other.response_cache.init()
+        for tenant in tenants:
+            for i in range(3):
+                await tenant.memory_db.add_entry(f"Prompt {i}", "Reply", f"{tenant.name}-{i}")
+        main.activity.last = datetime.now() - timedelta(hours=main.INACTIVITY_RESET_HOURS + 1)
+
+        await main.reset_if_inactive(tenants, expire=[main.default_tenant])
+        counts = [await tenant.memory_db.count() for tenant in tenants]
+        await main.reset_if_inactive(tenants, expire=[other])
+        counts += [await tenant.memory_db.count() for tenant in tenants]
+        cutoffs = [await tenant.memory_db.get_state(main.EXPIRY_CUTOFF_KEY) for tenant in tenants]
+        return counts, cutoffs
+
+    counts, cutoffs = run_bot(scenario)
+
+    assert counts == [0, 3, 0, 0]
+    assert cutoffs == ["", ""]
+
+
+def test_expire_entries_stops_at_the_cutoff_and_keeps_the_newest(tmp_path):
+    async def scenario():
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        ids = [await db.add_entry(f"Prompt {i}", "Reply", f"page-{i}") for i in range(10)]
+        conn = await db.connection()
+        for i, entry_id in enumerate(ids):
+            await conn.execute("UPDATE memory SET timestamp = ? WHERE id = ?", (f"2025-01-{i + 1:02d}T00:00:00", entry_id))
+        await conn.commit()
+        first = await db.expire_entries("2025-01-05", batch_size=2, max_batches=1)
+        rest = await db.expire_entries("2025-01-05", batch_size=2)
+        kept = await db.expire_entries("2025-02-01", keep=3)
+        remaining = await db.count()
+        await db.close()
+        return ids, first, rest, kept, remaining
+
+    ids, first, rest, kept, remaining = asyncio.run(scenario())
+
+    assert first == ids[:2]
+    assert rest == ids[2:4]
+    assert kept == ids[4:7]
+    assert remaining == 3
@@ -0,0 +1,137 @@
+"""Compacted memory entries (summarizer.py, MemoryDB archive) and the memory CLI commands"""
+
+import asyncio
+import os
+
+import pytest
+
+import main
+from code_extractor import code_hash, export_filename
+from extract_code import export_blocks
+from memory_db import FTS_DROP, MemoryDB
+from summarizer import ExtractiveSummarizer
+
+REPLY = (
+    "Use a list comprehension to square the numbers. It is shorter than a loop.\n"
+    "Here is the code: ```python\n"
+    "squares = [n * n for n in numbers]\n"
+    "print(squares)\n"
+    "```\n"
+    "~~~\n"
+    "$ python squares.py\n"
+    "~~~\n"
+    "The result is a new list."
+)
+
+
+def test_summary_replaces_code_blocks_with_placeholders():
+    summary = asyncio.run(ExtractiveSummarizer(max_chars=400).summarize("How do I square a list?", REPLY))
+    assert "squares = " not in summary
+    assert "[python code, 2 lines]" in summary
+    assert "[code, 1 line]" in summary  # a fence without a language
+    assert "list comprehension" in summary
+
+
+def test_entry_command_restores_a_compacted_reply(run_bot, capsys):
+    async def scenario():
+        entry_id = await main.memory_db.add_entry("How do I square a list?", REPLY, "page-1")
+        await main.memory_db.compact_entries([(entry_id, "Use a list comprehension.")])
+        context = await main.memory_db.get_context_entries(ids=[entry_id])
+        return entry_id, context
+
+    entry_id, context = run_bot(scenario)
+    assert context[0][1] == "Use a list comprehension."
+
+    asyncio.run(main.run_cli(["entry", str(entry_id)]))
+    out = capsys.readouterr().out
+    assert f"#{entry_id}" in out
+    assert REPLY in out
+
+
+def test_only_the_newest_compacted_entries_keep_their_archive(run_bot, monkeypatch):
+    monkeypatch.setattr(main, "MEMORY_VERBATIM_ENTRIES", 1)
+    monkeypatch.setattr(main, "MEMORY_ARCHIVE_ENTRIES", 2)
+
+    async def scenario():
+        ids = [await main.memory_db.add_entry(f"Question {i}?", REPLY, f"page-{i}") for i in range(4)]
+        compacted = await main.compact_memory([main.default_tenant])
+        return ids, compacted, [await main.memory_db.get_entry(entry_id) for entry_id in ids]
+
+    ids, compacted, entries = run_bot(scenario)
+    assert compacted == 3
+    # The two oldest lost their archive and keep only the summary; the next one is still restorable
+    assert [entry[2] == REPLY for entry in entries] == [False, False, True, True]
+    assert "[python code, 2 lines]" in entries[0][2]
+
+
+def test_code_export_uses_the_same_file_names_as_extract_code(run_bot, tmp_path):
+    code = "print('hello')\n"
+    run_bot(lambda: main.memory_db.add_entry("Hello world?", REPLY, "page-1", [{"language": "python", "code": code}]))
+
+    asyncio.run(main.run_cli(["code", "--export", str(tmp_path / "cli")]))
+    export_blocks([("reply.md", "python", code)], str(tmp_path / "script"))
+
+    assert os.listdir(tmp_path / "cli") == [export_filename(code_hash(code), "python")]
+    assert os.path.exists(tmp_path / "script" / os.listdir(tmp_path / "cli")[0])
+
+
+def test_search_prints_the_bm25_score(run_bot, capsys):
+    async def scenario():
+        await main.memory_db.add_entry("How do I square a list?", REPLY, "page-1")
+        await main.memory_db.add_entry("How do I sort a dict?", "Use sorted() on its items.", "page-2")
+        return await main.memory_db.search_memory("square")
+
+    results = run_bot(scenario)
+
+    asyncio.run(main.run_cli(["search", "square"]))
+    out = capsys.readouterr().out
+    assert f"#{results[0][5]} {results[0][0]:.4g}:" in out
+    assert " 0.00:" not in out and " -0.00:" not in out
+
+
+@pytest.mark.parametrize("args", [[], ["--tenant"]])
+def test_cli_without_a_command_prints_the_usage(fresh_db, capsys, monkeypatch, args):
+    monkeypatch.setattr(main, "TENANTS_FILE", None)
+
+    asyncio.run(main.run_cli(args))
+
+    assert capsys.readouterr().out.startswith("Usage: python main.py")
+
+
+def test_cli_with_a_tenant_but_no_command_prints_the_usage(fresh_db, capsys, tmp_path, monkeypatch):
+    tenants_file = tmp_path / "tenants.json"
+    tenants_file.write_text('[{"name": "docs", "database_id": "docs-db", "token": "docs-token"}]')
+    monkeypatch.setattr(main, "TENANTS_FILE", str(tenants_file))
+
+    asyncio.run(main.run_cli(["--tenant", "docs"]))
+
+    assert capsys.readouterr().out.startswith("Usage: python main.py")
+
+
+def test_older_search_index_is_rebuilt_without_the_code_column(tmp_path):
+    async def scenario():
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        entry_id = await db.add_entry("How do I square a list?", REPLY, "page-1")
+        conn = await db.connection()
+        # The earlier layout indexed an extra code_blocks column that was never filled
+        for statement in FTS_DROP:
+            await conn.execute(statement)
+        await conn.execute(
+            "CREATE VIRTUAL TABLE memory_fts USING fts5(prompt, response, code_blocks, content='memory', content_rowid='id')"
+        )
+        await conn.commit()
+        await db.close()
+
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        conn = await db.connection()
+        async with conn.execute("SELECT sql FROM sqlite_master WHERE name = 'memory_fts'") as cursor:
+            schema = (await cursor.fetchone())[0]
+        results = await db.search_memory("comprehension")
+        await db.close()
+        return entry_id, schema, results
+
+    entry_id, schema, results = asyncio.run(scenario())
+    assert "code_blocks" not in schema
+    assert [result[5] for result in results] == [entry_id]
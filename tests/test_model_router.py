@@ -0,0 +1,97 @@
+"""Model selection and hedging (model_router.py)"""
+
+import asyncio
+import logging
+import time
+
+import pytest
+
+from model_router import FakeProvider, ModelRouter, ModelSpec, make_providers
+
+MESSAGES = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "What is a closure?"}]
+
+
+def spec(name, provider="fake", **kwargs):
+    return ModelSpec(name, provider=provider, **kwargs)
+
+
+def test_cheapest_fitting_model_wins():
+    router = ModelRouter(
+        [
+            spec("pricey", prompt_cost_per_1k=0.01, completion_cost_per_1k=0.03),
+            spec("tiny", context_tokens=100, max_output_tokens=80),
+            spec("cheap", prompt_cost_per_1k=0.0005, completion_cost_per_1k=0.0015),
+        ],
+        {"fake": FakeProvider(latency=0)},
+    )
+    assert [s.name for s in router.rank(50, 400)] == ["cheap", "pricey"]
+    assert [s.name for s in router.rank(50, 20)] == ["tiny", "cheap", "pricey"]
+
+
+def test_largest_window_when_nothing_fits():
+    router = ModelRouter([spec("small", context_tokens=1000), spec("large", context_tokens=4000)], {"fake": FakeProvider()})
+    assert [s.name for s in router.rank(5000, 100)] == ["large"]
+    assert router.context_tokens() == 4000
+
+
+def test_models_on_missing_providers_are_skipped():
+    router = ModelRouter([spec("gone", provider="nowhere"), spec("here")], {"fake": FakeProvider()})
+    assert [s.name for s in router.models] == ["here"]
+    with pytest.raises(ValueError):
+        ModelRouter([spec("gone", provider="nowhere")], {"fake": FakeProvider()})
+
+
+def test_failures_push_a_model_down_the_ranking():
+    router = ModelRouter([spec("flaky"), spec("steady")], {"fake": FakeProvider()})
+    assert router.rank(10, 100)[0].name == "flaky"  # ties keep the configured order
+    for _ in range(5):
+        router.stats["flaky"].record(1.0, ok=False)
+    assert router.rank(10, 100)[0].name == "steady"
+
+
+def test_completion_records_model_cost_and_stats():
+    router = ModelRouter([spec("m", prompt_cost_per_1k=1.0, completion_cost_per_1k=1.0)], {"fake": FakeProvider(latency=0)})
+    result = asyncio.run(router.complete(MESSAGES, 40, 100, 0.3))
+    assert result.text == "[m] Answer to: What is a closure?"
+    assert result.model == "m"
+    assert result.prompt_tokens == 40  # as counted by the caller, not re-tokenized
+    assert result.cost == pytest.approx((result.prompt_tokens + result.completion_tokens) / 1000)
+    assert len(router.stats["m"]) == 1
+
+
+def hedged_router(hedge_after):
+    return ModelRouter(
+        [
+            spec("slow", provider="slow", prompt_cost_per_1k=0.001),
+            spec("backup", provider="fast", prompt_cost_per_1k=0.01),
+        ],
+        {"slow": FakeProvider(latency=0.3), "fast": FakeProvider(latency=0.01)},
+        hedge_after=hedge_after,
+    )
+
+
+def test_slow_request_is_hedged_on_another_provider():
+    router = hedged_router(0.05)
+    started = time.perf_counter()
+    result = asyncio.run(router.complete(MESSAGES, 40, 100, 0.3))
+    assert result.model == "backup"
+    assert time.perf_counter() - started < 0.25
+    # The cancelled primary still counts as a (lower-bound) latency sample
+    assert len(router.stats["slow"]) == 1 and router.stats["slow"].error_rate() == 0
+
+
+def test_no_hedge_when_disabled_or_the_primary_is_fast():
+    assert asyncio.run(hedged_router(0).complete(MESSAGES, 40, 100, 0.3)).model == "slow"
+    router = hedged_router(5.0)
+    router.providers["slow"].latency = 0.01
+    assert asyncio.run(router.complete(MESSAGES, 40, 100, 0.3)).model == "slow"
+    assert router.providers["fast"].calls == 0
+
+
+def test_only_configured_providers_are_built(caplog):
+    assert set(make_providers([spec("gpt", provider="openai")], anthropic_api_key="key")) == {"openai"}
+    assert set(make_providers([spec("gpt", provider="openai"), spec("stub")])) == {"openai", "fake"}
+    with caplog.at_level(logging.WARNING):
+        providers = make_providers([spec("claude", provider="anthropic")])
+    assert "anthropic" not in providers
+    assert "ANTHROPIC_API_KEY is not set" in caplog.text
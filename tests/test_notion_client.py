@@ -0,0 +1,61 @@
+"""Retries in the pooled Notion client (notion_client.py)"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import rate_limit
+from fake_notion import FakeNotion, create_app
+from notion_client import NotionClient
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limit, "backoff_delay", lambda *args: 0)
+
+
+def call(notion, method, path, **kwargs):
+    async def send():
+        client = NotionClient({}, base_url="http://notion.test/v1", transport=httpx.ASGITransport(app=create_app(notion)), max_attempts=3)
+        try:
+            return await client.request(method, path, **kwargs)
+        finally:
+            await client.close()
+
+    return asyncio.run(send())
+
+
+def test_server_errors_are_retried_for_page_updates():
+    notion = FakeNotion(error_rate=1.0)
+    page_id = notion.add_page("Prompt")
+    res = call(notion, "PATCH", f"/pages/{page_id}", json={"properties": {}})
+    assert res.status_code == 500
+    assert notion.requests["PATCH pages"] == 3
+
+
+def test_server_errors_are_not_retried_for_block_appends():
+    notion = FakeNotion(error_rate=1.0)
+    page_id = notion.add_page("Prompt")
+    res = call(notion, "PATCH", f"/blocks/{page_id}/children", json={"children": []})
+    assert res.status_code == 500
+    assert notion.requests["PATCH blocks"] == 1
+
+
+def test_rate_limited_block_append_is_retried_once_accepted():
+    notion = FakeNotion(rate_limit=100, burst=1)
+    page_id = notion.add_page("Prompt")
+    paragraph = {"type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": "Part 2"}}]}}
+
+    async def append_after_a_read():
+        client = NotionClient({}, base_url="http://notion.test/v1", transport=httpx.ASGITransport(app=create_app(notion)), max_attempts=3)
+        try:
+            await client.get(f"/pages/{page_id}")
+            return await client.patch(f"/blocks/{page_id}/children", json={"children": [paragraph]})
+        finally:
+            await client.close()
+
+    res = asyncio.run(append_after_a_read())
+    assert res.status_code == 200
+    assert notion.requests["429"] >= 1
+    assert notion.children[page_id] == [paragraph]
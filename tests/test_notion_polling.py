@@ -0,0 +1,73 @@
+"""get_pending_prompts and update_response against the local Notion stand-in"""
+
+import main
+
+OLD = "2020-01-01T00:00:00.000Z"
+
+
+def test_full_scan_follows_pagination(notion, run_bot):
+    pending = [notion.add_page(f"Prompt {i}") for i in range(250)]
+    notion.add_page("Answered", status="Done", response="Done already")
+    notion.add_page("Has a response", response="Written by hand")
+
+    pages = run_bot(lambda: main.get_pending_prompts(full_scan=True))
+
+    assert [page["id"] for page in pages] == pending
+    assert notion.requests["POST databases"] == 3
+
+
+def test_only_the_title_property_is_requested(notion, run_bot):
+    notion.add_page("What is a monad?")
+
+    pages = run_bot(lambda: main.get_pending_prompts(full_scan=True))
+
+    assert list(pages[0]["properties"]) == ["Prompt"]
+    assert pages[0]["properties"]["Prompt"]["title"][0]["text"]["content"] == "What is a monad?"
+
+
+def test_incremental_poll_uses_the_last_edited_time_cursor(notion, run_bot):
+    notion.add_page("Seen on the first poll", last_edited_time=OLD)
+
+    async def polls():
+        first = await main.get_pending_prompts()
+        cursor = await main.memory_db.get_state(main.POLL_CURSOR_KEY)
+        stale = notion.add_page("Edited before the cursor", last_edited_time=OLD)
+        fresh = notion.add_page("Edited just now")
+        second = await main.get_pending_prompts()
+        full = await main.get_pending_prompts(full_scan=True)
+        return first, cursor, stale, fresh, second, full
+
+    first, cursor, stale, fresh, second, full = run_bot(polls)
+
+    assert len(first) == 1
+    assert cursor is not None and cursor > OLD
+    assert [page["id"] for page in second] == [fresh]
+    assert stale in [page["id"] for page in full]
+    assert notion.requests["POST databases"] == 3
+
+
+def test_update_response_writes_reply_and_code(notion, run_bot):
+    page_id = notion.add_page("Show me hello world")
+    reply = "Here it is:\n\n```python\nprint('hello')\n```\n\nRun it with python."
+
+    assert run_bot(lambda: main.update_response(page_id, reply))
+
+    assert notion.status(page_id) == "Done"
+    assert notion.response_text(page_id) == "Here it is:\n\nRun it with python."
+    code = notion.pages[page_id]["properties"]["Code Output"]["rich_text"][0]["text"]["content"]
+    assert code.strip() == "// PYTHON CODE BLOCK 1\nprint('hello')"
+    assert notion.requests["PATCH pages"] == 1
+    assert notion.requests["PATCH blocks"] == 0
+
+
+def test_long_reply_overflows_into_one_children_append(notion, run_bot):
+    page_id = notion.add_page("Write an essay")
+    reply = "\n\n".join(f"Paragraph {i}. " + "word " * 150 for i in range(20))
+
+    assert run_bot(lambda: main.update_response(page_id, reply))
+
+    children = notion.children[page_id]
+    assert len(children) > 1
+    assert "[Response continues in" in notion.response_text(page_id)
+    assert notion.requests["PATCH pages"] == 1
+    assert notion.requests["PATCH blocks"] == 1
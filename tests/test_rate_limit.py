@@ -0,0 +1,118 @@
+"""Adaptive rate limiting and retries (rate_limit.py), and how the Notion client uses them"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from notion_client import NotionClient
+from rate_limit import RetryableError, TokenBucket, call_with_retries, parse_retry_after
+
+
+def elapsed(coroutine_fn):
+    async def timed():
+        started = time.monotonic()
+        result = await coroutine_fn()
+        return result, time.monotonic() - started
+
+    return asyncio.run(timed())
+
+
+def test_bucket_allows_a_burst_then_paces_requests():
+    bucket = TokenBucket(rate=50, burst=2)
+
+    async def acquire(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    _, burst = elapsed(lambda: acquire(2))
+    _, paced = elapsed(lambda: acquire(3))
+
+    assert burst < 0.02
+    assert paced >= 0.05
+    assert bucket.stats["acquired"] == 5
+
+
+def test_429_halves_the_rate_and_blocks_until_retry_after():
+    bucket = TokenBucket(rate=100, burst=5)
+    bucket.on_rate_limited(retry_after=0.1)
+
+    _, waited = elapsed(bucket.acquire)
+
+    assert waited >= 0.09
+    assert bucket.rate == 50 and bucket.stats["rate_limited"] == 1
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 100
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-3") == 0.0
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 < parse_retry_after(in_a_minute) <= 60
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_rate_limited_call_waits_retry_after_then_succeeds():
+    bucket = TokenBucket(rate=1000, burst=10)
+    calls = []
+
+    async def fn():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RetryableError("429 Too Many Requests", retry_after=0.1, rate_limited=True)
+        return "ok"
+
+    result, took = elapsed(lambda: call_with_retries(fn, bucket, max_attempts=3))
+
+    assert result == "ok"
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.1
+    assert bucket.stats["rate_limited"] == 1
+    assert took >= 0.1
+
+
+def test_permanent_errors_are_not_retried_and_the_last_error_is_raised():
+    calls = []
+
+    async def permanent():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_retries(permanent, max_attempts=3, classify=lambda e: None))
+    assert len(calls) == 1
+
+    async def always_busy():
+        calls.append(1)
+        raise RetryableError("busy", retry_after=0)
+
+    with pytest.raises(RetryableError):
+        asyncio.run(call_with_retries(always_busy, max_attempts=3))
+    assert len(calls) == 4
+
+
+def test_notion_client_honours_retry_after_on_429():
+    responses = [httpx.Response(429, headers={"Retry-After": "0.1"}), httpx.Response(200, json={"ok": True})]
+    sent = []
+
+    def handler(request):
+        sent.append(time.monotonic())
+        return responses[len(sent) - 1]
+
+    async def get():
+        client = NotionClient({}, base_url="http://notion.test/v1", transport=httpx.MockTransport(handler),
+                              rate_limiter=TokenBucket(rate=1000, burst=10, name="Notion"))
+        try:
+            return await client.get("/pages/page-1")
+        finally:
+            await client.close()
+
+    res = asyncio.run(get())
+
+    assert res.status_code == 200
+    assert len(sent) == 2 and sent[1] - sent[0] >= 0.1
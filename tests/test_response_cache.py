@@ -0,0 +1,116 @@
+"""Response cache hits for repeated prompts (response_cache.py)"""
+
+import asyncio
+
+import pytest
+
+import main
+from memory_db import MemoryDB
+from model_router import FakeProvider, ModelRouter, ModelSpec
+from response_cache import ResponseCache
+
+
+def turn(prompt, reply):
+    return [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}]
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = FakeProvider(latency=0)
+    monkeypatch.setattr(main, "router", ModelRouter([ModelSpec("fake-model", provider="fake")], {"fake": provider}))
+    return provider
+
+
+async def ask(prompt, page_id="page"):
+    """Answer a prompt and remember the exchange, as the bot does"""
+    reply = await main.ask_chatgpt_with_context(prompt)
+    await main.memory_db.add_entry(prompt, reply, page_id)
+    return reply
+
+
+def test_repeated_prompt_hits_once_its_own_exchange_is_in_memory(run_bot, provider):
+    async def ask_twice():
+        await main.memory_db.add_entry("Earlier question", "Earlier answer", "page-0")
+        first = await ask("What is a monad?", "page-1")
+        second = await main.ask_chatgpt_with_context("what is a monad")
+        return first, second
+
+    first, second = run_bot(ask_twice)
+
+    assert second == first
+    assert provider.calls == 1
+    assert main.response_cache.stats["hits"] >= 1
+
+
+def test_follow_up_prompts_only_hit_after_the_same_question(run_bot, provider):
+    async def conversation():
+        await ask("Write quicksort in Python")
+        await ask("Now rewrite it in Rust")
+        await ask("Write an HTTP server in Go")
+        await ask("Now rewrite it in Rust")
+
+    run_bot(conversation)
+
+    assert provider.calls == 4
+
+
+@pytest.mark.parametrize("scope, calls", [("recent", 1), ("context", 2)])
+def test_repeated_prompt_after_the_context_window_slides(run_bot, provider, monkeypatch, scope, calls):
+    monkeypatch.setattr(main.response_cache, "scope", scope)
+
+    async def conversation():
+        for i in range(main.CONTEXT_WINDOW):
+            await main.memory_db.add_entry(f"Question {i}", f"Answer {i}", f"page-{i}")
+        # Its own exchange pushes the oldest turn out of the window
+        first = await ask("What is a monad?")
+        second = await main.ask_chatgpt_with_context("What is a monad?")
+        return first, second
+
+    first, second = run_bot(conversation)
+
+    assert provider.calls == calls
+    if scope == "recent":
+        assert second == first
+
+
+@pytest.mark.parametrize("scope", ["prompt", "context", "recent"])
+def test_what_changes_the_key(tmp_path, scope):
+    async def scenario():
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        cache = ResponseCache(db, scope=scope)
+        await cache.init()
+        before = turn("Earlier question", "Earlier answer")
+        await cache.put("What is a monad?", before, "A monoid in the category of endofunctors.")
+        own = before + turn("What is a monad?", "A monoid...")
+        results = {
+            "own exchange": await cache.get("What is a monad?", own),
+            "later turn": await cache.get("What is a monad?", own + turn("Next", "Reply")),
+            "other history": await cache.get("What is a monad?", turn("Something else", "Entirely")),
+        }
+        await db.close()
+        return results
+
+    results = asyncio.run(scenario())
+
+    reply = "A monoid in the category of endofunctors."
+    assert results["own exchange"] == reply
+    assert results["later turn"] == (None if scope == "recent" else reply)
+    assert results["other history"] == (reply if scope == "prompt" else None)
+
+
+def test_eviction_only_counts_entries_in_its_own_namespace(tmp_path):
+    async def scenario():
+        db = MemoryDB(str(tmp_path / "memory.db"))
+        await db.init()
+        caches = {name: ResponseCache(db.namespaced(name) if name else db, max_entries=2) for name in ("", "other")}
+        await caches[""].init()
+        await caches["other"].put("Other tenant's question", [], "Other tenant's answer")
+        for i in range(3):
+            await caches[""].put(f"Question {i}", [], f"Answer {i}")
+        results = [await caches[""].get(f"Question {i}", []) for i in range(3)]
+        results.append(await caches["other"].get("Other tenant's question", []))
+        await db.close()
+        return results
+
+    assert asyncio.run(scenario()) == [None, "Answer 1", "Answer 2", "Other tenant's answer"]
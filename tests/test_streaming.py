@@ -0,0 +1,44 @@
+"""Streamed replies and the partial previews they leave in Notion (main.stream_chatgpt)"""
+
+import main
+
+MESSAGES = [{"role": "user", "content": "Explain generators"}]
+
+
+class BrokenStream:
+    """A router whose stream delivers some text and is then cut off"""
+
+    async def stream(self, messages, prompt_tokens, max_tokens, temperature, on_delta):
+        on_delta("Generators produce values lazily, one at a time")
+        raise ConnectionError("stream cut off")
+
+
+def test_failed_stream_clears_its_preview(notion, run_bot, monkeypatch):
+    page_id = notion.add_page("Explain generators")
+    monkeypatch.setattr(main, "router", BrokenStream())
+
+    async def scenario():
+        try:
+            await main.stream_chatgpt(MESSAGES, 10, 100, page_id)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("the stream error was swallowed")
+        return await main.fetch_page(page_id)
+
+    page = run_bot(scenario)
+
+    assert notion.requests["PATCH pages"] == 2  # the preview, then clearing it
+    assert notion.response_text(page_id) == ""
+    assert notion.status(page_id) == "Pending"
+    assert main.is_pending(page)
+
+
+def test_leftover_preview_is_recognized_and_still_pending_for_its_job(notion, run_bot):
+    page_id = notion.add_page("Explain generators", response="Generators produce" + main.PARTIAL_SUFFIX)
+
+    page = run_bot(lambda: main.fetch_page(page_id))
+
+    assert main.has_partial_response(page)
+    assert not main.is_pending(page)
+    assert main.is_pending(page, unfinished_job=True)
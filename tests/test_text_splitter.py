@@ -0,0 +1,53 @@
+"""Chunking replies for Notion's rich_text limits (text_splitter.py)"""
+
+import re
+
+from text_splitter import batched, rich_text, split_text
+
+CODE = "```python\n" + "\n".join(f"print({i})  # line {i}" for i in range(40)) + "\n```"
+REPLY = "\n\n".join(
+    [f"Paragraph {i}. " + "Some words in a sentence. " * 12 for i in range(6)] + [CODE] + ["Closing remarks."]
+)
+
+
+def squeeze(text):
+    return re.sub(r"\s+", "", text)
+
+
+def test_short_text_is_one_chunk():
+    assert split_text("  Just a line.  ") == ["Just a line."]
+    assert split_text("") == [""]
+
+
+def test_chunks_respect_the_limit_and_lose_no_content():
+    chunks = split_text(REPLY, limit=500)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert squeeze("".join(chunks)) == squeeze(REPLY)
+
+
+def test_code_block_that_fits_stays_in_one_chunk():
+    chunks = split_text(REPLY, limit=1000)
+
+    assert sum(CODE in chunk for chunk in chunks) == 1
+    assert not any(chunk.count("```") == 1 for chunk in chunks)
+
+
+def test_oversized_paragraphs_break_at_sentences_then_words_then_anywhere():
+    sentences = split_text("First sentence here. Second sentence here. Third one.", limit=25)
+    assert sentences == ["First sentence here.", "Second sentence here.", "Third one."]
+
+    words = split_text("alpha beta gamma delta epsilon", limit=12)
+    assert all(len(chunk) <= 12 for chunk in words)
+    assert " ".join(words) == "alpha beta gamma delta epsilon"
+
+    assert split_text("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_rich_text_items_and_batches():
+    items = rich_text("word " * 1000, limit=2000)
+    assert all(item["type"] == "text" and len(item["text"]["content"]) <= 2000 for item in items)
+    assert len(items) == 3
+
+    assert [len(batch) for batch in batched(list(range(250)))] == [100, 100, 50]
@@ -0,0 +1,49 @@
+"""Token counting and history packing (tokens.py)"""
+
+from tokens import MESSAGE_OVERHEAD, MIN_TRUNCATED_TOKENS, TRUNCATION_MARKER, count_tokens, pack_history
+
+
+def turn(prompt, response):
+    return prompt, response, count_tokens(prompt), count_tokens(response)
+
+
+def cost(row):
+    return row[2] + row[3] + 2 * MESSAGE_OVERHEAD
+
+
+NEWEST = turn("Newest question?", "Short answer.")
+MIDDLE = turn("Middle question?", "A long answer. " * 100)
+OLDEST = turn("Oldest question?", "Old answer.")
+
+
+def test_whole_history_fits_oldest_first():
+    history = [NEWEST, MIDDLE, OLDEST]
+
+    messages, used = pack_history(history, sum(cost(row) for row in history))
+
+    assert [m["content"] for m in messages[::2]] == ["Oldest question?", "Middle question?", "Newest question?"]
+    assert [m["role"] for m in messages[:2]] == ["user", "assistant"]
+    assert used == sum(cost(row) for row in history)
+
+
+def test_first_turn_that_does_not_fit_is_truncated_and_older_ones_dropped():
+    budget = cost(NEWEST) + MIDDLE[2] + 2 * MESSAGE_OVERHEAD + MIN_TRUNCATED_TOKENS + 10
+
+    messages, used = pack_history([NEWEST, MIDDLE, OLDEST], budget)
+
+    assert [m["content"] for m in messages[::2]] == ["Middle question?", "Newest question?"]
+    truncated = messages[1]["content"]
+    assert truncated.endswith(TRUNCATION_MARKER)
+    assert MIDDLE[1].startswith(truncated[:-len(TRUNCATION_MARKER)])
+    assert count_tokens(truncated) <= MIN_TRUNCATED_TOKENS + 10
+    assert used <= budget
+
+
+def test_too_little_room_drops_the_turn_instead_of_truncating_it():
+    budget = cost(NEWEST) + MIDDLE[2] + 2 * MESSAGE_OVERHEAD + MIN_TRUNCATED_TOKENS - 1
+
+    messages, used = pack_history([NEWEST, MIDDLE, OLDEST], budget)
+
+    assert [m["content"] for m in messages] == ["Newest question?", "Short answer."]
+    assert used == cost(NEWEST)
+    assert pack_history([NEWEST], 0) == ([], 0)
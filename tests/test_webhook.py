@@ -0,0 +1,127 @@
+"""The /webhook/notion endpoint in app.py"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from collections import deque
+
+import httpx
+import pytest
+
+import app
+import main
+from fake_notion import FakeNotion, create_app
+from tenants import TenantScheduler
+
+SECRET = "verification-token"
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    page_ids = []
+    monkeypatch.setattr(main, "NOTION_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(main, "enqueue_page_ids", lambda ids, database_id=None: page_ids.extend(ids))
+    monkeypatch.setitem(app.bot_status, "running", True)
+    return page_ids
+
+
+def post(body, signature=None):
+    async def send():
+        headers = {"X-Notion-Signature": signature} if signature else {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://bot.test") as client:
+            return await client.post("/webhook/notion", content=body, headers=headers)
+
+    return asyncio.run(send())
+
+
+def sign(body, secret=SECRET):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def test_signed_event_queues_its_page(queued):
+    body = json.dumps({"type": "page.properties_updated", "entity": {"id": "page-1", "type": "page"}}).encode()
+
+    res = post(body, sign(body))
+
+    assert res.status_code == 202
+    assert res.json() == {"accepted": 1}
+    assert queued == ["page-1"]
+
+
+@pytest.mark.parametrize("signature", [None, "sha256=" + "0" * 64, "signed-with-another-secret"])
+def test_missing_or_wrong_signature_is_rejected(queued, signature):
+    body = json.dumps({"page_ids": ["page-1"]}).encode()
+    if signature == "signed-with-another-secret":
+        signature = sign(body, "another-secret")
+
+    res = post(body, signature)
+
+    assert res.status_code == 401
+    assert queued == []
+
+
+def test_signature_covers_the_exact_body(queued):
+    body = json.dumps({"page_ids": ["page-1"]}).encode()
+
+    res = post(json.dumps({"page_ids": ["page-2"]}).encode(), sign(body))
+
+    assert res.status_code == 401
+    assert queued == []
+
+
+def test_verification_token_is_not_logged(queued, caplog):
+    body = json.dumps({"verification_token": "secret-token-value"}).encode()
+
+    with caplog.at_level(logging.INFO):
+        res = post(body, sign(body))
+
+    assert res.status_code == 202
+    assert "verification token received" in caplog.text
+    assert "secret-token-value" not in caplog.text
+
+
+@pytest.mark.parametrize("secret, warned", [(None, True), (SECRET, False)])
+def test_webhook_mode_without_a_secret_warns_at_startup(monkeypatch, caplog, secret, warned):
+    async def init_services():
+        pass
+
+    monkeypatch.setattr(main, "WEBHOOK_MODE", True)
+    monkeypatch.setattr(main, "NOTION_WEBHOOK_SECRET", secret)
+    monkeypatch.setattr(main, "init_services", init_services)
+    monkeypatch.setattr(app, "start_bot", lambda: None)
+
+    asyncio.run(app.startup_event())
+
+    assert ("without NOTION_WEBHOOK_SECRET" in caplog.text) == warned
+
+
+def test_events_are_routed_to_the_tenant_owning_the_database(run_bot, notion, monkeypatch):
+    other = main.make_tenant({"name": "other", "database_id": "other-db", "token": "other-token"})
+    other_notion = FakeNotion(database_id="other-db")
+    monkeypatch.setattr(other.notion_client, "transport", httpx.ASGITransport(app=create_app(other_notion)))
+    scheduler = TenantScheduler([main.default_tenant, other], None, None)
+    monkeypatch.setattr(main, "tenant_scheduler", scheduler)
+    monkeypatch.setattr(main.default_tenant, "pending", deque())
+    monkeypatch.setattr(main.default_tenant, "queued_ids", set())
+    default_page = notion.add_page("Default prompt")
+    other_pages = [other_notion.add_page(f"Other prompt {i}") for i in range(2)]
+    event = {"type": "page.created", "entity": {"id": other_pages[0], "type": "page"},
+             "data": {"parent": {"id": "other-db", "type": "database"}}}
+
+    async def scenario():
+        await other.notion_client.open()
+        try:
+            return [
+                await main.ingest_page_ids(main.page_ids_from_event(event), main.database_id_from_event(event)),
+                # Without a database in the event, the tenant that can read the page takes it
+                await main.ingest_page_ids([other_pages[1], default_page]),
+                await main.ingest_page_ids([default_page], "unknown-db"),
+            ]
+        finally:
+            await other.notion_client.close()
+
+    assert run_bot(scenario) == [1, 2, 0]
+    assert [page["id"] for page in other.pending] == other_pages
+    assert [page["id"] for page in main.default_tenant.pending] == [default_page]
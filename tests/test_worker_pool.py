@@ -0,0 +1,90 @@
+"""The two-stage generate/write pipeline (worker_pool.py)"""
+
+import asyncio
+
+from worker_pool import PromptWorkerPool
+
+
+def run_pool(pages, generate, write, **options):
+    async def scenario():
+        pool = PromptWorkerPool(generate, write, **options)
+        submitted = [pool.submit(page) for page in pages]
+        stats = await pool.drain()
+        in_flight = pool.in_flight()
+        await pool.stop()
+        return submitted, dict(stats), in_flight
+
+    return asyncio.run(scenario())
+
+
+def test_each_page_is_generated_before_it_is_written():
+    events = []
+
+    async def generate(page):
+        # Later pages finish generating first, so writes complete out of submission order
+        await asyncio.sleep(0.01 * (5 - int(page["id"])))
+        events.append(("generate", page["id"]))
+        return f"reply {page['id']}"
+
+    async def write(page, reply):
+        events.append(("write", page["id"]))
+        assert reply == f"reply {page['id']}"
+        return True
+
+    pages = [{"id": str(i)} for i in range(5)]
+    submitted, stats, in_flight = run_pool(pages, generate, write, openai_concurrency=5, notion_concurrency=2)
+
+    assert submitted == [True] * 5
+    for page in pages:
+        assert events.index(("generate", page["id"])) < events.index(("write", page["id"]))
+    assert [page_id for stage, page_id in events if stage == "write"] != [page["id"] for page in pages]
+    assert stats["processed"] == 5 and stats["failed"] == 0
+    assert stats["last_drain_count"] == 5
+    assert in_flight == 0
+
+
+def test_drain_waits_for_every_page_and_counts_failures():
+    written = []
+    concurrent = peak = 0
+
+    async def generate(page):
+        nonlocal concurrent, peak
+        concurrent += 1
+        peak = max(peak, concurrent)
+        await asyncio.sleep(0.01)
+        concurrent -= 1
+        if page["id"] == "boom":
+            raise RuntimeError("OpenAI failed")
+        return None if page["id"] == "empty" else page["id"]
+
+    async def write(page, reply):
+        await asyncio.sleep(0.01)
+        written.append(reply)
+        return page["id"] != "rejected"
+
+    pages = [{"id": page_id} for page_id in ("a", "boom", "b", "empty", "rejected", "c")]
+    submitted, stats, in_flight = run_pool(pages, generate, write, openai_concurrency=2, notion_concurrency=1)
+
+    assert submitted == [True] * 6
+    assert sorted(written) == ["a", "b", "c", "rejected"]
+    assert stats["processed"] == 3 and stats["failed"] == 3
+    assert peak == 2
+    assert in_flight == 0
+
+
+def test_a_page_already_in_flight_is_not_queued_twice():
+    calls = []
+
+    async def generate(page):
+        calls.append(page["id"])
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def write(page, reply):
+        return True
+
+    submitted, stats, in_flight = run_pool([{"id": "p"}, {"id": "p"}, {"id": "q"}], generate, write)
+
+    assert submitted == [True, False, True]
+    assert calls == ["p", "q"]
+    assert stats["skipped"] == 1 and stats["processed"] == 2
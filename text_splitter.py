@@ -0,0 +1,102 @@
+import re
+
+# Notion rejects any single rich_text item longer than this
+RICH_TEXT_LIMIT = 2000
+# Max blocks in one "append block children" request
+MAX_BLOCKS_PER_REQUEST = 100
+
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _segments(text):
+    """Paragraphs of text, with each fenced code block kept as one segment"""
+    segments = []
+    current = []
+    in_fence = False
+    for line in text.split("\n"):
+        if _FENCE.match(line):
+            if not in_fence and current:
+                segments.append("\n".join(current))
+                current = []
+            current.append(line)
+            if in_fence:
+                segments.append("\n".join(current))
+                current = []
+            in_fence = not in_fence
+        elif in_fence:
+            current.append(line)
+        elif not line.strip():
+            if current:
+                segments.append("\n".join(current))
+                current = []
+        else:
+            current.append(line)
+    if current:
+        segments.append("\n".join(current))
+    return segments
+
+
+def _pieces(segment, limit):
+    """Break one oversized segment at the gentlest boundary that works"""
+    for pattern in ("\n", _SENTENCE_END, " "):
+        parts = segment.split(pattern) if isinstance(pattern, str) else pattern.split(segment)
+        if len(parts) > 1:
+            sep = pattern if isinstance(pattern, str) else " "
+            for part in _pack(parts, limit, sep):
+                if len(part) <= limit:
+                    yield part
+                else:
+                    yield from _pieces(part, limit)
+            return
+    for start in range(0, len(segment), limit):
+        yield segment[start:start + limit]
+
+
+def _pack(parts, limit, sep):
+    """Greedily join parts with sep into strings of at most limit chars (parts may be larger)"""
+    chunk = []
+    size = 0
+    for part in parts:
+        extra = len(part) + (len(sep) if chunk else 0)
+        if chunk and size + extra > limit:
+            yield sep.join(chunk)
+            chunk = []
+            size = 0
+            extra = len(part)
+        chunk.append(part)
+        size += extra
+    if chunk:
+        yield sep.join(chunk)
+
+
+def split_text(text, limit=RICH_TEXT_LIMIT):
+    """Split text into chunks of at most ``limit`` characters.
+
+    Chunks break between paragraphs where possible and keep a fenced code
+    block whole when it fits; oversized paragraphs fall back to line, then
+    sentence, then word boundaries, and only then to a hard cut. Runs in
+    linear time: pieces are collected in lists and joined once.
+    """
+    text = text.strip()
+    if not text:
+        return [""]
+    if len(text) <= limit:
+        return [text]
+    segments = []
+    for segment in _segments(text):
+        if len(segment) <= limit:
+            segments.append(segment)
+        else:
+            segments.extend(_pieces(segment, limit))
+    return [chunk.strip() for chunk in _pack(segments, limit, "\n\n") if chunk.strip()]
+
+
+def rich_text(content, limit=RICH_TEXT_LIMIT):
+    """A rich_text array for content of any length (one item per <= limit chars)"""
+    return [{"type": "text", "text": {"content": part}} for part in split_text(content, limit)]
+
+
+def batched(items, size=MAX_BLOCKS_PER_REQUEST):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,66 @@
+import logging
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken missing, or its encoding file can't be fetched
+    _encoding = None
+    logging.getLogger(__name__).debug("tiktoken unavailable; using ~4 chars/token estimate")
+
+# Per-message framing tokens added by the chat format (role, separators)
+MESSAGE_OVERHEAD = 4
+# Don't bother keeping a truncated turn shorter than this
+MIN_TRUNCATED_TOKENS = 64
+TRUNCATION_MARKER = "\n[...truncated]"
+
+
+def count_tokens(text):
+    """Number of tokens in text (exact with tiktoken, estimated otherwise)"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to at most max_tokens tokens"""
+    if max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        ids = _encoding.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        return _encoding.decode(ids[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def pack_history(history, budget):
+    """Pack past turns into a token budget, most relevant first.
+
+    ``history`` holds (prompt, response, prompt_tokens, response_tokens)
+    rows, most relevant (newest, or most similar) first, with token counts
+    cached by MemoryDB so nothing is re-tokenized here. Whole turns are kept
+    while they fit; the first turn that doesn't fit has its response
+    truncated (if enough room is left) and the less relevant ones are
+    dropped. Returns (chat messages, least relevant first so the most
+    relevant turn sits next to the prompt, and tokens used).
+    """
+    packed = []
+    used = 0
+    for prompt, response, prompt_tokens, response_tokens in history:
+        cost = prompt_tokens + response_tokens + 2 * MESSAGE_OVERHEAD
+        if used + cost <= budget:
+            packed.append((prompt, response))
+            used += cost
+            continue
+        room = budget - used - prompt_tokens - 2 * MESSAGE_OVERHEAD
+        if room >= MIN_TRUNCATED_TOKENS:
+            packed.append((prompt, truncate_to_tokens(response, room - count_tokens(TRUNCATION_MARKER)) + TRUNCATION_MARKER))
+            used += prompt_tokens + room + 2 * MESSAGE_OVERHEAD
+        break
+    messages = []
+    for prompt, response in reversed(packed):
+        messages.append({"role": "user", "content": prompt})
+        messages.append({"role": "assistant", "content": response})
+    return messages, used
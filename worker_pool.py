@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+
+
+class PromptWorkerPool:
+    """Two-stage asyncio pipeline for pending Notion pages.
+
+    Pages flow through a generate queue (OpenAI work, ``openai_concurrency``
+    workers) and a write queue (Notion work, ``notion_concurrency`` workers).
+    A page is only ever in the pipeline once, and its stages always run in
+    order, so per-page ordering holds no matter how wide the pool is.
+    """
+
+    def __init__(self, generate, write, openai_concurrency=4, notion_concurrency=2):
+        self.generate = generate
+        self.write = write
+        self.openai_concurrency = max(1, openai_concurrency)
+        self.notion_concurrency = max(1, notion_concurrency)
+        self._generate_queue = None
+        self._write_queue = None
+        self._workers = []
+        self._in_flight = set()
+        self.stats = {
+            "submitted": 0,
+            "processed": 0,
+            "failed": 0,
+            "skipped": 0,
+            "last_drain_count": 0,
+            "last_drain_seconds": 0.0,
+            "last_drain_rate": 0.0,
+        }
+
+    @property
+    def running(self):
+        return bool(self._workers)
+
+    def start(self):
+        if self.running:
+            return
+        self._generate_queue = asyncio.Queue()
+        self._write_queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._generate_worker(i)) for i in range(self.openai_concurrency)
+        ] + [
+            asyncio.create_task(self._write_worker(i)) for i in range(self.notion_concurrency)
+        ]
+        logging.info(
+            f"Worker pool started: {self.openai_concurrency} OpenAI worker(s), "
+            f"{self.notion_concurrency} Notion writer(s)"
+        )
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._in_flight.clear()
+
+    def submit(self, page):
+        """Queue a page for processing. Returns False if it is already in flight."""
+        self.start()
+        page_id = page["id"]
+        if page_id in self._in_flight:
+            self.stats["skipped"] += 1
+            return False
+        self._in_flight.add(page_id)
+        self.stats["submitted"] += 1
+        self._generate_queue.put_nowait(page)
+        return True
+
+    def in_flight(self):
+        return len(self._in_flight)
+
+    async def drain(self):
+        """Wait until every submitted page has been written and record the drain metric."""
+        if not self.running:
+            return self.stats
+        started = time.monotonic()
+        processed_before = self.stats["processed"] + self.stats["failed"]
+        await self._generate_queue.join()
+        await self._write_queue.join()
+        elapsed = time.monotonic() - started
+        drained = self.stats["processed"] + self.stats["failed"] - processed_before
+        if drained:
+            self.stats["last_drain_count"] = drained
+            self.stats["last_drain_seconds"] = elapsed
+            self.stats["last_drain_rate"] = drained / elapsed if elapsed > 0 else float(drained)
+            logging.info(
+                f"Drained {drained} prompt(s) in {elapsed:.2f}s "
+                f"({self.stats['last_drain_rate']:.2f} prompts/sec)"
+            )
+        return self.stats
+
+    def _finish(self, page_id, ok):
+        self._in_flight.discard(page_id)
+        self.stats["processed" if ok else "failed"] += 1
+
+    async def _generate_worker(self, n):
+        while True:
+            page = await self._generate_queue.get()
+            try:
+                result = await self.generate(page)
+            except Exception as e:
+                logging.error(f"Generate worker {n} failed on page {page['id']}: {e}")
+                self._finish(page["id"], False)
+            else:
+                if result is None:
+                    self._finish(page["id"], False)
+                else:
+                    self._write_queue.put_nowait((page, result))
+            finally:
+                self._generate_queue.task_done()
+
+    async def _write_worker(self, n):
+        while True:
+            page, result = await self._write_queue.get()
+            ok = False
+            try:
+                ok = await self.write(page, result)
+            except Exception as e:
+                logging.error(f"Write worker {n} failed on page {page['id']}: {e}")
+            finally:
+                self._finish(page["id"], bool(ok))
+                self._write_queue.task_done()